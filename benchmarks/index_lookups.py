@@ -0,0 +1,83 @@
+"""
+Measures latency of the hot lookups (load_user, registration check, bid lookups)
+on a seeded database, first without and then with the indexes declared on the models.
+
+Usage: python -m benchmarks.index_lookups [--uri sqlite:////tmp/bench.db] [--users N] ...
+Never point --uri at a database with real data, its tables are dropped.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+
+def measure(name, query, keys, repeat):
+    timings = []
+    for key in keys[:repeat]:
+        start = time.perf_counter()
+        query(*key)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "query": name,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[int(len(timings) * 0.99) - 1] * 1000,
+    }
+
+
+def run(args):
+    from najlepsiaponuka import app, db, db_setup
+    from najlepsiaponuka.models import AuctionRegistration, Bid, User
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.uri
+    with app.app_context():
+        db_setup.create_tables()
+        db_setup.drop_indexes()
+        db_setup.seed_tables(users=args.users,
+                             auctions=args.auctions,
+                             registrations_per_auction=args.registrations,
+                             bids_per_auction=args.bids)
+
+        rnd = random.Random(1)
+        emails = [(email,) for (email,) in db.session.query(User.email).all()]
+        registrations = db.session.query(AuctionRegistration.auction_id, AuctionRegistration.creator_id).all()
+        bids = db.session.query(Bid.auction_id, Bid.creator_id, Bid.price).all()
+        for keys in (emails, registrations, bids):
+            rnd.shuffle(keys)
+
+        queries = {
+            "load_user": lambda email: User.query.filter(User.email == email).first(),
+            "is_registered_on_auction": lambda auction_id, creator_id: AuctionRegistration.query.filter_by(
+                auction_id=auction_id, creator_id=creator_id).first(),
+            "last_bid_current_users": lambda auction_id, creator_id, price: Bid.query.filter_by(
+                auction_id=auction_id, creator_id=creator_id, price=price).first(),
+        }
+        keys = {"load_user": emails, "is_registered_on_auction": registrations, "last_bid_current_users": bids}
+
+        results = []
+        for phase in ("without indexes", "with indexes"):
+            if phase == "with indexes":
+                db_setup.create_missing_indexes()
+            for name, query in queries.items():
+                results.append(dict(phase=phase, **measure(name, query, keys[name], args.repeat)))
+                db.session.rollback()
+
+    for result in results:
+        print(f"{result['phase']:<16} {result['query']:<26} "
+              f"p50 {result['p50_ms']:8.3f} ms   p99 {result['p99_ms']:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default=f"sqlite:///{tempfile.gettempdir()}/najlepsiaponuka_bench.db")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--auctions", type=int, default=10000)
+    parser.add_argument("--registrations", type=int, default=10)
+    parser.add_argument("--bids", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=500)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
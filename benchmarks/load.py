@@ -0,0 +1,331 @@
+"""
+Replays a mix of catalog, detail, bid and data API traffic of logged in users and reports
+latency percentiles, throughput and SQL query counts per endpoint.
+
+The dataset is seeded through db_setup.seed_tables into --uri. The traffic goes to the app
+in this process (test client, SQL queries are counted) or to a running server at --url
+(seed the database the server uses, SQL queries are not visible from here). Each of the
+--concurrency workers logs in as another seeded user and sends --requests / --concurrency
+requests chosen by the --mix weights. The results are saved as JSON with --output, so runs
+can be compared.
+
+Usage: python -m benchmarks.load [--uri sqlite:////tmp/bench.db] [--url http://127.0.0.1:5000]
+       [--users N] [--auctions N] [--requests N] [--concurrency C] [--mix auctions=2,auction_bid=1]
+       [--output results.json] [--no-seed]
+Never point --uri at a database with real data, its tables are dropped unless --no-seed is given.
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+
+PASSWORD = "benchmark123"
+DEFAULT_MIX = {
+    "auctions": 2,
+    "data_auctions": 3,
+    "auction_detail": 3,
+    "auction_bid": 1,
+    "data_bid_auctions": 1,
+}
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class InProcessClient:
+    """Sends requests to the app through its test client and counts their SQL queries."""
+
+    def __init__(self, app, sql_counter):
+        self.client = app.test_client()
+        self.sql_counter = sql_counter
+
+    def request(self, method, path, data=None):
+        self.sql_counter.count = 0
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code, self.sql_counter.count
+
+    def csrf_token(self, path):
+        # CSRF protection is disabled for the in-process app
+        return None
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Sends requests to a running server, keeping the session cookie."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect())
+
+    def _open(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def request(self, method, path, data=None):
+        status, _ = self._open(method, path, data)
+        return status, None
+
+    def csrf_token(self, path):
+        _, body = self._open("GET", path)
+        match = CSRF_PATTERN.search(body.decode("utf-8", "replace"))
+        return match.group(1) if match else None
+
+
+class Workload:
+    """Requests of one virtual user."""
+
+    def __init__(self, client, rnd, state, user, mix):
+        self.client = client
+        self.rnd = rnd
+        self.state = state
+        self.user = user
+        self.names = list(mix)
+        self.weights = list(mix.values())
+
+    def login(self):
+        data = {"email": self.user["email"], "password": PASSWORD}
+        token = self.client.csrf_token("/auth/login")
+        if token:
+            data["csrf_token"] = token
+        status, _ = self.client.request("POST", "/auth/login", data)
+        if status not in (200, 302):
+            raise RuntimeError(f"Login of {self.user['email']} failed with {status}.")
+
+    def _search_args(self):
+        if self.rnd.random() < 0.3:
+            return {"search[value]": self.rnd.choice(self.state.words)}
+        return {}
+
+    def next_request(self):
+        """Returns (endpoint, method, path, data) of the next request."""
+        name = self.rnd.choices(self.names, self.weights)[0]
+        if name == "auction_bid" and self.user["bid_auctions"]:
+            auction_id = self.rnd.choice(self.user["bid_auctions"])
+            data = {"price": str(self.state.next_price(auction_id))}
+            token = self.client.csrf_token(f"/auctionDetail/{auction_id}")
+            if token:
+                data["csrf_token"] = token
+            return name, "POST", f"/auctionBid/{auction_id}", data
+        if name in ("auction_detail", "auction_bid"):
+            # users without a registration only look at the auction
+            return "auction_detail", "GET", f"/auctionDetail/{self.rnd.choice(self.state.auction_ids)}", None
+        if name == "auctions":
+            args = {"q": self.rnd.choice(self.state.words)} if self.rnd.random() < 0.3 else {}
+            return name, "GET", "/auctions?" + urllib.parse.urlencode(args), None
+        if name == "data_auctions":
+            args = dict(self._search_args(), draw=1, start=self.rnd.randrange(10) * 100, length=100)
+            return name, "GET", "/api/data/auctions?" + urllib.parse.urlencode(args), None
+        if name == "data_bid_auctions":
+            return name, "GET", "/api/data/bidAuctions?" + urllib.parse.urlencode({"draw": 1, "length": 100}), None
+        raise ValueError(f"Unknown endpoint {name}.")
+
+
+class SharedState:
+    """Auctions, their prices and search words shared by the virtual users."""
+
+    def __init__(self, auction_ids, prices, words):
+        self.auction_ids = auction_ids
+        self.words = words
+        self._prices = prices
+        self._lock = threading.Lock()
+
+    def next_price(self, auction_id):
+        """Price outbidding the last bid sent to the auction by any virtual user."""
+        with self._lock:
+            price, step = self._prices[auction_id]
+            price += step
+            self._prices[auction_id] = (price, step)
+            return price
+
+
+def load_dataset(args):
+    from najlepsiaponuka import db, db_setup, search
+    from najlepsiaponuka.models import (Auction, AuctionRegistration, AuctionRegistrationState, AuctionState,
+                                        AuctionType, User)
+
+    if not args.no_seed:
+        db_setup.create_tables()
+        db_setup.seed_tables(users=args.users,
+                             auctions=args.auctions,
+                             registrations_per_auction=args.registrations,
+                             bids_per_auction=args.bids,
+                             seed=args.seed,
+                             password=PASSWORD)
+        search.rebuild_index()
+
+    visible = (AuctionState.ACTIVE, AuctionState.CONFIRMED, AuctionState.CLOSED)
+    auctions = db.session.query(Auction.auction_id, Auction.price, Auction.minimal_bid, Auction.type, Auction.state) \
+        .filter(Auction.state.in_(visible)).all()
+    prices = {auction.auction_id: (auction.price, auction.minimal_bid if auction.type == AuctionType.OFFER
+                                   else -auction.minimal_bid)
+              for auction in auctions if auction.state == AuctionState.ACTIVE}
+
+    bid_auctions = defaultdict(list)
+    for auction_id, creator_id in db.session.query(AuctionRegistration.auction_id, AuctionRegistration.creator_id) \
+            .filter(AuctionRegistration.state == AuctionRegistrationState.ALLOWED,
+                    AuctionRegistration.auction_id.in_(list(prices))):
+        bid_auctions[creator_id].append(auction_id)
+
+    rnd = random.Random(args.seed)
+    user_rows = db.session.query(User.user_id, User.email).filter(User.email.like("%@seed.najlepsiaponuka.xyz")).all()
+    users = [{"email": email, "bid_auctions": bid_auctions.get(user_id, [])}
+             for user_id, email in rnd.sample(user_rows, min(args.concurrency, len(user_rows)))]
+    db.session.rollback()
+    return users, SharedState([auction.auction_id for auction in auctions], prices,
+                              [search_word(word) for word in db_setup.SEED_WORDS])
+
+
+def search_word(word):
+    # what users type, a prefix without diacritics
+    from najlepsiaponuka import search
+    return search.fold(word)[:max(3, len(word) - 2)]
+
+
+def run_worker(make_client, user, state, mix, requests, seed, timings, errors):
+    client = make_client()
+    workload = Workload(client, random.Random(seed), state, user, mix)
+    try:
+        workload.login()
+    except Exception as error:
+        errors.append(str(error))
+        return
+    for _ in range(requests):
+        name, method, path, data = workload.next_request()
+        start = time.perf_counter()
+        try:
+            status, queries = client.request(method, path, data)
+        except Exception as error:
+            status, queries = type(error).__name__, None
+        timings[name].append((time.perf_counter() - start, status, queries))
+
+
+def summarize(timings, elapsed):
+    endpoints = {}
+    for name, samples in sorted(timings.items()):
+        latencies = sorted(sample[0] for sample in samples)
+        queries = [sample[2] for sample in samples if sample[2] is not None]
+        endpoints[name] = {
+            "requests": len(samples),
+            "throughput_rps": len(samples) / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "statuses": dict(Counter(str(sample[1]) for sample in samples)),
+            "sql_queries_mean": statistics.fmean(queries) if queries else None,
+            "sql_queries_max": max(queries) if queries else None,
+        }
+    return endpoints
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (text or "").split(",")):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name}, choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def run(args):
+    from sqlalchemy import event
+
+    from najlepsiaponuka import db
+    from najlepsiaponuka.app import app
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.uri
+    app.config["WTF_CSRF_ENABLED"] = False
+    with app.app_context():
+        users, state = load_dataset(args)
+
+        sql_counter = threading.local()
+        if args.url:
+            def make_client():
+                return HttpClient(args.url)
+        else:
+            def count_query(*_):
+                sql_counter.count = getattr(sql_counter, "count", 0) + 1
+
+            event.listen(db.engine, "before_cursor_execute", count_query)
+
+            def make_client():
+                return InProcessClient(app, sql_counter)
+
+        timings = defaultdict(list)
+        errors = []
+        per_worker = args.requests // max(len(users), 1)
+        workers = [threading.Thread(target=run_worker,
+                                    args=(make_client, user, state, args.mix, per_worker, args.seed + i, timings, errors))
+                   for i, user in enumerate(users)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+    endpoints = summarize(timings, elapsed)
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    result = {
+        "started": datetime.datetime.now().isoformat(),
+        "target": args.url or "in-process",
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_s": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed if elapsed else None,
+        "login_errors": errors,
+        "endpoints": endpoints,
+    }
+
+    print(f"{total} requests in {elapsed:.1f} s, {result['throughput_rps']:.1f} requests/s, "
+          f"{len(users) - len(errors)} users logged in")
+    for name, endpoint in endpoints.items():
+        queries = f"{endpoint['sql_queries_mean']:6.1f}" if endpoint["sql_queries_mean"] is not None else "     -"
+        print(f"{name:<18} {endpoint['requests']:>6} req  p50 {endpoint['p50_ms']:8.2f} ms  "
+              f"p99 {endpoint['p99_ms']:8.2f} ms  {endpoint['throughput_rps']:7.1f} req/s  "
+              f"sql {queries}  {endpoint['statuses']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, default=str)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=f"sqlite:///{tempfile.gettempdir()}/najlepsiaponuka_bench.db")
+    parser.add_argument("--url", help="Base URL of a running server, the app runs in this process otherwise.")
+    parser.add_argument("--no-seed", action="store_true", help="Use the data already in --uri.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--auctions", type=int, default=1000)
+    parser.add_argument("--registrations", type=int, default=10)
+    parser.add_argument("--bids", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Weights of the endpoints, e.g. auctions=2,auction_bid=0.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File to save the results as JSON.")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
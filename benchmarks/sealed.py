@@ -0,0 +1,86 @@
+"""
+Measures closing of sealed-bid auctions on a seeded database: revealing the bid counts and
+computing the winners and prices of batches of auctions, as the scheduler does. The
+winners are checked against the highest (OFFER) or lowest (DEMAND) sealed bid computed
+in Python, the earlier bid winning a tie.
+
+Usage: python -m benchmarks.sealed [--uri sqlite:////tmp/bench.db] [--auctions 20000] [--bids 50] ...
+Never point --uri at a database with real data, its tables are dropped.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+
+def expected_winners(rows, types):
+    winners = {}
+    for auction_id, creator_id, price, timestamp, sealed_bid_id in rows:
+        best = winners.get(auction_id)
+        sign = 1 if types[auction_id] == "OFFER" else -1
+        key = (sign * price, (-timestamp.timestamp(), -sealed_bid_id))
+        if best is None or key > best[0]:
+            winners[auction_id] = (key, creator_id, price)
+    return {auction_id: (creator_id, price) for auction_id, (key, creator_id, price) in winners.items()}
+
+
+def run(args):
+    from najlepsiaponuka import app, db, db_setup
+    from najlepsiaponuka.models import Auction, AuctionRules, AuctionState, SealedBid
+    from najlepsiaponuka.scheduler import close_auctions
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.uri
+    with app.app_context():
+        db_setup.create_tables()
+        db_setup.seed_tables(users=max(args.bids * 10, 1000), auctions=args.auctions,
+                             registrations_per_auction=args.bids, bids_per_auction=args.bids)
+        Auction.query.filter_by(rules=AuctionRules.CLOSED) \
+            .update({Auction.state: AuctionState.ACTIVE}, synchronize_session=False)
+        db.session.commit()
+        auction_ids = [auction_id for (auction_id,) in db.session.query(Auction.auction_id)
+                       .filter_by(rules=AuctionRules.CLOSED).order_by(Auction.auction_id)]
+        types = {auction_id: auction_type.name for auction_id, auction_type in
+                 db.session.query(Auction.auction_id, Auction.type).filter_by(rules=AuctionRules.CLOSED)}
+        sealed = db.session.query(SealedBid.auction_id, SealedBid.creator_id, SealedBid.price,
+                                  SealedBid.timestamp, SealedBid.sealed_bid_id).all()
+        print(f"{len(auction_ids)} sealed auctions with {len(sealed)} bids")
+
+        timings = []
+        for i in range(0, len(auction_ids), args.batch_size):
+            batch = auction_ids[i:i + args.batch_size]
+            start = time.perf_counter()
+            db.session.commit()
+            close_auctions(batch)
+            db.session.commit()
+            timings.append(time.perf_counter() - start)
+        print(f"closed in batches of {args.batch_size}: p50 {statistics.median(timings) * 1000:.1f} ms, "
+              f"max {max(timings) * 1000:.1f} ms, total {sum(timings):.2f} s")
+
+        expected = expected_winners(sealed, types)
+        counts = {}
+        for auction_id, *_ in sealed:
+            counts[auction_id] = counts.get(auction_id, 0) + 1
+        mismatches = 0
+        for auction in Auction.query.filter(Auction.auction_id.in_(auction_ids)).yield_per(1000):
+            winner = expected.get(auction.auction_id)
+            if (auction.state != AuctionState.CLOSED
+                    or auction.bid_count != counts.get(auction.auction_id, 0)
+                    or (winner and (auction.winner_id, auction.price) != winner)
+                    or (not winner and auction.winner_id is not None)):
+                mismatches += 1
+        print(f"winners, prices and bid counts checked: {mismatches} mismatches")
+        return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=f"sqlite:///{tempfile.gettempdir()}/najlepsiaponuka_bench.db")
+    parser.add_argument("--auctions", type=int, default=20000)
+    parser.add_argument("--bids", type=int, default=50, help="Sealed bids per auction.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    if run(parser.parse_args()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
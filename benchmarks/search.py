@@ -0,0 +1,87 @@
+"""
+Measures latency of searching the auction catalog, scanning with LIKE and with the search
+index, on a seeded database. A search counts the matching auctions and reads the first page,
+as /api/data/auctions does, optionally with facet counts.
+
+Usage: python -m benchmarks.search [--uri sqlite:////tmp/bench.db] [--auctions 1000000] ...
+Never point --uri at a database with real data, its tables are dropped.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+
+def measure(name, run_query, texts):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        run_query(text)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "query": name,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[max(int(len(timings) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def run(args):
+    from najlepsiaponuka import app, db, db_setup, search
+    from najlepsiaponuka.models import Auction
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.uri
+    with app.app_context():
+        db_setup.create_tables()
+        db_setup.seed_tables(users=1000, auctions=args.auctions, registrations_per_auction=0, bids_per_auction=0)
+        start = time.perf_counter()
+        search.rebuild_index()
+        print(f"indexed {args.auctions} auctions in {time.perf_counter() - start:.1f} s")
+
+        rnd = random.Random(1)
+        # the same vocabulary as the seeded auctions, frequent words are searched more often
+        vocabulary = db_setup.seed_vocabulary()
+        texts = []
+        for _ in range(args.repeat):
+            words = [db_setup.seed_word(rnd, vocabulary) for _ in range(rnd.randint(1, 2))]
+            # users type prefixes, often without diacritics
+            texts.append(" ".join(search.fold(word)[:rnd.randint(3, len(word))] for word in words))
+
+        def like(query, text):
+            for word in text.split():
+                query = query.filter(db.or_(Auction.title.contains(word, autoescape=True),
+                                            Auction.description.contains(word, autoescape=True)))
+            return query
+
+        def page(apply, facets=False):
+            def run_query(text):
+                query = apply(Auction.query, text)
+                query.order_by(None).count()
+                query.order_by(Auction.auction_id).limit(args.page_size).all()
+                if facets:
+                    search.facet_counts(query)
+                db.session.rollback()
+            return run_query
+
+        results = [
+            measure("like", page(like), texts),
+            measure("index", page(search.match), texts),
+            measure("index + facets", page(search.match, facets=True), texts),
+        ]
+
+    for result in results:
+        print(f"{result['query']:<16} p50 {result['p50_ms']:9.3f} ms   p99 {result['p99_ms']:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default=f"sqlite:///{tempfile.gettempdir()}/najlepsiaponuka_bench.db")
+    parser.add_argument("--auctions", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=100)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures the cold start of a server process: the time of importing the application
+(wsgi by default, as gunicorn does) in a fresh interpreter and its peak resident memory,
+and lists the packages which take the longest to import, from python -X importtime.
+
+Usage: python -m benchmarks.startup [--module wsgi] [--repeat 10] [--top 15] [--output results.json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+MEASURE = """
+import json, resource, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_s": elapsed, "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    output = subprocess.run([sys.executable, "-c", MEASURE, module], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_times(module):
+    """Import time in microseconds by top level package, of all its modules."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stderr
+    totals = defaultdict(int)
+    for self_us, name in IMPORTTIME_PATTERN.findall(stderr):
+        # self time, the cumulative time would count nested imports of other packages too
+        totals[name.split(".")[0]] += int(self_us)
+    return totals
+
+
+def run(args):
+    runs = [measure(args.module) for _ in range(args.repeat)]
+    imports = [run["import_s"] * 1000 for run in runs]
+    rss = [run["max_rss_kb"] / 1024 for run in runs]
+    modules = sorted(import_times(args.module).items(), key=lambda item: item[1], reverse=True)
+    result = {
+        "module": args.module,
+        "import_ms": {"p50": statistics.median(imports), "min": min(imports), "max": max(imports)},
+        "max_rss_mb": statistics.median(rss),
+        "slowest_imports_ms": [[name, us / 1000] for name, us in modules[:args.top]],
+    }
+
+    print(f"import {args.module}: p50 {result['import_ms']['p50']:.1f} ms "
+          f"(min {result['import_ms']['min']:.1f}, max {result['import_ms']['max']:.1f}) "
+          f"over {args.repeat} runs, peak RSS {result['max_rss_mb']:.1f} MB")
+    for name, ms in result["slowest_imports_ms"]:
+        print(f"{name:<40} {ms:8.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="wsgi", help="Module imported by the server process.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="Number of the slowest imports listed.")
+    parser.add_argument("--output", help="File to save the results as JSON.")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Measures throughput of rendering image variants, per core and with a pool of workers.
+
+Usage: python -m benchmarks.thumbnails [--images N] [--width 4032 --height 3024] [--workers W]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_images(directory, count, width, height):
+    from PIL import Image
+
+    paths = []
+    for i in range(count):
+        # noise compresses badly, so the files are about as large as phone photos
+        image = Image.effect_noise((width, height), 64 + i % 64).convert("RGB")
+        path = os.path.join(directory, f"photo_{i}.jpg")
+        image.save(path, "JPEG", quality=92)
+        paths.append(path)
+    return paths
+
+
+def render_all(paths, output_dir, workers):
+    from najlepsiaponuka.images import render_variants
+
+    start = time.perf_counter()
+    if workers == 1:
+        for path in paths:
+            render_variants(path, output_dir)
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            list(executor.map(render_variants, paths, [output_dir] * len(paths)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = make_images(directory, args.images, args.width, args.height)
+        size = sum(os.path.getsize(path) for path in paths) / len(paths) / 1e6
+        print(f"{args.images} images {args.width}x{args.height}, {size:.1f} MB on average")
+        for workers in sorted({1, args.workers}):
+            output_dir = tempfile.mkdtemp(dir=directory)
+            elapsed = render_all(paths, output_dir, workers)
+            rate = args.images / elapsed
+            print(f"{workers:>3} worker(s): {rate:7.2f} images/s, {rate / workers:7.2f} images/s per core")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
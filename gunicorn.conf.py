@@ -0,0 +1,61 @@
+"""
+Gunicorn settings of the production server, see wsgi.py.
+
+The master imports the application once (preload_app) and forks the workers, so a
+recycled worker starts without importing anything. On shutdown the workers stop accepting
+connections, finish their requests within graceful_timeout and wait for the bids being
+placed before they exit.
+
+Several workers need an event broker, a response cache and an identity cache shared
+between processes. The defaults, events.PollingBroker, response_cache.MemoryBackend and
+the identity cache with their generation files, are shared, the master refuses to start
+several workers with backends which are not.
+
+A gthread worker serves GUNICORN_THREADS requests at once and every open event stream of
+/auctionDetail/<id>/events holds one of its threads. With many watchers install gevent and
+set GUNICORN_WORKER_CLASS=gevent, a worker then serves up to GUNICORN_WORKER_CONNECTIONS
+connections and a waiting stream costs a greenlet instead of a thread.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# concurrent connections of a gevent worker
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+preload_app = True
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# workers are replaced after this many requests, the jitter keeps them from restarting together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def on_starting(server):
+    from najlepsiaponuka import events, identity, response_cache
+
+    if server.cfg.workers > 1 and not (events.broker.shared and response_cache.backend.shared and identity.shared):
+        # bids and invalidations of one worker would not reach the others
+        raise RuntimeError(f"{server.cfg.workers} workers need an EVENT_BROKER, a RESPONSE_CACHE_BACKEND and an "
+                           f"IDENTITY_GENERATION_FILE shared between processes, set GUNICORN_WORKERS=1 to run a "
+                           f"single worker.")
+
+
+def post_fork(server, worker):
+    import wsgi
+
+    wsgi.after_fork()
+
+
+def worker_exit(server, worker):
+    import wsgi
+
+    wsgi.shutdown(graceful_timeout)
@@ -1,12 +1,20 @@
 import datetime
+import decimal
+import hmac
 
 from . import *
-from flask import flash, redirect, render_template, request, url_for, abort
+from flask import flash, redirect, render_template, request, url_for, abort, Response, stream_with_context, \
+    send_from_directory
 from .forms import RegistrationForm, LoginForm, AuctionForm, UpdateForm, UserManagementForm, AuctionManageForm, BidForm, \
-    secure_filename
+    PASSWORD_SERVICE_BUSY
 from .models import *
+from .bidding import BidRejection, place_bid, place_proxy_bid, reveal_sealed_bids, winning_bids
+from .export import FORMATS, export_bids as bid_export
+from . import database, event_log, events, identity, images, instrumentation, metrics, response_cache, search
+from .passwords import PasswordServiceBusy, hash_password, needs_rehash
+from .paging import paginate
 from flask_login import current_user, login_user, login_required, logout_user
-import os
+from . import commands
 
 
 def redirect_url(default='index'):
@@ -43,7 +51,7 @@ def load_user(email):
     :param user_id: email as email is what user uses as a login username
     :return: return User object
     """
-    return User.query.filter(User.email == email).first()
+    return identity.load_identity(email)
 
 
 @app.route("/")
@@ -57,6 +65,14 @@ def login():
 
     if request.method == "POST":
         if form.validate_on_submit():
+            if needs_rehash(form.user.password):
+                try:
+                    form.user.password = hash_password(form.password.data)
+                    db.session.commit()
+                    identity.invalidate_identity(form.user.email)
+                except PasswordServiceBusy:
+                    # the hash is upgraded on one of the next logins
+                    pass
             user = User(
                 email=form.email.data,
                 password=form.password.data
@@ -74,22 +90,36 @@ def logout():
     return redirect(url_for("index"))
 
 
+def _hash_form_password(field):
+    """
+    Hash of the password of the form field, None when the password service is busy, the
+    form is shown again with the error as login does.
+    """
+    try:
+        return hash_password(field.data)
+    except PasswordServiceBusy:
+        field.errors.append(PASSWORD_SERVICE_BUSY)
+        return None
+
+
 @app.route("/auth/register", methods=["GET", "POST"])
 def register():
     form = RegistrationForm()
 
     if request.method == "POST":
         if form.validate_on_submit():
-            user = User(name=form.name.data,
-                        surname=form.surname.data,
-                        email=form.email.data,
-                        phone=form.phone.data,
-                        password=bcrypt.generate_password_hash(form.password.data),
-                        type="basic"
-                        )
-            db.session.add(user)
-            db.session.commit()
-            return redirect(redirect_url())
+            password = _hash_form_password(form.password)
+            if password:
+                user = User(name=form.name.data,
+                            surname=form.surname.data,
+                            email=form.email.data,
+                            phone=form.phone.data,
+                            password=password,
+                            type="basic"
+                            )
+                db.session.add(user)
+                db.session.commit()
+                return redirect(redirect_url())
 
     return render_template("auth/register.html", form=form)
 
@@ -99,17 +129,34 @@ def register():
 def delete_user(user_id):
     user = User.query.get(user_id)
     if user:
+        email = user.email
         db.session.delete(user)
         db.session.commit()
+        identity.invalidate_identity(email)
     else:
         flash("Užívateľ neexistuje.")
     return redirect(url_for("user_management"))
 
 
 @app.route("/auctions")
+@database.read_only
+@response_cache.cached
 def auctions_controller():
-    auctions = Auction.query.filter(Auction.state.in_([AuctionState.ACTIVE, AuctionState.CLOSED, AuctionState.CONFIRMED])).all()
-    return render_template("auction/auctions.html", auctions=auctions)
+    query = Auction.query.filter(Auction.state.in_([AuctionState.ACTIVE, AuctionState.CLOSED, AuctionState.CONFIRMED]))
+    text = request.args.get("q")
+    if text:
+        query = search.match(query, text)
+    for name, (column, enum) in AUCTION_FILTERS.items():
+        if request.args.get(name):
+            try:
+                query = query.filter(column == enum.coerce(request.args[name]))
+            except ValueError:
+                abort(400)
+    # counting the whole catalog would scan it on every visit
+    facets = search.facet_counts(query) if text else None
+    # the rest of the catalog is paged by /api/data/auctions
+    auctions = query.order_by(Auction.auction_id).limit(app.config.get("DATA_PAGE_SIZE_MAX", 1000)).all()
+    return render_template("auction/auctions.html", auctions=auctions, facets=facets, q=text)
 
 
 @app.route("/auctionDetail/<string:auction_id>", methods=["GET", "POST"])
@@ -125,6 +172,7 @@ def auction_detail(auction_id):
             bid_form.price.data = auction.price - auction.minimal_bid
 
     if request.method == "GET":
+        metrics.auction_views.inc()
         return render_template("auction/auctionDetail.html", auction=auction, bid_form=bid_form)
     elif request.method == "POST" and current_user.is_authenticated:
         if auction.state == AuctionState.CONFIRMED:
@@ -139,6 +187,8 @@ def auction_detail(auction_id):
                 )
                 db.session.add(registration)
                 db.session.commit()
+                response_cache.invalidate()
+                metrics.registrations.inc(state=str(AuctionRegistrationState.CREATED))
             return redirect(url_for("auction_detail", auction_id=auction_id))
         else:
             flash("Na aukciu sa už nedá registrovať.")
@@ -147,6 +197,21 @@ def auction_detail(auction_id):
         return render_template("auction/auctionNotFound.html")
 
 
+@app.route("/auctionDetail/<int:auction_id>/events")
+def auction_events(auction_id):
+    # subscribe before reading the state, so no change in between is missed
+    subscription = events.broker.subscribe(events.auction_channel(auction_id))
+    auction = Auction.query.get(auction_id)
+    if auction is None:
+        subscription.close()
+        abort(404)
+
+    return Response(events.event_stream(subscription, initial=events.auction_state(auction),
+                                        keep_alive=app.config.get("EVENT_KEEP_ALIVE", 15)),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.route("/user/<string:auction_registration_id>/allow")
 @roles_required(UserType.ADMIN, UserType.AUCTIONEER)
 def allow_registration(auction_registration_id):
@@ -154,6 +219,8 @@ def allow_registration(auction_registration_id):
     registration.state = AuctionRegistrationState.ALLOWED
     registration.checked_timestamp = datetime.datetime.now()
     db.session.commit()
+    response_cache.invalidate()
+    metrics.registrations.inc(state=str(AuctionRegistrationState.ALLOWED))
     return redirect(url_for("manage_auction", auction_id=registration.auction_id))
 
 
@@ -164,9 +231,24 @@ def deny_registration(auction_registration_id):
     registration.state = AuctionRegistrationState.FORBIDDEN
     registration.checked_timestamp = datetime.datetime.now()
     db.session.commit()
+    response_cache.invalidate()
+    metrics.registrations.inc(state=str(AuctionRegistrationState.FORBIDDEN))
     return redirect(url_for("manage_auction", auction_id=registration.auction_id))
 
 
+@app.route("/images/<string:filename>")
+def stored_image(filename):
+    digest = images.digest_of(filename)
+    if digest is None or "/" in filename:
+        abort(404)
+    # the content of a name never changes, so it may be cached forever
+    response = send_from_directory(images.store_folder(), filename,
+                                   max_age=images.IMMUTABLE_MAX_AGE, conditional=True, etag=filename)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route("/profile")
 @login_required
 def profile():
@@ -179,6 +261,11 @@ def update_profile():
     form = UpdateForm()
     if request.method == "POST":
         if form.validate_on_submit():
+            # hashed first, a busy password service leaves the user unchanged
+            password = _hash_form_password(form.password) if form.password.data else None
+            if form.password.data and not password:
+                return render_template("profile/updateProfile.html", form=form)
+            email = current_user.email
             if form.name.data:
                 current_user.name = form.name.data
             if form.surname.data:
@@ -187,9 +274,10 @@ def update_profile():
                 current_user.email = form.email.data
             if form.phone.data:
                 current_user.phone = form.phone.data
-            if form.password.data:
-                current_user.password = bcrypt.generate_password_hash(form.password.data)
+            if password:
+                current_user.password = password
             db.session.commit()
+            identity.invalidate_identity(email)
             return redirect(url_for("profile"))
     return render_template("profile/updateProfile.html", form=form)
 
@@ -205,8 +293,12 @@ def auction_management():
 def delete_auction(auction_id):
     auction = Auction.query.filter_by(auction_id=auction_id).first()
     if auction:
+        image = auction.image
+        event_log.record_deleted(auction)
         db.session.delete(auction)
         db.session.commit()
+        response_cache.invalidate()
+        images.release(image)
     else:
         flash("Aukcia neexistuje.")
     return redirect(url_for("auction_management"))
@@ -215,10 +307,16 @@ def delete_auction(auction_id):
 @app.route("/manageAuction/<string:auction_id>", methods=["GET", "POST"])
 @roles_required(UserType.ADMIN, UserType.AUCTIONEER)
 def manage_auction(auction_id):
-    auction = Auction.query.filter_by(auction_id=auction_id).first()
+    query = Auction.query.filter_by(auction_id=auction_id)
+    if request.method == "POST":
+        # a bid committed meanwhile would be missing in the logged state
+        query = query.with_for_update()
+    auction = query.first()
     form = AuctionManageForm()
     if request.method == "GET":
         form.state.data = auction.state
+        form.start_date.data = auction.start_date
+        form.end_date.data = auction.end_date
 
     elif request.method == "POST":
         if form.validate_on_submit():
@@ -226,14 +324,31 @@ def manage_auction(auction_id):
             if auction.state == AuctionState.CONFIRMED:
                 auction.auctioneer_id = current_user.user_id
                 auction.confirmation_timestamp = datetime.datetime.now()
+                # the scheduler activates and closes the auction on these dates
+                auction.start_date = form.start_date.data
+                auction.end_date = form.end_date.data
             elif auction.state == AuctionState.CLOSED:
                 auction.end_date = datetime.datetime.now()
+                reveal_sealed_bids([auction.auction_id])
+                # set in the database by the update above
+                db.session.expire(auction, ["bid_count"])
+                winner = winning_bids([auction.auction_id]).get(auction.auction_id)
+                auction.winner_id = winner[0] if winner else None
+                if winner:
+                    auction.price = winner[1]
             elif auction.state == AuctionState.CREATED:
                 auction.auctioneer_id = None
             elif auction.state == AuctionState.ACTIVE:
                 auction.start_date = datetime.datetime.now()
+                if form.end_date.data:
+                    auction.end_date = form.end_date.data
 
+            event_log.record_state(auction)
+            state = events.auction_state(auction)
             db.session.commit()
+            response_cache.invalidate()
+            metrics.auction_transitions.inc(state=str(auction.state))
+            events.publish_auction_state(state)
             return redirect(url_for("auction_management"))
 
     return render_template("auction/manageAuction.html", form=form, auction=auction)
@@ -268,7 +383,9 @@ def edit_auction(auction_id):
                     auction.type = form.type.data
                 if form.category.data:
                     auction.category = form.category.data
+                search.index_auction(auction)
                 db.session.commit()
+                response_cache.invalidate()
                 flash("Aukcia upravená.")
                 return redirect(url_for("my_auctions"))
         else:
@@ -310,18 +427,22 @@ def create_auction():
                 creator_id=current_user.user_id,
             )
             db.session.add(auction)
+            db.session.flush()
+            event_log.record_created(auction)
             db.session.commit()
 
             flash("Aukcia bola vytvorená.")
+            raw_path = None
             if form.image.data:
-                filename = secure_filename(
-                    f"auction_image_{auction.auction_id}.{form.image.data.filename.rsplit('.')[-1]}")
-                file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                form.image.data.save(file_path)
-                auction.image = f"static/images/{filename}"
+                # the raw upload is shown until the resized variants are rendered
+                raw_path = images.store_upload(auction, form.image.data)
             else:
                 auction.image = "static/images/placeholder.png"
+            search.index_auction(auction)
             db.session.commit()
+            response_cache.invalidate()
+            if raw_path:
+                images.process_upload(auction.auction_id, raw_path, auction.image)
             return redirect(url_for("auction_detail", auction_id=auction.auction_id))
 
     return render_template("auction/createAuction.html", form=form)
@@ -347,6 +468,10 @@ def manage_user():
         id = request.args.get("id", type=int)
         user = User.query.get(id)
         if form.validate_on_submit():
+            password = _hash_form_password(form.password) if form.password.data else None
+            if form.password.data and not password:
+                return render_template("admin/userManage.html", form=form, user=user)
+            email = user.email
             user.type = form.type.data
             if form.name.data:
                 user.name = form.name.data
@@ -356,71 +481,217 @@ def manage_user():
                 user.email = form.email.data
             if form.phone.data:
                 user.phone = form.phone.data
-            if form.password.data:
-                user.password = bcrypt.generate_password_hash(form.password.data)
+            if password:
+                user.password = password
             db.session.commit()
+            identity.invalidate_identity(email)
             return redirect(url_for("user_management"))
 
     return render_template("profile/profile.html")
 
 
+AUCTION_COLUMNS = {
+    "auction_id": Auction.auction_id,
+    "title": Auction.title,
+    "start_price": Auction.start_price,
+    "price": Auction.price,
+    "type": Auction.type,
+    "state": Auction.state,
+    "category": Auction.category,
+    "rules": Auction.rules,
+}
+
+AUCTION_FILTERS = {
+    "state": (Auction.state, AuctionState),
+    "category": (Auction.category, AuctionCategory),
+    "type": (Auction.type, AuctionType),
+    "rules": (Auction.rules, AuctionRules),
+}
+
+
 @app.route("/api/data/editAuctions")
+@database.read_only
 @login_required
 def data_edit_auctions():
-    return {
-        "data": [auction.edit_to_dict() for auction in Auction.query.filter_by(creator_id=current_user.user_id).all()]}
+    page = paginate(Auction.query.filter_by(creator_id=current_user.user_id),
+                    AUCTION_COLUMNS, Auction.auction_id, AUCTION_FILTERS, searchable=[Auction.title])
+    return page.to_dict([auction.edit_to_dict() for auction in page.items])
 
 
 @app.route("/api/data/bidAuctions")
+@database.read_only
 @login_required
 def data_bid_auctions():
+    query = db.session.query(AuctionRegistration, Auction) \
+        .join(Auction, Auction.auction_id == AuctionRegistration.auction_id) \
+        .filter(AuctionRegistration.creator_id == current_user.user_id)
+    page = paginate(query,
+                    dict(AUCTION_COLUMNS, registration_state=AuctionRegistration.state),
+                    AuctionRegistration.auction_registration_id,
+                    dict(AUCTION_FILTERS, registration_state=(AuctionRegistration.state, AuctionRegistrationState)),
+                    searchable=[Auction.title])
     data = []
-    auction_dict = {}
-    regs = AuctionRegistration.query.filter_by(creator_id=current_user.user_id).all()
-    for reg in regs:
-        auction = Auction.query.get(reg.auction_id)
-        if auction:
-            auction_dict = auction.bid_to_dict()
+    for reg, auction in page.items:
+        auction_dict = auction.bid_to_dict()
         auction_dict["registration_state"] = reg.state.value
         data.append(auction_dict)
 
-    return {"data": data }
+    return page.to_dict(data)
 
 
 @app.route("/api/data/joinedAuctions")
+@database.read_only
 @login_required
 def data_joined_auctions():
-    return {
-        "data": [auction.edit_to_dict() for auction in Auction.query.filter_by(creator_id=current_user.user_id).all()]
-    }
+    page = paginate(Auction.query.filter_by(creator_id=current_user.user_id),
+                    AUCTION_COLUMNS, Auction.auction_id, AUCTION_FILTERS, searchable=[Auction.title])
+    return page.to_dict([auction.edit_to_dict() for auction in page.items])
 
 
 @app.route("/api/data/manageAuctions")
+@database.read_only
 @roles_required(UserType.ADMIN, UserType.AUCTIONEER)
 def data_manage_auctions():
-    return {"data": [auction.manage_to_dict() for auction in Auction.query.all() if
-                     auction.creator_id != current_user.user_id and (
-                             auction.auctioneer_id == current_user.user_id or auction.auctioneer_id is None)]}
+    query = Auction.query.filter(Auction.creator_id != current_user.user_id,
+                                 db.or_(Auction.auctioneer_id == current_user.user_id,
+                                        Auction.auctioneer_id.is_(None)))
+    page = paginate(query, AUCTION_COLUMNS, Auction.auction_id, AUCTION_FILTERS, searchable=[Auction.title])
+    return page.to_dict([auction.manage_to_dict() for auction in page.items])
+
+
+def _managed_auction(auction_id):
+    """The auction when the current user may manage it, as listed by data_manage_auctions."""
+    auction = Auction.query.get(auction_id)
+    if auction is None:
+        abort(404)
+    if auction.creator_id == current_user.user_id or auction.auctioneer_id not in (None, current_user.user_id):
+        abort(403)
+    return auction
 
 
 @app.route("/api/data/manageRegistrations/<string:auction_id>")
+@database.read_only
 @roles_required(UserType.ADMIN, UserType.AUCTIONEER)
 def data_auction_registrations(auction_id):
-    return {"data": [registration.registration_to_dict() for registration in
-                     AuctionRegistration.query.filter_by(auction_id=auction_id).all() if
-                     registration.state == AuctionRegistrationState.CREATED]}
+    _managed_auction(auction_id)
+    # the users are joined, not loaded one by one for each registration
+    query = db.session.query(AuctionRegistration, User) \
+        .join(User, User.user_id == AuctionRegistration.creator_id) \
+        .filter(AuctionRegistration.auction_id == auction_id,
+                AuctionRegistration.state == AuctionRegistrationState.CREATED)
+    page = paginate(query,
+                    {"user_id": AuctionRegistration.creator_id, "name": User.name, "surname": User.surname,
+                     "email": User.email},
+                    AuctionRegistration.auction_registration_id,
+                    searchable=[User.name, User.surname, User.email])
+    return page.to_dict([registration.registration_to_dict(user) for registration, user in page.items])
+
+
+REGISTRATION_DECISIONS = {
+    "allow": AuctionRegistrationState.ALLOWED,
+    "deny": AuctionRegistrationState.FORBIDDEN,
+}
+# registration ids per UPDATE, below the bound parameter limits of the databases
+REGISTRATION_BATCH_SIZE = 500
+
+
+def _flag(value):
+    """Boolean of a JSON body field, "false", "0" and "" are false."""
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    text = str(value).lower()
+    if text in ("1", "true", "on", "yes"):
+        return True
+    if text in ("", "0", "false", "off", "no"):
+        return False
+    abort(400)
+
+
+def _registration_ids(values):
+    """Ids of a JSON list, a string is not a list of its characters."""
+    if values is None:
+        return []
+    if not isinstance(values, list):
+        abort(400)
+    ids = set()
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            abort(400)
+        try:
+            ids.add(int(value))
+        except ValueError:
+            abort(400)
+    return sorted(ids)
+
+
+@app.route("/api/manageRegistrations/<int:auction_id>/<string:decision>", methods=["POST"])
+@roles_required(UserType.ADMIN, UserType.AUCTIONEER)
+def bulk_decide_registrations(auction_id, decision):
+    """
+    Allows or denies the registrations of the auction listed in "ids" of the JSON body, or all
+    its pending registrations when "all" is true, in one transaction.
+    """
+    if decision not in REGISTRATION_DECISIONS:
+        abort(404)
+    _managed_auction(auction_id)
+    data = _json_body()
+    values = {AuctionRegistration.state: REGISTRATION_DECISIONS[decision],
+              AuctionRegistration.checked_timestamp: datetime.datetime.now()}
+    query = AuctionRegistration.query.filter(AuctionRegistration.auction_id == auction_id)
+
+    if _flag(data.get("all")):
+        updated = query.filter(AuctionRegistration.state == AuctionRegistrationState.CREATED) \
+            .update(values, synchronize_session=False)
+    else:
+        ids = _registration_ids(data.get("ids"))
+        updated = 0
+        for i in range(0, len(ids), REGISTRATION_BATCH_SIZE):
+            batch = ids[i:i + REGISTRATION_BATCH_SIZE]
+            updated += query.filter(AuctionRegistration.auction_registration_id.in_(batch)) \
+                .update(values, synchronize_session=False)
+    db.session.commit()
+
+    if updated:
+        response_cache.invalidate()
+        metrics.registrations.inc(updated, state=str(REGISTRATION_DECISIONS[decision]))
+    return {"auction_id": auction_id, "state": REGISTRATION_DECISIONS[decision].value, "updated": updated}
 
 
 @app.route("/api/data/users")
+@database.read_only
 @roles_required(UserType.ADMIN)
 def data_users():
-    return {"data": [user.to_dict() for user in User.query.all()]}
+    page = paginate(User.query,
+                    {
+                        "user_id": User.user_id,
+                        "name": User.name,
+                        "surname": User.surname,
+                        "type": User.type,
+                        "phone": User.phone,
+                        "email": User.email,
+                    },
+                    User.user_id,
+                    {"type": (User.type, UserType)},
+                    searchable=[User.name, User.surname, User.email])
+    return page.to_dict([user.to_dict() for user in page.items])
 
 
 @app.route("/api/data/auctions")
+@database.read_only
+@response_cache.cached
 def data_auctions():
+    query = Auction.query.filter(Auction.state.in_([AuctionState.ACTIVE, AuctionState.CLOSED, AuctionState.CONFIRMED]))
+    page = paginate(query, AUCTION_COLUMNS, Auction.auction_id, AUCTION_FILTERS, search=search.match)
+
     data = []
-    for auction in Auction.query.filter(Auction.state.in_([AuctionState.ACTIVE, AuctionState.CLOSED, AuctionState.CONFIRMED])).all():
+    registrations = {}
+    if current_user.is_authenticated and page.items:
+        # one lookup of user's registrations on the page instead of a query per auction
+        registrations = {reg.auction_id: reg for reg in AuctionRegistration.query.filter(
+            AuctionRegistration.creator_id == current_user.user_id,
+            AuctionRegistration.auction_id.in_([auction.auction_id for auction in page.items]))}
+
+    for auction in page.items:
         auction_dict = auction.view_auction_to_dict()
         auction_dict["register_link"] = None
         auction_dict["edit_link"] = None
@@ -435,8 +706,7 @@ def data_auctions():
             auction_dict["registered"] = "moja aukcia"
             auction_dict["edit_link"] = f'/editAuction/{auction.auction_id}'
         else:
-            reg = AuctionRegistration.query.filter_by(auction_id=auction.auction_id,
-                                                      creator_id=current_user.user_id).first()
+            reg = registrations.get(auction.auction_id)
             if not reg:
                 auction_dict["register_link"] = f'/auctionDetail/{auction.auction_id}'
                 auction_dict["registered"] = f'neregistrovaný'
@@ -450,7 +720,10 @@ def data_auctions():
                 auction_dict["registered"] = f'registrovaný'
         data.append(auction_dict)
 
-    return {"data": data}
+    response = page.to_dict(data)
+    if request.args.get("facets"):
+        response["facets"] = search.facet_counts(page.query)
+    return response
 
 
 @app.route("/auctionBid/<string:auction_id>", methods=["POST"])
@@ -462,36 +735,128 @@ def auction_bid(auction_id):
     if request.method == "POST":
 
         if form.validate_on_submit():
-            if not current_user.is_registered_on_auction(auction_id):
-                flash("Nie ste registrovaný na aukciu alebo vaša registrácia nebola schvalená.")
-                return redirect(url_for("auction_detail", auction_id=auction_id))
-            if auction.state != AuctionState.ACTIVE:
-                flash("Aukcia nie je aktívna.")
-                return redirect(url_for("auction_detail", auction_id=auction_id))
-
-            price = form.price.data
-
-            if auction.rules == AuctionRules.OPEN:
-                bid = Bid(price=price,
-                          timestamp=datetime.datetime.now(),
-                          creator_id=current_user.user_id,
-                          auction_id=auction.auction_id)
-
-                db.session.add(bid)
-                auction.price = price
-                flash("Prihodenie prebehlo úspešne.")
-                db.session.commit()
-            elif auction.rules == AuctionRules.CLOSED and not auction.did_user_bid_on_closed(current_user):
-                bid = Bid(price=price,
-                          timestamp=datetime.datetime.now(),
-                          creator_id=current_user.user_id,
-                          auction_id=auction.auction_id)
-                db.session.add(bid)
-                auction.price = price
-                flash("Prihodenie prebehlo úspešne.")
-                db.session.commit()
+            result = place_bid(auction_id, current_user, form.price.data)
+            flash(result.message)
+        elif form.price.errors and form.price.data is not None:
+            # rejected by BidForm.validate_price before reaching place_bid
+            rejection = BidRejection.PRICE_TOO_LOW if auction.is_offer() else BidRejection.PRICE_TOO_HIGH
+            metrics.bids.inc(result=str(rejection))
 
         return redirect(url_for("auction_detail", auction_id=auction_id))
 
     else:
         abort(400)
+
+
+@app.route("/auctionProxyBid/<string:auction_id>", methods=["POST"])
+@login_required
+def auction_proxy_bid(auction_id):
+    auction = Auction.query.get(auction_id)
+    # the price of the form is the limit of the proxy bid
+    form = BidForm(auction=auction)
+    if form.validate_on_submit():
+        flash(place_proxy_bid(auction_id, current_user, form.price.data).message)
+    else:
+        for error in form.price.errors:
+            flash(error)
+    return redirect(url_for("auction_detail", auction_id=auction_id))
+
+
+def _bid_response(result):
+    if result.accepted:
+        return result.to_dict()
+    if result.rejection == BidRejection.AUCTION_NOT_FOUND:
+        return result.to_dict(), 404
+    return result.to_dict(), 409
+
+
+def _json_body():
+    """
+    Object of a JSON request body. Form posts are not accepted, a page of another site can
+    post a form in the session of a logged in user, but not a JSON body.
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    if not isinstance(data, dict):
+        abort(400)
+    return data
+
+
+def _json_price(name):
+    data = _json_body()
+    try:
+        price = decimal.Decimal(str(data[name]))
+        # NaN passes quantize and fails the comparisons of the bid service
+        if not price.is_finite():
+            abort(400)
+        return price.quantize(decimal.Decimal("0.01"))
+    except (KeyError, decimal.InvalidOperation):
+        abort(400)
+
+
+@app.route("/api/auctionBid/<int:auction_id>", methods=["POST"])
+@login_required
+def api_auction_bid(auction_id):
+    return _bid_response(place_bid(auction_id, current_user, _json_price("price")))
+
+
+@app.route("/api/auctionProxyBid/<int:auction_id>", methods=["POST"])
+@login_required
+def api_auction_proxy_bid(auction_id):
+    return _bid_response(place_proxy_bid(auction_id, current_user, _json_price("price_limit")))
+
+
+@app.route("/admin/cacheStats")
+@roles_required(UserType.ADMIN)
+def cache_stats():
+    return dict(identity.stats(), responses=response_cache.stats())
+
+
+@app.route("/admin/requestStats")
+@roles_required(UserType.ADMIN)
+def request_stats():
+    return instrumentation.stats()
+
+
+def _metrics_allowed():
+    """
+    Whether the request may read the metrics: a scraper sending METRICS_TOKEN as its bearer
+    token, or a logged in admin. The address of the client does not tell, behind the reverse
+    proxy every request comes from 127.0.0.1.
+    """
+    token = app.config.get("METRICS_TOKEN")
+    authorization = request.headers.get("Authorization", "")
+    if token and authorization.startswith("Bearer "):
+        return hmac.compare_digest(authorization[len("Bearer "):].encode(), token.encode())
+    # as roles_required, the anonymous user has no type
+    return getattr(current_user, "type", None) == UserType.ADMIN
+
+
+@app.route("/metrics")
+def metrics_exposition():
+    # the metrics are not public
+    if not _metrics_allowed():
+        abort(404)
+    return Response(metrics.registry.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/export/bids")
+@database.read_only
+@roles_required(UserType.ADMIN, UserType.AUCTIONEER)
+def export_bids():
+    format = request.args.get("format", "ndjson")
+    if format not in FORMATS:
+        abort(400)
+    try:
+        since, until = (datetime.datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                        for name in ("since", "until"))
+    except ValueError:
+        abort(400)
+
+    chunks = bid_export(format,
+                        auction_id=request.args.get("auction_id", type=int),
+                        since=since,
+                        until=until)
+    if format == "csv":
+        return Response(stream_with_context(chunks), mimetype="text/csv",
+                        headers={"Content-Disposition": "attachment; filename=bids.csv"})
+    return Response(stream_with_context(chunks), mimetype="application/x-ndjson")
@@ -0,0 +1,380 @@
+"""
+Bid placement service shared by the auctionBid view and the JSON API.
+
+The auction row is locked with SELECT ... FOR UPDATE, so the price check, the
+Bid insert and the price update happen in one short transaction and
+concurrent bidders are serialized on the auction instead of overwriting
+each other.
+
+Bids on auctions with AuctionRules.CLOSED are sealed: they are stored as SealedBid rows
+and leave the price and the bid summary of the auction untouched, so other bidders learn
+nothing about them. The unique index of SealedBid allows one bid per user. Winners,
+prices and bid counts of sealed auctions are revealed when they close.
+
+On open auctions users may set a proxy bid, a limit up to which the engine outbids
+others for them. Competing proxies are resolved in the transaction of the bid which
+triggered them, see resolve_proxies().
+
+Bids are accepted until the end_date of the auction. A bid on an open auction placed
+less than SOFT_CLOSE_WINDOW seconds before it moves end_date to SOFT_CLOSE_EXTENSION
+seconds after the bid, so a last second bid can still be answered.
+"""
+import datetime
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from enum import Enum
+
+from sqlalchemy.exc import IntegrityError
+
+from . import app, db, event_log, events, metrics, response_cache
+from .models import Auction, AuctionRegistration, AuctionRegistrationState, AuctionRules, AuctionState, AuctionType, \
+    Bid, ProxyBid, SealedBid
+
+MINIMAL_STEP = Decimal("0.01")
+
+
+class BidRejection(Enum):
+    AUCTION_NOT_FOUND = "Aukcia neexistuje."
+    NOT_ACTIVE = "Aukcia nie je aktívna."
+    ENDED = "Aukcia už skončila."
+    NOT_REGISTERED = "Nie ste registrovaný na aukciu alebo vaša registrácia nebola schvalená."
+    ALREADY_BID = "Na aukciu ste už prihodili."
+    PROXY_NOT_ALLOWED = "Automatické prihadzovanie je možné len na otvorených aukciách."
+    PRICE_TOO_LOW = "Minimálna výška prihodenia je {minimal_bid}."
+    PRICE_TOO_HIGH = "Minimálna výška sníženia je {minimal_bid}."
+
+    def __str__(self):
+        return self.name.lower()
+
+
+@dataclass
+class BidResult:
+    accepted: bool
+    auction_id: int
+    price: Decimal = None
+    rejection: BidRejection = None
+    minimal_bid: Decimal = None
+    bid_id: int = None
+    leading: bool = None
+    price_limit: Decimal = None
+
+    @property
+    def message(self):
+        if self.accepted:
+            if self.price_limit is not None:
+                return f"Automatické prihadzovanie do {self.price_limit} bolo nastavené."
+            if self.leading is False:
+                return "Prihodenie prebehlo úspešne, automatické prihadzovanie iného užívateľa vás však prehodilo."
+            return "Prihodenie prebehlo úspešne."
+        return self.rejection.value.format(minimal_bid=self.minimal_bid)
+
+    def to_dict(self):
+        return {
+            "accepted": self.accepted,
+            "auction_id": self.auction_id,
+            "price": self.price,
+            "reason": str(self.rejection) if self.rejection else None,
+            "message": self.message,
+            "bid_id": self.bid_id,
+            "leading": self.leading,
+            "price_limit": self.price_limit,
+        }
+
+
+def _reject(auction_id, rejection, auction=None):
+    result = BidResult(accepted=False,
+                       auction_id=auction_id,
+                       rejection=rejection,
+                       price=auction.price if auction else None,
+                       minimal_bid=auction.minimal_bid if auction else None)
+    # releases the row lock
+    db.session.rollback()
+    return result
+
+
+# bids being placed, a shutting down server waits for them in drain()
+_in_flight = 0
+_in_flight_changed = threading.Condition()
+
+
+def drain(timeout=None):
+    """Waits until the bids being placed are finished, returns False when timeout runs out first."""
+    with _in_flight_changed:
+        return _in_flight_changed.wait_for(lambda: _in_flight == 0, timeout)
+
+
+def place_bid(auction_id, user, price, timestamp=None):
+    """
+    Places a bid of user on the auction in a single transaction.
+
+    Whatever is pending in the session is committed first, so the locking
+    read starts a fresh transaction and sees the latest committed price.
+    :return: BidResult describing whether the bid was accepted and why not
+    """
+    return _tracked(_place_bid, auction_id, user, price, timestamp)
+
+
+def place_proxy_bid(auction_id, user, price_limit, timestamp=None):
+    """
+    Sets the proxy bid of user on an open auction and resolves it against the other
+    proxies, in a single transaction like place_bid().
+    :return: BidResult with the price after the resolution
+    """
+    return _tracked(_place_proxy_bid, auction_id, user, price_limit, timestamp)
+
+
+def _tracked(place, *args):
+    global _in_flight
+    with _in_flight_changed:
+        _in_flight += 1
+    try:
+        start = time.perf_counter()
+        result = place(*args)
+        metrics.bid_seconds.observe(time.perf_counter() - start)
+    finally:
+        with _in_flight_changed:
+            _in_flight -= 1
+            _in_flight_changed.notify_all()
+    metrics.bids.inc(result="accepted" if result.accepted else str(result.rejection))
+    return result
+
+
+def _lock_auction(auction_id, user, price, timestamp):
+    """
+    Locks the auction and checks that user may bid price on it at timestamp.
+    :return: the auction and None, or None and the rejected BidResult
+    """
+    db.session.commit()
+
+    auction = Auction.query.filter_by(auction_id=auction_id) \
+        .with_for_update() \
+        .populate_existing() \
+        .first()
+    if auction is None:
+        return None, _reject(auction_id, BidRejection.AUCTION_NOT_FOUND)
+    if auction.state != AuctionState.ACTIVE:
+        return None, _reject(auction_id, BidRejection.NOT_ACTIVE, auction)
+    if auction.end_date is not None and timestamp >= auction.end_date:
+        # ended, but not closed by the scheduler yet
+        return None, _reject(auction_id, BidRejection.ENDED, auction)
+    if not user.is_registered_on_auction(auction.auction_id):
+        return None, _reject(auction_id, BidRejection.NOT_REGISTERED, auction)
+    if not auction.is_acceptable_bid(price):
+        rejection = BidRejection.PRICE_TOO_LOW if auction.is_offer() else BidRejection.PRICE_TOO_HIGH
+        return None, _reject(auction_id, rejection, auction)
+    return auction, None
+
+
+def _add_bid(auction, creator_id, price, timestamp):
+    bid = Bid(price=price,
+              timestamp=timestamp,
+              creator_id=creator_id,
+              auction_id=auction.auction_id)
+    db.session.add(bid)
+    auction.price = price
+    auction.bid_count += 1
+    auction.leading_bidder_id = bid.creator_id
+    auction.leading_bid_timestamp = bid.timestamp
+    _extend_deadline(auction, timestamp)
+    event_log.record_bid(auction, bid)
+    return bid
+
+
+def _extend_deadline(auction, timestamp):
+    window = app.config.get("SOFT_CLOSE_WINDOW", 0)
+    if not window or auction.end_date is None:
+        return
+    if auction.end_date - timestamp <= datetime.timedelta(seconds=window):
+        extended = timestamp + datetime.timedelta(seconds=app.config.get("SOFT_CLOSE_EXTENSION", window))
+        auction.end_date = max(auction.end_date, extended)
+
+
+def _commit_bids(auction, user, bid, price_limit=None):
+    state = events.auction_state(auction)
+    db.session.commit()
+    response_cache.invalidate()
+    events.publish_auction_state(state)
+
+    return BidResult(accepted=True,
+                     auction_id=auction.auction_id,
+                     price=auction.price,
+                     minimal_bid=auction.minimal_bid,
+                     bid_id=bid.bid_id if bid else None,
+                     leading=auction.leading_bidder_id == user.user_id,
+                     price_limit=price_limit)
+
+
+def _place_bid(auction_id, user, price, timestamp):
+    timestamp = timestamp or datetime.datetime.now()
+    auction, rejected = _lock_auction(auction_id, user, price, timestamp)
+    if rejected:
+        return rejected
+    if auction.rules == AuctionRules.CLOSED:
+        return _place_sealed_bid(auction, user, price, timestamp)
+
+    bid = _add_bid(auction, user.user_id, price, timestamp)
+    _resolve_proxies(auction, timestamp)
+    return _commit_bids(auction, user, bid)
+
+
+def _place_proxy_bid(auction_id, user, price_limit, timestamp):
+    timestamp = timestamp or datetime.datetime.now()
+    auction, rejected = _lock_auction(auction_id, user, price_limit, timestamp)
+    if rejected:
+        return rejected
+    if auction.rules == AuctionRules.CLOSED:
+        return _reject(auction_id, BidRejection.PROXY_NOT_ALLOWED, auction)
+
+    # the unique index and the auction lock keep one proxy bid per user
+    proxy = ProxyBid.query.filter_by(auction_id=auction.auction_id, creator_id=user.user_id).first()
+    if proxy is None:
+        proxy = ProxyBid(auction_id=auction.auction_id, creator_id=user.user_id)
+        db.session.add(proxy)
+    # a changed limit loses the precedence of the earlier one on ties
+    proxy.price_limit = price_limit
+    proxy.timestamp = timestamp
+    db.session.flush()
+    bids = _resolve_proxies(auction, timestamp)
+    return _commit_bids(auction, user, bids[-1] if bids else None, price_limit)
+
+
+def resolve_proxies(price, has_bid, leader_id, step, proxies, offer=True):
+    """
+    Computes the bids proxies place against each other in closed form.
+
+    The outcome is the same as if, one bid at a time, the strongest proxy of a user other
+    than the leader whose limit allows it bid the lowest acceptable price, until no proxy
+    could. Only the two strongest proxies ever bid then, alternating with prices step
+    apart, so the number of their bids follows from their limits.
+    :param price: current price of the auction, has_bid tells whether it was bid already
+    :param proxies: (creator_id, price_limit) of the two strongest proxies, the highest limit
+                    for OFFER auctions (the lowest for DEMAND) and the earlier one of equal limits first
+    :return: the last bid of the outbid proxy and the bid of the leading one as (creator_id, price),
+             an empty list when no proxy bids
+    """
+    if not proxies:
+        return []
+    sign = 1 if offer else -1
+    strongest, second = proxies[0], (proxies[1] if len(proxies) > 1 else None)
+    first, other = (second, strongest) if strongest[0] == leader_id else (strongest, second)
+    if first is None:
+        return []
+    start = price + sign * step if has_bid else price
+
+    def bids_allowed(proxy):
+        """Index of the last of the alternating bids whose price proxy allows."""
+        headroom = sign * (proxy[1] - start)
+        return int(headroom // step) + 1 if headroom >= 0 else 0
+
+    # first bids at odd indexes, other at even ones, the first one which can not bid ends it
+    first_allowed = bids_allowed(first)
+    other_allowed = bids_allowed(other) if other else 0
+    first_stops = first_allowed + 1 if first_allowed % 2 == 0 else first_allowed + 2
+    other_stops = other_allowed + 1 if other_allowed % 2 == 1 else other_allowed + 2
+    count = min(first_stops, other_stops) - 1
+    if count == 0:
+        return []
+
+    def bid(index):
+        return (first if index % 2 == 1 else other)[0], start + sign * step * (index - 1)
+
+    return [bid(index) for index in range(max(count - 1, 1), count + 1)]
+
+
+def _resolve_proxies(auction, timestamp):
+    """
+    Places the bids of the proxies outbidding the leader of the locked auction, only proxies
+    of users whose registration is still allowed bid.
+    """
+    limit = ProxyBid.price_limit.desc() if auction.is_offer() else ProxyBid.price_limit
+    proxies = db.session.query(ProxyBid.creator_id, ProxyBid.price_limit) \
+        .join(AuctionRegistration, db.and_(AuctionRegistration.auction_id == ProxyBid.auction_id,
+                                           AuctionRegistration.creator_id == ProxyBid.creator_id)) \
+        .filter(ProxyBid.auction_id == auction.auction_id,
+                AuctionRegistration.state == AuctionRegistrationState.ALLOWED) \
+        .order_by(limit, ProxyBid.timestamp, ProxyBid.proxy_bid_id) \
+        .limit(2) \
+        .all()
+    # a zero step would let two proxies outbid each other forever
+    step = auction.minimal_bid if auction.minimal_bid and auction.minimal_bid > 0 else MINIMAL_STEP
+    return [_add_bid(auction, creator_id, price, timestamp)
+            for creator_id, price in resolve_proxies(auction.price, auction.has_bid(), auction.leading_bidder_id,
+                                                     step, proxies, auction.is_offer())]
+
+
+def _place_sealed_bid(auction, user, price, timestamp):
+    bid = SealedBid(price=price,
+                    timestamp=timestamp,
+                    creator_id=user.user_id,
+                    auction_id=auction.auction_id)
+    db.session.add(bid)
+    event_log.record_sealed_bid(bid)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the unique index of (auction_id, creator_id) instead of checking for an earlier bid,
+        # the failed flush expired the auction, it is reloaded after the rollback
+        db.session.rollback()
+        return _reject(auction.auction_id, BidRejection.ALREADY_BID, auction)
+
+    return BidResult(accepted=True,
+                     auction_id=auction.auction_id,
+                     price=bid.price,
+                     minimal_bid=auction.minimal_bid,
+                     bid_id=bid.sealed_bid_id)
+
+
+def _best_bids(model, auction_ids):
+    best = db.session.query(model.auction_id,
+                            db.func.max(model.price).label("highest"),
+                            db.func.min(model.price).label("lowest")) \
+        .filter(model.auction_id.in_(auction_ids)) \
+        .group_by(model.auction_id) \
+        .subquery()
+    primary_key = model.__mapper__.primary_key[0]
+    rows = db.session.query(model.auction_id, model.creator_id, model.price) \
+        .join(best, best.c.auction_id == model.auction_id) \
+        .join(Auction, Auction.auction_id == model.auction_id) \
+        .filter(db.or_(db.and_(Auction.type == AuctionType.OFFER, model.price == best.c.highest),
+                       db.and_(Auction.type == AuctionType.DEMAND, model.price == best.c.lowest))) \
+        .order_by(model.auction_id, model.timestamp.desc(), primary_key.desc())
+
+    # later rows of an auction are the earlier bids, so they overwrite the later ones
+    return {auction_id: (creator_id, price) for auction_id, creator_id, price in rows}
+
+
+def _leading_bids(auction_ids):
+    """Leading bidders and prices of the open auctions, as the detail page and the event stream show them."""
+    rows = db.session.query(Auction.auction_id, Auction.leading_bidder_id, Auction.price) \
+        .filter(Auction.auction_id.in_(auction_ids), Auction.leading_bidder_id.isnot(None))
+    return {auction_id: (leader_id, price) for auction_id, leader_id, price in rows}
+
+
+def winning_bids(auction_ids):
+    """
+    Finds the winning bid of each of the auctions, open and sealed, in one query each. An
+    open auction is won by its leading bidder, who may have matched the price when
+    minimal_bid is 0. The highest sealed bid wins OFFER auctions, the lowest DEMAND
+    auctions and the earlier bid wins a tie.
+    :return: dict of auction_id to (creator_id, price) of auctions which have a bid
+    """
+    if not auction_ids:
+        return {}
+    winners = _leading_bids(auction_ids)
+    # sealed auctions have no leader, db_setup.upgrade() moves the older bids of sealed auctions
+    winners.update(_best_bids(SealedBid, auction_ids))
+    return winners
+
+
+def reveal_sealed_bids(auction_ids):
+    """
+    Sets the bid count of the auctions with sealed bids among auction_ids in one statement,
+    their prices are set with the winners. The caller commits.
+    """
+    sealed = db.select(db.func.count(SealedBid.sealed_bid_id)) \
+        .where(SealedBid.auction_id == Auction.auction_id) \
+        .scalar_subquery()
+    Auction.query.filter(Auction.auction_id.in_(auction_ids), Auction.rules == AuctionRules.CLOSED) \
+        .update({Auction.bid_count: sealed}, synchronize_session=False)
@@ -0,0 +1,76 @@
+"""
+Flask CLI commands, run as `flask <command>` with FLASK_APP=najlepsiaponuka.app.
+"""
+import json
+
+import click
+
+from . import app, db_setup, event_log, search
+from .export import FORMATS, export_bids
+from .scheduler import AuctionScheduler
+
+
+@app.cli.command("export-bids")
+@click.option("--auction-id", type=int, help="Export only bids of this auction.")
+@click.option("--since", type=click.DateTime(), help="Export bids placed at or after this time.")
+@click.option("--until", type=click.DateTime(), help="Export bids placed before this time.")
+@click.option("--format", "format", type=click.Choice(FORMATS), default="ndjson", show_default=True)
+@click.option("--output", type=click.File("w", encoding="utf-8"), default="-", help="Output file, stdout by default.")
+def export_bids_command(auction_id, since, until, format, output):
+    """Streams the bid history as NDJSON or CSV."""
+    for chunk in export_bids(format, auction_id=auction_id, since=since, until=until):
+        output.write(chunk)
+
+
+@app.cli.command("rebuild-bid-summary")
+def rebuild_bid_summary_command():
+    """Recomputes bid count and leading bid of every auction from the bid history."""
+    db_setup.rebuild_bid_summary()
+
+
+@app.cli.command("run-scheduler")
+@click.option("--interval", type=float, default=1.0, show_default=True, help="Seconds between ticks.")
+@click.option("--batch-size", type=int, default=500, show_default=True, help="Auctions committed per batch.")
+@click.option("--resync-interval", type=float, default=60.0, show_default=True,
+              help="Seconds between reads of the auctions activated or rescheduled by others.")
+def run_scheduler_command(interval, batch_size, resync_interval):
+    """Activates and closes auctions on their start and end dates until interrupted."""
+    AuctionScheduler(batch_size=batch_size, interval=interval, resync_interval=resync_interval).run()
+
+
+@app.cli.command("reindex-search")
+@click.option("--batch-size", type=int, default=10000, show_default=True, help="Auctions indexed per transaction.")
+def reindex_search_command(batch_size):
+    """Rebuilds the search index of auction titles and descriptions."""
+    click.echo(f"Indexed {search.rebuild_index(batch_size)} auctions.")
+
+
+@app.cli.command("replay-auction")
+@click.argument("auction_id", type=int)
+@click.option("--at", type=click.DateTime(), help="Replay the events which happened at or before this time.")
+@click.option("--until-event", type=int, help="Replay the events up to this id.")
+def replay_auction_command(auction_id, at, until_event):
+    """Prints the state of an auction rebuilt from its event log."""
+    snapshot = event_log.replay(auction_id, at=at, until_event_id=until_event)
+    if snapshot is None:
+        raise click.ClickException(f"Auction {auction_id} has no events.")
+    click.echo(json.dumps(snapshot.to_dict(), ensure_ascii=False, indent=2))
+
+
+@app.cli.command("check-event-log")
+@click.option("--batch-size", type=int, default=1000, show_default=True, help="Auctions compared per query.")
+def check_event_log_command(batch_size):
+    """Compares the state replayed from the event log to the auction table."""
+    mismatches = event_log.check(batch_size)
+    for auction_id, field, replayed, stored in mismatches:
+        click.echo(f"auction {auction_id}: {field} is {stored!s} in the table, {replayed!s} in the event log")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} differences found.")
+    click.echo("The event log matches the auction table.")
+
+
+@app.cli.command("backfill-event-log")
+@click.option("--batch-size", type=int, default=10000, show_default=True, help="Auctions logged per transaction.")
+def backfill_event_log_command(batch_size):
+    """Logs the auctions created before the event log from their bids and current state."""
+    click.echo(f"Backfilled {event_log.backfill(batch_size)} auctions.")
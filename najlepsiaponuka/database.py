@@ -0,0 +1,134 @@
+"""
+Read replica routing and statement timeouts of the database connections.
+
+Views marked with @read_only read from the "replica" bind of SQLALCHEMY_BINDS when one is
+configured, everything else, including every flush, goes to the primary. A client which
+wrote to the database reads from the primary for REPLICA_READ_AFTER_WRITE seconds, so it
+sees its own bids and changes even when the replica lags behind.
+
+SELECT statements running longer than SQLALCHEMY_STATEMENT_TIMEOUT_MS are aborted by the
+database (MAX_EXECUTION_TIME on MySQL, statement_timeout on PostgreSQL, a progress
+handler on SQLite). Pool sizing, pre-ping and recycling are set by
+SQLALCHEMY_ENGINE_OPTIONS in instance/config.py and apply to the replica as well, SQLite
+engines, which do not use QueuePool, get them without the pool sizing.
+"""
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from . import app, db
+
+REPLICA_BIND = "replica"
+READ_ONLY_ENDPOINTS = set()
+# options of SQLALCHEMY_ENGINE_OPTIONS taken only by QueuePool
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+def read_only(view):
+    """Marks the view as one reading from the replica, put it below @app.route."""
+    READ_ONLY_ENDPOINTS.add(view.__name__)
+    return view
+
+
+def _has_replica():
+    return REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of read-only views to the replica."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and g.get("use_replica") and not self._flushing:
+            return db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+db.session.session_factory.class_ = RoutingSession
+
+_create_engine = db.create_engine
+
+
+def _create_pooled_engine(sa_url, engine_opts):
+    """Creates the engine without the pool sizing options when it does not use QueuePool."""
+    poolclass = engine_opts.get("poolclass")
+    if poolclass is not None and not issubclass(poolclass, QueuePool):
+        # Flask-SQLAlchemy picks NullPool for SQLite files and StaticPool in memory, both reject them
+        engine_opts = {name: value for name, value in engine_opts.items() if name not in QUEUE_POOL_OPTIONS}
+    return _create_engine(sa_url, engine_opts)
+
+
+db.create_engine = _create_pooled_engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(db_session, flush_context):
+    if has_request_context():
+        g.wrote_database = True
+
+
+@app.before_request
+def _route_request():
+    last_write = session.get("_last_write", 0)
+    g.use_replica = (_has_replica()
+                     and request.endpoint in READ_ONLY_ENDPOINTS
+                     and time.time() - last_write > app.config.get("REPLICA_READ_AFTER_WRITE", 5))
+
+
+@app.after_request
+def _remember_write(response):
+    if g.get("wrote_database"):
+        session["_last_write"] = time.time()
+    return response
+
+
+def _timeout_ms():
+    return app.config.get("SQLALCHEMY_STATEMENT_TIMEOUT_MS")
+
+
+@event.listens_for(Engine, "connect")
+def _set_statement_timeout(dbapi_connection, connection_record):
+    timeout = _timeout_ms()
+    if not timeout:
+        return
+    module = type(dbapi_connection).__module__
+    if module.startswith("sqlite3"):
+        deadline = connection_record.info["statement_deadline"] = [None]
+        # called every 10000 virtual machine instructions, a true result interrupts the statement
+        dbapi_connection.set_progress_handler(lambda: deadline[0] is not None and time.monotonic() > deadline[0],
+                                              10000)
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        if module.startswith(("pymysql", "MySQLdb", "mysql")):
+            cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout)}")
+        elif module.startswith("psycopg2"):
+            cursor.execute(f"SET statement_timeout = {int(timeout)}")
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_deadline(conn, cursor, statement, parameters, context, executemany):
+    deadline = conn.info.get("statement_deadline")
+    if deadline is not None and statement.lstrip()[:6].upper() == "SELECT":
+        # only SELECT, like MAX_EXECUTION_TIME on MySQL
+        deadline[0] = time.monotonic() + _timeout_ms() / 1000
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _clear_deadline(conn, cursor, statement, parameters, context, executemany):
+    deadline = conn.info.get("statement_deadline")
+    if deadline is not None:
+        deadline[0] = None
+
+
+@event.listens_for(Engine, "handle_error")
+def _clear_deadline_on_error(context):
+    if context.connection is not None:
+        deadline = context.connection.info.get("statement_deadline")
+        if deadline is not None:
+            deadline[0] = None
@@ -1,7 +1,33 @@
 import bdb
 import datetime
+import random
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
 from . import *
 from .models import *
+from .passwords import hash_password
+
+# the most frequent words of the seeded titles and descriptions
+SEED_WORDS = ("auto", "bicykel", "stolička", "stôl", "počítač", "notebook", "telefón", "chladnička",
+              "byt", "dom", "pozemok", "lyže", "korčule", "gauč", "skriňa", "oprava", "upratovanie",
+              "nový", "použitý", "zachovalý", "starožitný", "čierny", "biely", "červený", "drevený",
+              "Bratislava", "Košice", "Žilina", "Brno", "záruka", "doprava", "zľava")
+SEED_SYLLABLES = ("ba", "ce", "či", "do", "fe", "go", "há", "ja", "ko", "lú", "ma", "ne", "ôk", "pa", "ri", "sa",
+                  "ši", "to", "uh", "va", "zá", "žu")
+
+
+def seed_vocabulary(size=20000, seed=0):
+    """SEED_WORDS followed by generated words, in order of decreasing frequency."""
+    rnd = random.Random(seed)
+    words = list(SEED_WORDS)
+    while len(words) < size:
+        words.append("".join(rnd.choices(SEED_SYLLABLES, k=rnd.randint(2, 4))))
+    return words
+
+
+def seed_word(rnd, vocabulary):
+    """Random word of vocabulary, the n-th one is about n times rarer than the first (Zipf's law)."""
+    return vocabulary[int(len(vocabulary) ** rnd.random()) - 1]
 
 
 def create_tables():
@@ -14,7 +40,7 @@ def populate_tables():
                  surname="SSS",
                  email="admin@najlepsiaponuka.xyz",
                  phone="123456789",
-                 password=bcrypt.generate_password_hash("adminxbican03").decode("utf-8"),
+                 password=hash_password("adminxbican03"),
                  type=UserType.ADMIN
                  )
 
@@ -22,7 +48,7 @@ def populate_tables():
                  surname="tator",
                  email="licitator@najlepsiaponuka.xyz",
                  phone="123456789",
-                 password=bcrypt.generate_password_hash("licitator123").decode("utf-8"),
+                 password=hash_password("licitator123"),
                  type=UserType.AUCTIONEER
                  )
 
@@ -30,7 +56,7 @@ def populate_tables():
                  surname="user",
                  email="user@najlepsiaponuka.xyz",
                  phone="123456789",
-                 password=bcrypt.generate_password_hash("user123").decode("utf-8"),
+                 password=hash_password("user123"),
                  type=UserType.BASIC
                  )
 
@@ -46,6 +72,191 @@ def create_table(table):
     table.__table__.create(db.session.bind)
 
 
+def add_missing_columns():
+    """Adds columns declared on the models which are missing in existing tables."""
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                spec = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(f"ALTER TABLE {table.name} ADD COLUMN {spec}")
+                added.append(f"{table.name}.{column.name}")
+    db.session.commit()
+    return added
+
+
+def create_missing_indexes():
+    """
+    Creates indexes declared on the models which are missing in an existing database,
+    so the database does not have to be recreated to get them.
+    """
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+
+def drop_indexes():
+    """Drops indexes declared on the models, used to benchmark the unindexed schema."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                index.drop(db.engine)
+
+
+def move_sealed_bids():
+    """
+    Moves the bids of auctions with AuctionRules.CLOSED placed before SealedBid existed from
+    the bid table to sealed_bid, keeping the first bid of each user, in one INSERT ... SELECT
+    and one DELETE. A user who already has a sealed bid keeps only that one.
+    :return: number of moved bids
+    """
+    sealed_auctions = db.select(Auction.auction_id).where(Auction.rules == AuctionRules.CLOSED)
+    earlier = db.aliased(Bid)
+    earlier_bid = db.select(earlier.bid_id) \
+        .where(earlier.auction_id == Bid.auction_id,
+               earlier.creator_id == Bid.creator_id,
+               db.or_(earlier.timestamp < Bid.timestamp,
+                      db.and_(earlier.timestamp == Bid.timestamp, earlier.bid_id < Bid.bid_id))) \
+        .exists()
+    sealed_bid = db.select(SealedBid.sealed_bid_id) \
+        .where(SealedBid.auction_id == Bid.auction_id, SealedBid.creator_id == Bid.creator_id) \
+        .exists()
+    moved = db.session.execute(db.insert(SealedBid).from_select(
+        ["price", "timestamp", "creator_id", "auction_id"],
+        db.select([Bid.price, Bid.timestamp, Bid.creator_id, Bid.auction_id])
+        .where(Bid.auction_id.in_(sealed_auctions), ~earlier_bid, ~sealed_bid)
+        .order_by(Bid.timestamp, Bid.bid_id))).rowcount
+    db.session.execute(db.delete(Bid).where(Bid.auction_id.in_(sealed_auctions))
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    return moved
+
+
+def upgrade():
+    """
+    Brings an existing database up to date with the models without dropping data.
+    :return: added columns, created indexes and the number of bids moved to sealed_bid
+    """
+    db.create_all()
+    return add_missing_columns(), create_missing_indexes(), move_sealed_bids()
+
+
+def rebuild_bid_summary():
+    """
+    Recomputes the bid summary columns of all auctions from the bid tables in one statement,
+    sealed bids are counted only once their auction is closed.
+    """
+    bids = db.select(Bid).where(Bid.auction_id == Auction.auction_id)
+    latest = bids.order_by(Bid.timestamp.desc(), Bid.bid_id.desc()).limit(1)
+    sealed = db.select(db.func.count(SealedBid.sealed_bid_id)).where(SealedBid.auction_id == Auction.auction_id)
+    db.session.execute(db.update(Auction).values(
+        bid_count=bids.with_only_columns([db.func.count(Bid.bid_id)]).scalar_subquery()
+        + db.case((db.and_(Auction.rules == AuctionRules.CLOSED, Auction.state == AuctionState.CLOSED),
+                   sealed.scalar_subquery()), else_=0),
+        leading_bidder_id=latest.with_only_columns([Bid.creator_id]).scalar_subquery(),
+        leading_bid_timestamp=latest.with_only_columns([Bid.timestamp]).scalar_subquery(),
+    ))
+    db.session.commit()
+
+
+def _insert_chunked(table, rows, chunk_size=10000):
+    for i in range(0, len(rows), chunk_size):
+        db.session.execute(table.__table__.insert(), rows[i:i + chunk_size])
+    db.session.commit()
+
+
+def seed_tables(users=1000, auctions=1000, registrations_per_auction=10, bids_per_auction=20, seed=0,
+                password=None):
+    """
+    Populates the tables with a synthetic dataset of the given size.
+    Seeded users can log in only when password is given, it is hashed once for all of them.
+    """
+    rnd = random.Random(seed)
+    now = datetime.datetime.now()
+    password_hash = hash_password(password) if password else ""
+
+    first_user = (db.session.query(db.func.max(User.user_id)).scalar() or 0) + 1
+    _insert_chunked(User, [{
+        "user_id": first_user + i,
+        "type": UserType.AUCTIONEER if i % 50 == 0 else UserType.BASIC,
+        "name": f"user{first_user + i}",
+        "surname": "seed",
+        "phone": "+421900000000",
+        "email": f"user{first_user + i}@seed.najlepsiaponuka.xyz",
+        "password": password_hash,
+    } for i in range(users)])
+    user_ids = range(first_user, first_user + users)
+
+    first_auction = (db.session.query(db.func.max(Auction.auction_id)).scalar() or 0) + 1
+    vocabulary = seed_vocabulary()
+    auction_rows = []
+    for i in range(auctions):
+        auction_type = rnd.choice(list(AuctionType))
+        auction_rows.append({
+            "auction_id": first_auction + i,
+            "price": 1000,
+            "start_price": 1000,
+            "minimal_bid": 1,
+            "title": " ".join(seed_word(rnd, vocabulary) for _ in range(3)).capitalize(),
+            "description": " ".join(seed_word(rnd, vocabulary) for _ in range(20)),
+            "rules": rnd.choice(list(AuctionRules)),
+            "type": auction_type,
+            "state": rnd.choice(list(AuctionState)),
+            "category": rnd.choice(list(AuctionCategory)),
+            "image": "static/images/placeholder.png",
+            "creator_id": rnd.choice(user_ids),
+            "creation_timestamp": now,
+        })
+    registration_rows = []
+    bid_rows = []
+    sealed_bid_rows = []
+    for auction in auction_rows:
+        bidders = rnd.sample(user_ids, min(registrations_per_auction, users))
+        for user_id in bidders:
+            registration_rows.append({
+                "auction_id": auction["auction_id"],
+                "creator_id": user_id,
+                "state": rnd.choice(list(AuctionRegistrationState)),
+                "creation_timestamp": now,
+            })
+        if not bidders:
+            continue
+        step = 1 if auction["type"] == AuctionType.OFFER else -1
+        if auction["rules"] == AuctionRules.CLOSED:
+            # one sealed bid per bidder, the price of the auction stays hidden
+            for i, user_id in enumerate(rnd.sample(bidders, min(bids_per_auction, len(bidders)))):
+                sealed_bid_rows.append({
+                    "price": auction["price"] + step * rnd.randint(0, 10 * bids_per_auction),
+                    "timestamp": now + datetime.timedelta(seconds=i),
+                    "creator_id": user_id,
+                    "auction_id": auction["auction_id"],
+                })
+            continue
+        for i in range(bids_per_auction):
+            auction["price"] += step
+            bid_rows.append({
+                "price": auction["price"],
+                "timestamp": now + datetime.timedelta(seconds=i),
+                "creator_id": rnd.choice(bidders),
+                "auction_id": auction["auction_id"],
+            })
+    _insert_chunked(Auction, auction_rows)
+    _insert_chunked(AuctionRegistration, registration_rows)
+    _insert_chunked(Bid, bid_rows)
+    _insert_chunked(SealedBid, sealed_bid_rows)
+    rebuild_bid_summary()
+
+
 def main():
     create_tables()
     populate_tables()
@@ -0,0 +1,216 @@
+"""
+Append-only log of auction bids and state changes, and its replay.
+
+Every change of the bid summary or the state of an auction appends an AuctionEvent in the
+transaction of the change, so the log and the Auction table can not disagree after a
+crash. Bids, the frequent events, fill only the bidder, price, timestamp and end_date
+columns. STATE events are written on transitions and carry the state, price, bid count,
+end_date and winner the auction got. Event ids grow in the order the events were written,
+bids of one auction are serialized by its row lock, so its events are in the order of
+its changes.
+
+replay() rebuilds the state of an auction at any point in time, check() compares the
+replayed state of all auctions to the Auction table. Auctions older than the log get their
+events from backfill(), from the bid history and their current state.
+"""
+import datetime
+from dataclasses import asdict, dataclass
+
+from . import db
+from .models import Auction, AuctionEvent, AuctionEventKind, AuctionState, Bid, SealedBid
+
+# columns of Auction compared by check()
+CHECKED_FIELDS = ("state", "price", "bid_count", "leading_bidder_id", "leading_bid_timestamp", "winner_id",
+                  "end_date")
+
+
+def _append(auction_id, kind, timestamp=None, **fields):
+    db.session.add(AuctionEvent(auction_id=auction_id,
+                                kind=kind,
+                                timestamp=timestamp or datetime.datetime.now(),
+                                **fields))
+
+
+def record_created(auction):
+    """Logs a new auction, it has to be flushed to have an id."""
+    _append(auction.auction_id, AuctionEventKind.CREATED, auction.creation_timestamp,
+            price=auction.price, state=auction.state)
+
+
+def record_bid(auction, bid):
+    """Logs a bid after it was applied to the auction."""
+    _append(auction.auction_id, AuctionEventKind.BID, bid.timestamp,
+            user_id=bid.creator_id, price=bid.price, end_date=auction.end_date)
+
+
+def record_sealed_bid(bid):
+    _append(bid.auction_id, AuctionEventKind.SEALED_BID, bid.timestamp, user_id=bid.creator_id, price=bid.price)
+
+
+def record_state(auction):
+    """Logs the state an auction got, after the change was applied to it."""
+    _append(auction.auction_id, AuctionEventKind.STATE,
+            user_id=auction.winner_id, price=auction.price, state=auction.state, end_date=auction.end_date,
+            bid_count=auction.bid_count)
+
+
+def record_states(auction_ids):
+    """Logs the state of the auctions in one INSERT ... SELECT, after a bulk update of them."""
+    columns = [AuctionEvent.auction_id, AuctionEvent.kind, AuctionEvent.timestamp, AuctionEvent.user_id,
+               AuctionEvent.price, AuctionEvent.state, AuctionEvent.end_date, AuctionEvent.bid_count]
+    select = db.select([Auction.auction_id,
+                        db.literal(AuctionEventKind.STATE.name),
+                        db.literal(datetime.datetime.now()),
+                        Auction.winner_id, Auction.price, Auction.state, Auction.end_date, Auction.bid_count]) \
+        .where(Auction.auction_id.in_(auction_ids)) \
+        .order_by(Auction.auction_id)
+    db.session.execute(db.insert(AuctionEvent).from_select([column.key for column in columns], select))
+
+
+def record_deleted(auction):
+    _append(auction.auction_id, AuctionEventKind.DELETED)
+
+
+@dataclass
+class AuctionSnapshot:
+    auction_id: int
+    state: AuctionState = None
+    price: object = None
+    bid_count: int = 0
+    leading_bidder_id: int = None
+    leading_bid_timestamp: datetime.datetime = None
+    winner_id: int = None
+    end_date: datetime.datetime = None
+    sealed_bids: int = 0
+    deleted: bool = False
+    last_event_id: int = None
+
+    def apply(self, event):
+        if event.kind == AuctionEventKind.CREATED:
+            self.state, self.price = event.state, event.price
+        elif event.kind == AuctionEventKind.BID:
+            self.price = event.price
+            self.bid_count += 1
+            self.leading_bidder_id = event.user_id
+            self.leading_bid_timestamp = event.timestamp
+            self.end_date = event.end_date
+        elif event.kind == AuctionEventKind.SEALED_BID:
+            self.sealed_bids += 1
+        elif event.kind == AuctionEventKind.STATE:
+            self.state, self.price, self.bid_count = event.state, event.price, event.bid_count
+            self.end_date, self.winner_id = event.end_date, event.user_id
+        elif event.kind == AuctionEventKind.DELETED:
+            self.deleted = True
+        self.last_event_id = event.event_id
+
+    def to_dict(self):
+        return {name: value.value if isinstance(value, AuctionState)
+                else value.isoformat() if isinstance(value, datetime.datetime)
+                else str(value) if name == "price" and value is not None
+                else value
+                for name, value in asdict(self).items()}
+
+
+def replay(auction_id, at=None, until_event_id=None):
+    """
+    Rebuilds the state of the auction from its events.
+    :param at: replay only the events which happened at or before this time
+    :param until_event_id: replay only the events up to this id
+    :return: AuctionSnapshot, None when the auction has no events
+    """
+    query = AuctionEvent.query.filter(AuctionEvent.auction_id == auction_id)
+    if at is not None:
+        query = query.filter(AuctionEvent.timestamp <= at)
+    if until_event_id is not None:
+        query = query.filter(AuctionEvent.event_id <= until_event_id)
+    snapshot = None
+    for event in query.order_by(AuctionEvent.event_id):
+        snapshot = snapshot or AuctionSnapshot(auction_id)
+        snapshot.apply(event)
+    return snapshot
+
+
+def _replay_batch(auction_ids):
+    snapshots = {}
+    for event in AuctionEvent.query.filter(AuctionEvent.auction_id.in_(auction_ids)) \
+            .order_by(AuctionEvent.auction_id, AuctionEvent.event_id):
+        snapshots.setdefault(event.auction_id, AuctionSnapshot(event.auction_id)).apply(event)
+    return snapshots
+
+
+def check(batch_size=1000):
+    """
+    Compares the replayed state of every auction to its row in the Auction table.
+    :return: list of (auction_id, field, replayed value, table value) of the differences
+    """
+    mismatches = []
+    last_id = 0
+    while True:
+        auctions = Auction.query.filter(Auction.auction_id > last_id) \
+            .order_by(Auction.auction_id) \
+            .limit(batch_size) \
+            .all()
+        if not auctions:
+            break
+        last_id = auctions[-1].auction_id
+        snapshots = _replay_batch([auction.auction_id for auction in auctions])
+        for auction in auctions:
+            snapshot = snapshots.get(auction.auction_id)
+            if snapshot is None:
+                mismatches.append((auction.auction_id, "events", None, "missing"))
+                continue
+            if snapshot.deleted:
+                mismatches.append((auction.auction_id, "deleted", True, False))
+            for field in CHECKED_FIELDS:
+                if getattr(snapshot, field) != getattr(auction, field):
+                    mismatches.append((auction.auction_id, field, getattr(snapshot, field), getattr(auction, field)))
+        db.session.expunge_all()
+
+    # logged auctions missing in the table without a DELETED event
+    deleted = db.func.sum(db.case((AuctionEvent.kind == AuctionEventKind.DELETED, 1), else_=0))
+    for (auction_id,) in db.session.query(AuctionEvent.auction_id) \
+            .outerjoin(Auction, Auction.auction_id == AuctionEvent.auction_id) \
+            .filter(Auction.auction_id.is_(None)) \
+            .group_by(AuctionEvent.auction_id) \
+            .having(deleted == 0):
+        mismatches.append((auction_id, "deleted", False, True))
+    return mismatches
+
+
+def backfill(batch_size=10000):
+    """
+    Logs the auctions which have no events yet: their creation, their bids from the bid
+    history and their current state. Their state between those is not known to the log.
+    :return: number of backfilled auctions
+    """
+    logged = db.select(AuctionEvent.event_id).where(AuctionEvent.auction_id == Auction.auction_id).exists()
+    count = 0
+    last_id = 0
+    while True:
+        auction_ids = [auction_id for (auction_id,) in db.session.query(Auction.auction_id)
+                       .filter(Auction.auction_id > last_id, ~logged)
+                       .order_by(Auction.auction_id)
+                       .limit(batch_size)]
+        if not auction_ids:
+            break
+        last_id = auction_ids[-1]
+        _insert_from(db.select([Auction.auction_id, db.literal(AuctionEventKind.CREATED.name),
+                                Auction.creation_timestamp, Auction.start_price, db.literal(AuctionState.CREATED.name)])
+                     .where(Auction.auction_id.in_(auction_ids))
+                     .order_by(Auction.auction_id),
+                     ["auction_id", "kind", "timestamp", "price", "state"])
+        for model, kind, primary_key in ((Bid, AuctionEventKind.BID, Bid.bid_id),
+                                         (SealedBid, AuctionEventKind.SEALED_BID, SealedBid.sealed_bid_id)):
+            _insert_from(db.select([model.auction_id, db.literal(kind.name), model.timestamp, model.creator_id,
+                                    model.price])
+                         .where(model.auction_id.in_(auction_ids))
+                         .order_by(model.auction_id, model.timestamp, primary_key),
+                         ["auction_id", "kind", "timestamp", "user_id", "price"])
+        record_states(auction_ids)
+        db.session.commit()
+        count += len(auction_ids)
+    return count
+
+
+def _insert_from(select, columns):
+    db.session.execute(db.insert(AuctionEvent).from_select(columns, select))
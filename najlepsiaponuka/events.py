@@ -0,0 +1,213 @@
+"""
+Publish/subscribe of auction changes for the auctionDetail event stream.
+
+A change is serialized once and handed to every watcher of the auction through
+the broker, so watchers cost one message per bid instead of a page render per poll.
+The broker is pluggable, EVENT_BROKER may name a Broker subclass as "module:Class"
+(e.g. one backed by Redis). PollingBroker is used otherwise, it delivers the states
+published in the process at once and reads the watched auctions from the database every
+EVENT_POLL_INTERVAL seconds, so the bids of the other server processes and the state
+changes of the scheduler reach the watchers as well. MemoryBroker delivers only what is
+published in its own process.
+"""
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from werkzeug.utils import import_string
+
+from . import app
+
+
+class Broker:
+    """Interface of a message broker."""
+    # whether the messages published by the other processes are delivered
+    shared = False
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """Returns a Subscription receiving messages published to channel from now on."""
+        raise NotImplementedError
+
+
+class Subscription:
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize)
+
+    def get(self, timeout=None):
+        """Returns the next message or None when none arrives in timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, message):
+        # a slow watcher skips the oldest messages, the newest one carries the current state and
+        # is not delivered again
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker(Broker):
+    """Broker delivering messages to subscribers in the same process."""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.maxsize)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscriptions.get(channel, ()))
+
+
+class PollingBroker(MemoryBroker):
+    """
+    MemoryBroker which also reads the states of the watched auctions every interval seconds
+    and publishes those which changed. A message equal to the last one of its channel, or
+    read before the last one was published, is not delivered.
+    """
+    shared = True
+
+    def __init__(self, maxsize=16, interval=None):
+        super().__init__(maxsize)
+        self.interval = interval or app.config.get("EVENT_POLL_INTERVAL", 1.0)
+        self._last = {}
+        self._thread = None
+
+    def publish(self, channel, message):
+        self._deliver(channel, message, time.monotonic())
+
+    def _deliver(self, channel, message, read_at):
+        with self._lock:
+            last_message, last_read_at = self._last.get(channel, (None, None))
+            if channel not in self._subscriptions or message == last_message \
+                    or (last_read_at is not None and last_read_at > read_at):
+                return
+            self._last[channel] = (message, read_at)
+        super().publish(channel, message)
+
+    def subscribe(self, channel):
+        with self._lock:
+            # started by the first watcher, so in the worker and not in the master it is forked from
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._poll, name="event-poller", daemon=True)
+                self._thread.start()
+        return super().subscribe(channel)
+
+    def unsubscribe(self, subscription):
+        super().unsubscribe(subscription)
+        with self._lock:
+            if subscription.channel not in self._subscriptions:
+                self._last.pop(subscription.channel, None)
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                channels = list(self._subscriptions)
+            if not channels:
+                continue
+            read_at = time.monotonic()
+            try:
+                with app.app_context():
+                    messages = _load_states(channels)
+            except Exception:
+                app.logger.exception("Reading the watched auctions failed.")
+                continue
+            for channel, message in messages.items():
+                self._deliver(channel, message, read_at)
+
+
+broker = import_string(app.config["EVENT_BROKER"])() if app.config.get("EVENT_BROKER") else PollingBroker()
+
+
+def auction_channel(auction_id):
+    return f"auction:{auction_id}"
+
+
+def _load_states(channels):
+    from . import db
+    from .models import Auction
+
+    auction_ids = [int(channel.split(":", 1)[1]) for channel in channels if channel.startswith("auction:")]
+    try:
+        return {auction_channel(auction.auction_id): json.dumps(auction_state(auction))
+                for auction in Auction.query.filter(Auction.auction_id.in_(auction_ids))}
+    finally:
+        db.session.remove()
+
+
+def auction_state(auction):
+    return {
+        "auction_id": auction.auction_id,
+        "price": str(auction.price),
+        "state": auction.state.value,
+        "bid_count": auction.bid_count,
+        "leading_bid_timestamp": auction.leading_bid_timestamp.isoformat() if auction.leading_bid_timestamp else None,
+        # moved by bids in the soft close window
+        "end_date": auction.end_date.isoformat() if auction.end_date else None,
+    }
+
+
+def publish_auction_state(state):
+    """
+    Publishes an auction state to its watchers, take the state with auction_state() before
+    committing and publish it after the commit, so the auction does not have to be reloaded.
+    """
+    broker.publish(auction_channel(state["auction_id"]), json.dumps(state))
+
+
+def event_stream(subscription, initial=None, keep_alive=15):
+    """
+    Yields server-sent events of the subscription until the client disconnects.
+    :param initial: auction state sent right after connecting
+    """
+    try:
+        yield "retry: 3000\n\n"
+        if initial is not None:
+            yield f"event: auction\ndata: {json.dumps(initial)}\n\n"
+        while True:
+            message = subscription.get(timeout=keep_alive)
+            if message is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: auction\ndata: {message}\n\n"
+    finally:
+        subscription.close()
@@ -0,0 +1,110 @@
+"""
+Streaming export of bid history as NDJSON or CSV.
+
+Bids are read in batches with keyset pagination over (timestamp, bid_id), so the
+export uses constant memory and starts producing output after the first batch. The sealed
+bids of closed auctions are revealed, they are read from their own table the same way and
+merged in with sealed set, their bid_id is the id of the sealed bid. Sealed bids of
+auctions which have not closed yet are not exported.
+"""
+import csv
+import heapq
+import io
+import itertools
+import json
+
+from sqlalchemy import and_, or_
+
+from . import db
+from .models import Auction, AuctionState, Bid, SealedBid
+
+BID_FIELDS = ("bid_id", "auction_id", "creator_id", "price", "timestamp", "sealed")
+FORMATS = ("ndjson", "csv")
+
+
+def _iter_rows(query, timestamp, bid_id, batch_size):
+    """Yields the rows of query ordered by (timestamp, bid_id), read batch_size rows at a time."""
+    query = query.order_by(timestamp, bid_id)
+    last = None
+    while True:
+        batch_query = query
+        if last is not None:
+            batch_query = query.filter(or_(timestamp > last.timestamp,
+                                           and_(timestamp == last.timestamp, bid_id > last.bid_id)))
+        rows = batch_query.limit(batch_size).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def iter_bid_batches(auction_id=None, since=None, until=None, batch_size=1000):
+    """
+    Yields lists of bid rows ordered by (timestamp, sealed, bid_id), the open bids and the
+    sealed bids of closed auctions.
+
+    :param auction_id: only bids of this auction, all auctions if None
+    :param since: only bids placed at or after this time
+    :param until: only bids placed before this time
+    """
+    sources = []
+    for model, bid_id, sealed in ((Bid, Bid.bid_id, False), (SealedBid, SealedBid.sealed_bid_id, True)):
+        query = db.session.query(bid_id.label("bid_id"), model.auction_id, model.creator_id, model.price,
+                                 model.timestamp, db.literal(sealed).label("sealed"))
+        if sealed:
+            query = query.join(Auction, Auction.auction_id == model.auction_id) \
+                .filter(Auction.state == AuctionState.CLOSED)
+        if auction_id is not None:
+            query = query.filter(model.auction_id == auction_id)
+        if since is not None:
+            query = query.filter(model.timestamp >= since)
+        if until is not None:
+            query = query.filter(model.timestamp < until)
+        sources.append(_iter_rows(query, model.timestamp, bid_id, batch_size))
+
+    rows = heapq.merge(*sources, key=lambda row: (row.timestamp, bool(row.sealed), row.bid_id))
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+
+
+def _row_to_dict(row):
+    return {
+        "bid_id": row.bid_id,
+        "auction_id": row.auction_id,
+        "creator_id": row.creator_id,
+        "price": str(row.price),
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        # 0 and 1 on databases without a boolean type
+        "sealed": bool(row.sealed),
+    }
+
+
+def ndjson_chunks(batches):
+    for rows in batches:
+        yield "".join(json.dumps(_row_to_dict(row)) + "\n" for row in rows)
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=BID_FIELDS)
+    writer.writeheader()
+    for rows in batches:
+        writer.writerows(_row_to_dict(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # header only, when there is nothing to export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_bids(format="ndjson", **kwargs):
+    """Returns a generator of text chunks of the export, kwargs are passed to iter_bid_batches."""
+    batches = iter_bid_batches(**kwargs)
+    if format == "csv":
+        return csv_chunks(batches)
+    return ndjson_chunks(batches)
@@ -6,10 +6,10 @@ from flask_wtf.file import FileField, FileAllowed
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, StopValidation, Optional
 from .models import User, AuctionType, AuctionRules, AuctionCategory, UserType, AuctionState
 from flask_login import current_user
-import phonenumbers
-import email_validator
-from . import bcrypt
-from flask_uploads import IMAGES, UploadSet, secure_filename
+from .passwords import PasswordServiceBusy, check_password
+
+# error of a password field when the password service is busy
+PASSWORD_SERVICE_BUSY = "Server je preťažený, skúste to prosím znova."
 
 
 def stop_validation_if_empty(form, field):
@@ -28,11 +28,22 @@ class AuctionManageForm(FlaskForm):
                                    Optional(),
                                ])
 
+    end_date = DateTimeField(label="Plánované ukončenie aukcie",
+                             format='%d/%m/%Y %H:%M:%S',
+                             validators=[
+                                 Optional(),
+                             ])
+
     def validate_start_date(self, start_date):
         if start_date.data:
             if start_date.data < datetime.datetime.now():
                 raise ValidationError("Nemôže byť v minulosti.")
 
+    def validate_end_date(self, end_date):
+        if end_date.data:
+            if end_date.data < (self.start_date.data or datetime.datetime.now()):
+                raise ValidationError("Musí byť po začatí aukcie.")
+
 
 class AuctionForm(FlaskForm):
     start_price = DecimalField(label="Vyvolávacia cena",
@@ -111,6 +122,9 @@ class RegistrationForm(FlaskForm):
     def validate_phone(self, phone):
         message = "Neplatné telefonné číslo."
         if not phone:
+            # phonenumbers loads slowly and only a few requests validate a phone number
+            import phonenumbers
+
             try:
                 p = phonenumbers.parse(phone.data)
             except phonenumbers.phonenumberutil.NumberParseException:
@@ -123,6 +137,8 @@ class RegistrationForm(FlaskForm):
         message_bad_format = "Email je v zlom formáte."
         message_user_exists = "účet s týmto emailom už existuje."
         user = User.query.filter(User.email == email.data).first()
+        import email_validator
+
         try:
             valid = email_validator.validate_email(email.data)
             e = valid.email
@@ -142,10 +158,17 @@ class LoginForm(FlaskForm):
         DataRequired()
     ])
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = None
+
     def validate_email(self, email):
         message_bad_format = "Email je v zlom formáte."
         message_no_email = "účet s týmto emailom neexistuje."
-        user = User.query.filter(User.email == email.data).first()
+        # loaded once for both email and password validation
+        self.user = user = User.query.filter(User.email == email.data).first()
+        import email_validator
+
         try:
             valid = email_validator.validate_email(email.data)
             e = valid.email
@@ -157,10 +180,14 @@ class LoginForm(FlaskForm):
                 raise ValidationError(message_no_email)
 
     def validate_password(self, password):
-        user = User.query.filter(User.email == self.email.data).first()
+        user = self.user
         message = "Heslo je nesprávne."
         if user:
-            if not bcrypt.check_password_hash(user.password, password.data):
+            try:
+                valid = check_password(user.password, password.data)
+            except PasswordServiceBusy:
+                raise ValidationError(PASSWORD_SERVICE_BUSY)
+            if not valid:
                 raise ValidationError(message)
 
 
@@ -195,11 +222,17 @@ class UpdateForm(FlaskForm):
     def validate_password_confirm(self, password_confirm):
         message = "Nesprávne heslo."
 
-        if not bcrypt.check_password_hash(current_user.password, password_confirm.data):
+        try:
+            valid = check_password(current_user.password, password_confirm.data)
+        except PasswordServiceBusy:
+            raise ValidationError(PASSWORD_SERVICE_BUSY)
+        if not valid:
             raise ValidationError(message)
 
     def validate_phone(self, phone):
         message = "Neplatné telefonné číslo."
+        import phonenumbers
+
         try:
             p = phonenumbers.parse(phone.data)
         except phonenumbers.phonenumberutil.NumberParseException:
@@ -235,25 +268,14 @@ class BidForm(FlaskForm):
         self.auction = auction
 
     def validate_price(self, price, *args):
-        if self.auction.type == AuctionType.OFFER:
-            if not self.auction.has_bid():
-                condition = price.data >= self.auction.price
-            else:
-                condition = price.data >= self.auction.price + self.auction.minimal_bid
-
-            if not condition:
+        # DecimalField takes NaN and Infinity, which can not be compared to the price
+        if price.data is None or not price.data.is_finite():
+            raise ValidationError("Zadajte platnú sumu.")
+        if not self.auction.is_acceptable_bid(price.data):
+            if self.auction.type == AuctionType.OFFER:
                 raise ValidationError(
                     f"Minimálna výška prihodenia je {self.auction.minimal_bid}."
                 )
-
-        else:
-            if not self.auction.has_bid():
-                condition = price.data <= self.auction.price
-            else:
-                condition = price.data <= self.auction.price - self.auction.minimal_bid
-
-            if not condition:
-                raise ValidationError(
-                    f"Minimálna výška sníženia je {self.auction.minimal_bid}."
-                )
-
+            raise ValidationError(
+                f"Minimálna výška sníženia je {self.auction.minimal_bid}."
+            )
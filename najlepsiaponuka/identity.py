@@ -0,0 +1,168 @@
+"""
+Process-local cache of logged in users and per-request memoization.
+
+load_user is called on every request, the cache keeps the column values of recently
+seen users for IDENTITY_CACHE_TTL seconds, so the user (with its role) is attached
+to the session without a query. Views which change a user call invalidate_identity().
+The entries are kept under the generation of the file IDENTITY_GENERATION_FILE which
+invalidate_identity() bumps, so a user changed or deleted in one server process is not
+served from the caches of the others. Set it to None to keep the invalidations in the
+process.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, has_request_context
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from . import app, db
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire ttl seconds after being set."""
+
+    def __init__(self, maxsize=1024, ttl=30, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else None,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+            }
+
+
+class GenerationFile:
+    """Generation kept in a file, a bump in one process is seen by all processes of the host."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def get(self):
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def bump(self):
+        # a unique value instead of a counter, concurrent bumps from other processes can not be lost
+        value = uuid.uuid4().hex
+        tmp = f"{self.path}.{value}.tmp"
+        with open(tmp, "w") as f:
+            f.write(value)
+        os.replace(tmp, self.path)
+
+
+identity_cache = TTLCache(maxsize=app.config.get("IDENTITY_CACHE_SIZE", 1024),
+                          ttl=app.config.get("IDENTITY_CACHE_TTL", 30))
+
+_generation_path = app.config.get("IDENTITY_GENERATION_FILE",
+                                  os.path.join(app.instance_path, "identity_generation"))
+identity_generation = GenerationFile(_generation_path) if _generation_path else None
+# whether an invalidation reaches the other processes
+shared = identity_generation is not None
+
+request_memo_stats = {"hits": 0, "misses": 0}
+
+
+def load_identity(email):
+    """Returns the User with the given email attached to the current session."""
+    from .models import User
+
+    # read before the user, a bump in between leaves an entry which is not used
+    generation = identity_generation.get() if identity_generation else None
+    entry = identity_cache.get(email)
+    if entry is None or entry[0] != generation:
+        user = User.query.filter(User.email == email).first()
+        if user is not None:
+            identity_cache.set(email, (generation, {attr.key: getattr(user, attr.key)
+                                                    for attr in inspect(User).column_attrs}))
+        return user
+
+    user = User(**entry[1])
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_identity(*emails):
+    identity_cache.invalidate(*emails)
+    if identity_generation is not None:
+        identity_generation.bump()
+
+
+def request_memoized(key):
+    """
+    Memoizes results of the decorated function in flask.g for the rest of the request.
+    :param key: function computing the memo key from the arguments
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not has_request_context():
+                return func(*args, **kwargs)
+            memo = g.setdefault("request_memo", {})
+            memo_key = (func.__qualname__, key(*args, **kwargs))
+            if memo_key in memo:
+                request_memo_stats["hits"] += 1
+            else:
+                request_memo_stats["misses"] += 1
+                memo[memo_key] = func(*args, **kwargs)
+            return memo[memo_key]
+
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    return {
+        "identity": identity_cache.stats(),
+        "request_memo": dict(request_memo_stats),
+    }
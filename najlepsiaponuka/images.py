@@ -0,0 +1,233 @@
+"""
+Content addressed store of auction images.
+
+Images are stored once per content, the variants rendered from an upload are named by the
+hash of the uploaded bytes (<hash>_thumb.webp, <hash>_detail.webp) and StoredImage counts
+the auctions using them. Uploading a photo which is already stored only takes a reference,
+the variants are removed when delete_auction releases the last one. Since the content of a
+name never changes, /images/<name> is served with immutable cache headers.
+
+Rendering runs in a pool of IMAGE_WORKERS processes, the request thread only stores the
+uploaded file in UPLOAD_FOLDER/raw and hashes it on the way. Until the variants are ready
+Auction.image points to the raw file, then to the detail variant, the other variants are
+found with Auction.image_url().
+"""
+import datetime
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.exc import IntegrityError
+
+from . import app, db, response_cache
+
+# longest side of each variant in pixels
+VARIANTS = {
+    "thumb": 320,
+    "detail": 1280,
+}
+VARIANT_FORMAT = "webp"
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+URL_PREFIX = "images"
+# raw uploads are served from UPLOAD_FOLDER/raw by the static route until their variants are ready
+RAW_PREFIX = "static/images/raw"
+VARIANT_PATTERN = re.compile(rf"(?P<digest>[0-9a-f]{{32}})_(?P<variant>{'|'.join(VARIANTS)})\.{VARIANT_FORMAT}$")
+RAW_PATTERN = re.compile(r"raw/(?P<digest>[0-9a-f]{32})-[0-9a-f]{8}\.\w+$")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def store_folder():
+    return os.path.abspath(app.config["UPLOAD_FOLDER"])
+
+
+def variant_filename(digest, variant):
+    return f"{digest}_{variant}.{VARIANT_FORMAT}"
+
+
+def variant_image(digest, variant="detail"):
+    """Value of Auction.image pointing to a stored variant."""
+    return f"{URL_PREFIX}/{variant_filename(digest, variant)}"
+
+
+def digest_of(image):
+    """Content hash of the image referenced by Auction.image, None for images outside of the store."""
+    match = VARIANT_PATTERN.search(image or "") or RAW_PATTERN.search(image or "")
+    return match.group("digest") if match else None
+
+
+def _variants_exist(output_dir, digest, variants=VARIANTS):
+    return all(os.path.exists(os.path.join(output_dir, variant_filename(digest, name))) for name in variants)
+
+
+def render_variants(raw_path, output_dir, quality=80):
+    """
+    Renders all variants of the image at raw_path into output_dir, runs in a worker process.
+    Variants which already exist are not rendered again.
+    :return: content hash naming the variants
+    """
+    # only the worker processes need Pillow
+    from PIL import Image, ImageOps
+
+    digest = hashlib.sha256()
+    with open(raw_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()[:32]
+
+    missing = {name: size for name, size in VARIANTS.items() if not _variants_exist(output_dir, digest, [name])}
+    if not missing:
+        return digest
+
+    with Image.open(raw_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        # largest variant first, each smaller one is resized from the previous result
+        for name, size in sorted(missing.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.LANCZOS)
+            target = os.path.join(output_dir, variant_filename(digest, name))
+            tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+            image.save(tmp, VARIANT_FORMAT, quality=quality, method=4)
+            os.replace(tmp, target)
+    return digest
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(app.config.get("IMAGE_WORKERS", os.cpu_count() or 1),
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def shutdown():
+    """Waits for the images being rendered and stops the worker processes."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def _acquire(digest):
+    """Takes a reference to the stored image, inserting it on the first use."""
+    from .models import StoredImage
+
+    updated = StoredImage.query.filter_by(digest=digest) \
+        .update({StoredImage.refcount: StoredImage.refcount + 1}, synchronize_session=False)
+    if not updated:
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredImage(digest=digest, refcount=1, creation_timestamp=datetime.datetime.now()))
+        except IntegrityError:
+            # inserted by a concurrent upload of the same content
+            StoredImage.query.filter_by(digest=digest) \
+                .update({StoredImage.refcount: StoredImage.refcount + 1}, synchronize_session=False)
+
+
+def store_upload(auction, file_storage):
+    """
+    Stores an uploaded image of the auction and takes a reference to its content, the caller commits.
+    :return: path of the raw file to pass to process_upload() after the commit,
+             None when the content is already stored and the auction points to it
+    """
+    raw_dir = os.path.join(store_folder(), "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+    tmp = os.path.join(raw_dir, f"{uuid.uuid4().hex}.tmp")
+
+    digest = hashlib.sha256()
+    with open(tmp, "wb") as f:
+        for chunk in iter(lambda: file_storage.stream.read(1 << 16), b""):
+            digest.update(chunk)
+            f.write(chunk)
+    digest = digest.hexdigest()[:32]
+
+    _acquire(digest)
+    if _variants_exist(store_folder(), digest):
+        os.remove(tmp)
+        auction.image = variant_image(digest)
+        return None
+
+    extension = file_storage.filename.rsplit(".", 1)[-1].lower()
+    filename = f"{digest}-{uuid.uuid4().hex[:8]}.{extension}"
+    raw_path = os.path.join(raw_dir, filename)
+    os.replace(tmp, raw_path)
+    auction.image = f"{RAW_PREFIX}/{filename}"
+    return raw_path
+
+
+def _on_rendered(auction_id, raw_path, raw_image, future):
+    try:
+        digest = future.result()
+    except Exception:
+        app.logger.exception(f"Rendering image of auction {auction_id} failed, keeping the uploaded file.")
+        return
+
+    from .models import Auction
+
+    with app.app_context():
+        try:
+            # only when the auction still shows the uploaded file
+            updated = Auction.query.filter_by(auction_id=auction_id, image=raw_image) \
+                .update({Auction.image: variant_image(digest)}, synchronize_session=False)
+            db.session.commit()
+        finally:
+            db.session.remove()
+    if updated:
+        # cached pages may still show the raw file
+        response_cache.invalidate()
+        os.remove(raw_path)
+
+
+def process_upload(auction_id, raw_path, raw_image):
+    """Renders the variants of an uploaded image in the background and points the auction to them."""
+    future = _pool().submit(render_variants, raw_path, store_folder())
+    future.add_done_callback(lambda f: _on_rendered(auction_id, raw_path, raw_image, f))
+    return future
+
+
+def release(image):
+    """
+    Drops the reference of a deleted auction to its image in a transaction of its own,
+    the variants are removed with the last reference, before it commits.
+    """
+    from .models import StoredImage
+
+    if image and image.startswith(f"{RAW_PREFIX}/"):
+        # deleted before its variants were rendered
+        path = os.path.join(store_folder(), "raw", image.rsplit("/", 1)[-1])
+        if os.path.exists(path):
+            os.remove(path)
+
+    digest = digest_of(image)
+    if digest is None:
+        return
+    # the decrement locks the row until the commit, an upload of the same content waits in
+    # _acquire() and finds the row and the variants removed, so it renders them again
+    StoredImage.query.filter_by(digest=digest) \
+        .update({StoredImage.refcount: StoredImage.refcount - 1}, synchronize_session=False)
+    removed = StoredImage.query.filter(StoredImage.digest == digest, StoredImage.refcount <= 0) \
+        .delete(synchronize_session=False)
+    if removed:
+        for name in VARIANTS:
+            path = os.path.join(store_folder(), variant_filename(digest, name))
+            if os.path.exists(path):
+                os.remove(path)
+    db.session.commit()
+
+
+def image_url(image, variant):
+    """Path of a variant of the image stored in Auction.image, other images are returned as they are."""
+    if image:
+        for name in VARIANTS:
+            suffix = f"_{name}.{VARIANT_FORMAT}"
+            if image.endswith(suffix):
+                return f"{image[:-len(suffix)]}_{variant}.{VARIANT_FORMAT}"
+    return image
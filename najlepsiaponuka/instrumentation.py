@@ -0,0 +1,199 @@
+"""
+Per-request instrumentation of the views.
+
+Every request records its number of SQL queries, time spent in the database, in rendering
+templates and in total, aggregated per endpoint into histograms shown at /admin/requestStats.
+Queries are timed by SQLAlchemy engine events, templates by the template class of the Jinja
+environment (Flask signals need blinker, which is not a dependency).
+
+Requests slower than SLOW_REQUEST_MS and queries slower than SLOW_QUERY_MS are logged. A
+statement executed N_PLUS_ONE_THRESHOLD or more times by one request is logged as a likely
+N+1 query, loading its rows in one query usually fixes it.
+"""
+import bisect
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import app
+
+# upper bounds of the histogram buckets, the last bucket is unbounded
+TIME_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+            # a list keeps the order of the buckets in JSON
+            "buckets": [[label, count] for label, count in zip(labels, self.counts)],
+        }
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.slow = 0
+        self.n_plus_one = 0
+        self.statuses = Counter()
+        self.total_ms = Histogram(TIME_BUCKETS_MS)
+        self.db_ms = Histogram(TIME_BUCKETS_MS)
+        self.template_ms = Histogram(TIME_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "slow": self.slow,
+            "n_plus_one": self.n_plus_one,
+            "statuses": dict(self.statuses),
+            "total_ms": self.total_ms.to_dict(),
+            "db_ms": self.db_ms.to_dict(),
+            "template_ms": self.template_ms.to_dict(),
+            "queries": self.queries.to_dict(),
+        }
+
+
+class RequestMetrics:
+    """Measurements of the current request, kept in flask.g."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()
+        self.recorded = False
+
+
+_endpoints = defaultdict(EndpointStats)
+_lock = threading.Lock()
+
+
+def _enabled():
+    return app.config.get("INSTRUMENTATION_ENABLED", True)
+
+
+def _current():
+    return g.get("request_metrics") if has_request_context() else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if elapsed * 1000 >= app.config.get("SLOW_QUERY_MS", 100):
+        app.logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {statement}")
+    metrics = _current()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.db_time += elapsed
+        metrics.statements[statement] += 1
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # a failed query does not reach after_cursor_execute
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+class TimedTemplate(Template):
+    """Template adding its render time to the current request."""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            metrics = _current()
+            if metrics is not None:
+                metrics.template_time += time.perf_counter() - start
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@app.before_request
+def _start_request():
+    if _enabled():
+        g.request_metrics = RequestMetrics()
+
+
+def _record(status):
+    metrics = _current()
+    if metrics is None or metrics.recorded:
+        return
+    metrics.recorded = True
+    endpoint = request.endpoint or "<unmatched>"
+    total_ms = (time.perf_counter() - metrics.start) * 1000
+    slow = total_ms >= app.config.get("SLOW_REQUEST_MS", 500)
+    repeated = [(statement, count) for statement, count in metrics.statements.most_common(3)
+                if count >= app.config.get("N_PLUS_ONE_THRESHOLD", 5)]
+
+    with _lock:
+        stats = _endpoints[endpoint]
+        stats.requests += 1
+        stats.slow += slow
+        stats.n_plus_one += bool(repeated)
+        stats.statuses[status] += 1
+        stats.total_ms.observe(total_ms)
+        stats.db_ms.observe(metrics.db_time * 1000)
+        stats.template_ms.observe(metrics.template_time * 1000)
+        stats.queries.observe(metrics.queries)
+
+    if slow:
+        app.logger.warning(f"Slow request {request.method} {request.full_path} ({endpoint}): {total_ms:.1f} ms, "
+                           f"{metrics.queries} queries in {metrics.db_time * 1000:.1f} ms, "
+                           f"templates {metrics.template_time * 1000:.1f} ms")
+    for statement, count in repeated:
+        app.logger.warning(f"Likely N+1 query in {endpoint}, executed {count} times: {statement}")
+
+
+@app.after_request
+def _finish_request(response):
+    _record(response.status_code)
+    return response
+
+
+@app.teardown_request
+def _teardown_request(exc):
+    # requests failing with an exception do not reach after_request
+    if exc is not None:
+        _record(500)
+
+
+def stats():
+    with _lock:
+        return {endpoint: stats.to_dict() for endpoint, stats in sorted(_endpoints.items())}
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
@@ -0,0 +1,283 @@
+"""
+Business and runtime metrics exported in the Prometheus text format at /metrics, to a
+scraper sending METRICS_TOKEN as its bearer token or to a logged in admin.
+
+Counters and histograms keep their values in STRIPES stripes, each with its own lock, a
+thread only locks the stripe it was given on its first update, threads get the stripes in
+turn, so request threads rarely wait for each other. Gauges are computed when the metrics are scraped.
+
+With several server processes set METRICS_DIR to a directory shared by them. Every process
+dumps its counters and histograms there every METRICS_FLUSH_INTERVAL seconds and on exit,
+the scraped process adds up the dumps of all of them. Dumps of stopped processes keep
+counting, clear the directory when the server is redeployed.
+"""
+import atexit
+import bisect
+import itertools
+import json
+import math
+import os
+import threading
+from collections import defaultdict
+
+from . import app, db
+
+STRIPES = 16
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# stripe index of each thread, thread idents are aligned addresses and can not pick it
+_stripe_indexes = itertools.count()
+_thread = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _stripe_index():
+    try:
+        return _thread.stripe
+    except AttributeError:
+        # next() of itertools.count is atomic
+        _thread.stripe = next(_stripe_indexes) % STRIPES
+        return _thread.stripe
+
+
+class _Striped:
+    """Values of a metric by labels, spread over stripes."""
+
+    def __init__(self, name, documentation, factory):
+        self.name = name
+        self.documentation = documentation
+        self._factory = factory
+        self._stripes = [(threading.Lock(), defaultdict(factory)) for _ in range(STRIPES)]
+
+    def _stripe(self):
+        return self._stripes[_stripe_index()]
+
+    def values(self):
+        """Values of all stripes added up, by label key."""
+        merged = defaultdict(self._factory)
+        for lock, values in self._stripes:
+            with lock:
+                for key, value in values.items():
+                    merged[key] = self._add(merged[key], value)
+        return merged
+
+    def _add(self, a, b):
+        raise NotImplementedError
+
+
+class Counter(_Striped):
+    type = "counter"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation, float)
+
+    def inc(self, amount=1, **labels):
+        lock, values = self._stripe()
+        key = _label_key(labels)
+        with lock:
+            values[key] += amount
+
+    def _add(self, a, b):
+        return a + b
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Histogram(_Striped):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # counts of the buckets (the last one unbounded), sum and count of the observations
+        super().__init__(name, documentation, lambda: [0] * (len(self.buckets) + 3))
+
+    def observe(self, value, **labels):
+        lock, values = self._stripe()
+        key = _label_key(labels)
+        with lock:
+            entry = values[key]
+            entry[bisect.bisect_left(self.buckets, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def _add(self, a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, values):
+        for key, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(entry[-2])}"
+            yield f"{self.name}_count{_format_labels(key)} {entry[-1]}"
+
+
+class Gauge:
+    """Metric computed when scraped by a function yielding (labels, value) pairs."""
+    type = "gauge"
+
+    def __init__(self, name, documentation, collect):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self, directory=None, flush_interval=15):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._timer = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name, documentation):
+        """Decorator registering the function as a gauge."""
+
+        def decorator(collect):
+            self.register(Gauge(name, documentation, collect))
+            return collect
+
+        return decorator
+
+    def _dump_path(self):
+        return os.path.join(self.directory, f"metrics_{os.getpid()}.json")
+
+    def flush(self):
+        """Dumps counters and histograms of this process to the shared directory."""
+        if not self.directory:
+            return
+        dump = {name: [[list(map(list, key)), value] for key, value in metric.values().items()]
+                for name, metric in self._metrics.items() if not isinstance(metric, Gauge)}
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._dump_path()
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(dump, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _flush_periodically(self):
+        try:
+            self.flush()
+        except OSError:
+            app.logger.exception("Dumping metrics failed.")
+        self.start()
+
+    def start(self):
+        """Starts dumping the metrics every flush_interval seconds when a directory is set."""
+        if self.directory:
+            self._timer = threading.Timer(self.flush_interval, self._flush_periodically)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _read_dumps(self):
+        """Values of counters and histograms of all processes added up, by metric name."""
+        merged = {name: defaultdict(metric._factory) for name, metric in self._metrics.items()
+                  if not isinstance(metric, Gauge)}
+        for entry in os.scandir(self.directory):
+            if not (entry.name.startswith("metrics_") and entry.name.endswith(".json")):
+                continue
+            try:
+                with open(entry.path) as f:
+                    dump = json.load(f)
+            except (OSError, ValueError):
+                # removed meanwhile
+                continue
+            for name, values in merged.items():
+                for key, value in dump.get(name, ()):
+                    key = tuple(map(tuple, key))
+                    values[key] = self._metrics[name]._add(values[key], value)
+        return merged
+
+    def exposition(self):
+        """All metrics in the Prometheus text exposition format."""
+        if self.directory:
+            # the dump of this process is written first, so it is up to date
+            self.flush()
+            dumps = self._read_dumps()
+        lines = []
+        for name, metric in self._metrics.items():
+            if isinstance(metric, Gauge):
+                values = {_label_key(labels): value for labels, value in metric.collect()}
+            else:
+                values = dumps[name] if self.directory else metric.values()
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(directory=app.config.get("METRICS_DIR"),
+                    flush_interval=app.config.get("METRICS_FLUSH_INTERVAL", 15))
+registry.start()
+atexit.register(registry.flush)
+
+bids = registry.counter("najlepsiaponuka_bids_total",
+                        "Bids by result, accepted or the reason of the rejection.")
+bid_seconds = registry.histogram("najlepsiaponuka_bid_seconds",
+                                 "Time of placing a bid including the row lock wait.")
+auction_views = registry.counter("najlepsiaponuka_auction_views_total",
+                                 "Auction detail pages shown.")
+registrations = registry.counter("najlepsiaponuka_registrations_total",
+                                 "Auction registrations by state set, created by bidders or decided by auctioneers.")
+auction_transitions = registry.counter("najlepsiaponuka_auction_transitions_total",
+                                       "Auction state changes made in manageAuction by the new state.")
+
+
+@registry.gauge("najlepsiaponuka_registrations_pending", "Registrations waiting for approval.")
+def _pending_registrations():
+    from .models import AuctionRegistration, AuctionRegistrationState
+
+    yield {}, AuctionRegistration.query.filter_by(state=AuctionRegistrationState.CREATED).count()
+
+
+@registry.gauge("najlepsiaponuka_auctions", "Auctions by state.")
+def _auctions_by_state():
+    from .models import Auction
+
+    for state, count in db.session.query(Auction.state, db.func.count()).group_by(Auction.state):
+        if state is not None:
+            yield {"state": str(state)}, count
+
+
+@registry.gauge("najlepsiaponuka_db_pool_connections", "Connections of the database pool of the scraped process.")
+def _pool_connections():
+    pool = db.engine.pool
+    for name, attribute in (("size", "size"), ("checked_out", "checkedout"), ("overflow", "overflow")):
+        # only QueuePool reports all of them
+        if hasattr(pool, attribute):
+            yield {"kind": name, "pid": str(os.getpid())}, getattr(pool, attribute)()
@@ -1,4 +1,6 @@
-from . import db
+from . import database, db  # noqa: F401, database configures the engine before it is created
+from .identity import request_memoized
+from .images import image_url
 from enum import Enum
 
 
@@ -53,6 +55,10 @@ class AuctionRegistrationState(EnumChoices):
     FORBIDDEN = "zakázaná"
 
 class User(db.Model):
+    __table_args__ = (
+        db.Index("ix_user_email", "email", unique=True),
+    )
+
     user_id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.Enum(UserType))
     name = db.Column(db.String(50))
@@ -84,6 +90,7 @@ class User(db.Model):
         """False, as anonymous users aren't supported."""
         return False
 
+    @request_memoized(key=lambda self, auction_id: (self.user_id, str(auction_id)))
     def is_registered_on_auction(self, auction_id):
         reg = AuctionRegistration.query.filter_by(auction_id=auction_id, creator_id=self.user_id).first()
         return reg is not None and reg.state == AuctionRegistrationState.ALLOWED
@@ -102,6 +109,11 @@ class User(db.Model):
 
 
 class Auction(db.Model):
+    __table_args__ = (
+        db.Index("ix_auction_state_start_date", "state", "start_date"),
+        db.Index("ix_auction_state_end_date", "state", "end_date"),
+    )
+
     auction_id = db.Column(db.Integer, primary_key=True)
     price = db.Column(db.Numeric(20,2))
     start_price = db.Column(db.Numeric(20,2))
@@ -122,11 +134,18 @@ class Auction(db.Model):
     auctioneer_id = db.Column(db.Integer, db.ForeignKey('user.user_id'))
     confirmation_timestamp = db.Column(db.TIMESTAMP(6))
 
+    # summary of the bids, updated in the same transaction as each bid
+    bid_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    leading_bidder_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete="SET NULL"))
+    leading_bid_timestamp = db.Column(db.TIMESTAMP(6))
+
+    winner_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete="SET NULL"))
+
     def view_auction_to_dict(self):
         return {
             "creator_id": self.creator_id,
             "auction_id": self.auction_id,
-            "image": self.image,
+            "image": self.image_url("thumb"),
             "title": self.title,
             "type": self.type.value,
             "category": self.category.value,
@@ -170,17 +189,24 @@ class Auction(db.Model):
             "delete": f"/deleteAuction/{self.auction_id}"
         }
 
+    @request_memoized(key=lambda self, user_id: (self.auction_id, user_id))
+    def user_bid(self, user_id):
+        model = SealedBid if self.is_rules_closed() else Bid
+        return model.query.filter_by(auction_id=self.auction_id,
+                                     creator_id=user_id).first()
+
     def show_bid(self, user):
         if not user.is_authenticated:
             return False
-        return Bid.query.filter_by(auction_id=self.auction_id,
-                                   creator_id=user.user_id).first().price
+        return self.user_bid(user.user_id).price
 
     def did_user_bid_on_closed(self, user):
         if not user.is_authenticated:
             return False
-        return Bid.query.filter_by(auction_id=self.auction_id,
-                                   creator_id=user.user_id).first() and self.is_rules_closed()
+        return self.is_rules_closed() and self.user_bid(user.user_id) is not None
+
+    def image_url(self, variant="detail"):
+        return image_url(self.image, variant)
 
     def is_rules_closed(self):
         return self.rules == AuctionRules.CLOSED
@@ -192,19 +218,34 @@ class Auction(db.Model):
         return self.type == AuctionType.OFFER
 
     def has_bid(self):
-        return Bid.query.filter_by(auction_id=self.auction_id).first()
+        return self.bid_count > 0
+
+    def is_acceptable_bid(self, price):
+        """
+        Checks whether price beats the current price by at least minimal_bid,
+        the first bid only has to match the current price.
+        """
+        step = self.minimal_bid if self.has_bid() else 0
+        if self.is_offer():
+            return price >= self.price + step
+        return price <= self.price - step
 
     def last_bid_current_users(self, current_user):
         if not current_user.is_authenticated:
             return False
-        if Bid.query.filter_by(creator_id=current_user.user_id, auction_id=self.auction_id, price=self.price).first() is not None:
-            return True
+        return self.has_bid() and self.leading_bidder_id == current_user.user_id
 
     def is_confirmed(self):
         return self.state == AuctionState.CONFIRMED
 
 
 class Bid(db.Model):
+    __table_args__ = (
+        db.Index("ix_bid_auction_creator_price", "auction_id", "creator_id", "price"),
+        db.Index("ix_bid_auction_timestamp", "auction_id", "timestamp", "bid_id"),
+        db.Index("ix_bid_timestamp", "timestamp", "bid_id"),
+    )
+
     bid_id = db.Column(db.Integer, primary_key=True)
     price = db.Column(db.Numeric(20,2))
     timestamp = db.Column(db.TIMESTAMP(6))
@@ -212,7 +253,40 @@ class Bid(db.Model):
     auction_id = db.Column(db.Integer, db.ForeignKey('auction.auction_id', ondelete='CASCADE'), nullable=False)
 
 
+class SealedBid(db.Model):
+    """Bid on an auction with AuctionRules.CLOSED, hidden from other users until the auction closes."""
+    __table_args__ = (
+        db.Index("ix_sealed_bid_auction_creator", "auction_id", "creator_id", unique=True),
+    )
+
+    sealed_bid_id = db.Column(db.Integer, primary_key=True)
+    price = db.Column(db.Numeric(20,2))
+    timestamp = db.Column(db.TIMESTAMP(6))
+    creator_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
+    auction_id = db.Column(db.Integer, db.ForeignKey('auction.auction_id', ondelete='CASCADE'), nullable=False)
+
+
+class ProxyBid(db.Model):
+    """
+    Automatic bidding of a user on an open auction up to price_limit, the highest price
+    for OFFER auctions and the lowest for DEMAND ones. Resolved by bidding.resolve_proxies().
+    """
+    __table_args__ = (
+        db.Index("ix_proxy_bid_auction_creator", "auction_id", "creator_id", unique=True),
+    )
+
+    proxy_bid_id = db.Column(db.Integer, primary_key=True)
+    price_limit = db.Column(db.Numeric(20,2))
+    timestamp = db.Column(db.TIMESTAMP(6))
+    creator_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
+    auction_id = db.Column(db.Integer, db.ForeignKey('auction.auction_id', ondelete='CASCADE'), nullable=False)
+
+
 class AuctionRegistration(db.Model):
+    __table_args__ = (
+        db.Index("ix_auction_registration_auction_creator", "auction_id", "creator_id", unique=True),
+    )
+
     auction_registration_id = db.Column(db.Integer, primary_key=True)
     creation_timestamp = db.Column(db.TIMESTAMP(6))
     checked_timestamp = db.Column(db.TIMESTAMP(6))
@@ -221,8 +295,10 @@ class AuctionRegistration(db.Model):
     creator_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
     auctioneer_id = db.Column(db.Integer, db.ForeignKey('user.user_id'))
 
-    def registration_to_dict(self):
-        user = User.query.filter_by(user_id=self.creator_id).first()
+    def registration_to_dict(self, user=None):
+        """:param user: the creator, when loaded with the registration"""
+        if user is None:
+            user = User.query.filter_by(user_id=self.creator_id).first()
         return {
             "user_id": self.creator_id,
             "name": user.name,
@@ -233,3 +309,47 @@ class AuctionRegistration(db.Model):
             "allow": f"/user/{self.auction_registration_id}/allow",
             "deny": f"/user/{self.auction_registration_id}/deny"
         }
+
+
+class AuctionEventKind(Enum):
+    CREATED = "created"
+    BID = "bid"
+    SEALED_BID = "sealed_bid"
+    STATE = "state"
+    DELETED = "deleted"
+
+
+class AuctionEvent(db.Model):
+    """Append-only log of bids and state changes of auctions, see event_log."""
+    __table_args__ = (
+        db.Index("ix_auction_event_auction", "auction_id", "event_id"),
+    )
+
+    event_id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    # no foreign key, the log outlives deleted auctions
+    auction_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.Enum(AuctionEventKind), nullable=False)
+    timestamp = db.Column(db.TIMESTAMP(6))
+    # the bidder, the winner in STATE events
+    user_id = db.Column(db.Integer)
+    price = db.Column(db.Numeric(20,2))
+    state = db.Column(db.Enum(AuctionState))
+    end_date = db.Column(db.TIMESTAMP(6))
+    bid_count = db.Column(db.Integer)
+
+
+class StoredImage(db.Model):
+    """Rendered image variants shared by all auctions uploading the same content."""
+    digest = db.Column(db.String(32), primary_key=True)
+    refcount = db.Column(db.Integer, default=0, nullable=False)
+    creation_timestamp = db.Column(db.TIMESTAMP(6))
+
+
+class SearchTerm(db.Model):
+    """Inverted index of the folded words of auction titles and descriptions, kept by search.index_auction()."""
+    __table_args__ = (
+        db.Index("ix_search_term_auction", "auction_id"),
+    )
+
+    term = db.Column(db.String(64), primary_key=True)
+    auction_id = db.Column(db.Integer, db.ForeignKey('auction.auction_id', ondelete='CASCADE'), primary_key=True)
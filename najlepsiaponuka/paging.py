@@ -0,0 +1,161 @@
+"""
+Server-side processing for the tables behind the /api/data/* endpoints.
+
+Speaks the DataTables server-side protocol (draw, start, length, order[i][...],
+columns[i][data], search[value]) and pushes filtering, sorting and paging into SQL,
+so the size of a response is bounded by the page size instead of the table size.
+Requests without DataTables parameters get the first page of the default size.
+
+recordsTotal counts the rows before the filters and the search, recordsFiltered after
+them. A first page which is not full holds all the rows, so it needs no count, other
+counts are kept for DATA_COUNT_TTL seconds, so paging through a table counts it once.
+Clients which page deep into a table can pass the "next" value of a page as "after"
+instead of start, the next page is then read from the index of the tie breaker instead
+of skipping start rows, this works only in the default order.
+"""
+from flask import abort, current_app, request
+from sqlalchemy import or_
+
+from . import app
+from .identity import TTLCache
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# row counts by the SQL and parameters of the counted query
+_counts = TTLCache(maxsize=app.config.get("DATA_COUNT_CACHE_SIZE", 1024), ttl=app.config.get("DATA_COUNT_TTL", 10))
+
+
+class Page:
+    def __init__(self, items, draw, records_total, records_filtered, query=None, next_cursor=None):
+        self.items = items
+        # filtered and searched query before ordering and paging
+        self.query = query
+        self.draw = draw
+        self.records_total = records_total
+        self.records_filtered = records_filtered
+        # "after" of the next page, None on the last page or in a requested order
+        self.next_cursor = next_cursor
+
+    def to_dict(self, data):
+        page = {
+            "recordsTotal": self.records_total,
+            "recordsFiltered": self.records_filtered,
+            "data": data,
+        }
+        if self.draw is not None:
+            page["draw"] = self.draw
+        if self.next_cursor is not None:
+            page["next"] = self.next_cursor
+        return page
+
+
+def _int_arg(name, default):
+    value = request.args.get(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def _page_size():
+    max_size = current_app.config.get("DATA_PAGE_SIZE_MAX", MAX_PAGE_SIZE)
+    length = _int_arg("length", current_app.config.get("DATA_PAGE_SIZE", DEFAULT_PAGE_SIZE))
+    # DataTables sends -1 for "all", which is capped as well
+    if length < 0 or length > max_size:
+        return max_size
+    return length
+
+
+def _apply_filters(query, filters):
+    for name, (column, enum) in filters.items():
+        value = request.args.get(name)
+        if value:
+            try:
+                query = query.filter(column == enum.coerce(value))
+            except ValueError:
+                abort(400)
+    return query
+
+
+def _apply_order(query, columns, tie_breaker):
+    """:return: the ordered query and whether the request ordered it by a column"""
+    i = 0
+    ordered = False
+    while f"order[{i}][column]" in request.args:
+        index = _int_arg(f"order[{i}][column]", 0)
+        column = columns.get(request.args.get(f"columns[{index}][data]"))
+        if column is not None:
+            if request.args.get(f"order[{i}][dir]") == "desc":
+                query = query.order_by(column.desc())
+            else:
+                query = query.order_by(column.asc())
+            ordered = True
+        i += 1
+    return query.order_by(tie_breaker), ordered
+
+
+def _count(query):
+    query = query.order_by(None)
+    compiled = query.statement.compile(dialect=query.session.get_bind().dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    count = _counts.get(key)
+    if count is None:
+        count = query.count()
+        _counts.set(key, count)
+    return count
+
+
+def _cursor_of(item, tie_breaker):
+    """Value of the tie breaker of an item, an entity or a row of entities."""
+    entity = tie_breaker.class_
+    if not isinstance(item, entity):
+        item = next(part for part in item if isinstance(part, entity))
+    return getattr(item, tie_breaker.key)
+
+
+def paginate(query, columns, tie_breaker, filters=None, searchable=(), search=None):
+    """
+    Returns one page of query for the current request.
+
+    :param columns: column names used by the front-end table mapped to sortable SQL columns
+    :param tie_breaker: unique integer column appended to the ordering so pages are stable
+    :param filters: request argument mapped to (column, EnumChoices class) it filters on
+    :param searchable: text columns matched by the DataTables search box
+    :param search: function(query, text) applying the search box instead of searchable
+    """
+    draw = request.args.get("draw", type=int)
+    size = _page_size()
+    start = max(_int_arg("start", 0), 0)
+    after = _int_arg("after", None) if "after" in request.args else None
+
+    unfiltered = query
+    query = _apply_filters(query, filters or {})
+    text = request.args.get("search[value]")
+    if text and search:
+        query = search(query, text)
+    elif text and searchable:
+        query = query.filter(or_(*[column.contains(text, autoescape=True) for column in searchable]))
+
+    filtered = query
+    query, ordered = _apply_order(query, columns, tie_breaker)
+    if after is not None:
+        if ordered:
+            abort(400)
+        items = query.filter(tie_breaker > after).limit(size).all()
+    else:
+        items = query.offset(start).limit(size).all()
+
+    # a first page which is not full holds all the filtered rows
+    records_filtered = len(items) if after is None and start == 0 and len(items) < size else None
+    if filtered is unfiltered:
+        records_total = records_filtered = records_filtered if records_filtered is not None else _count(unfiltered)
+    else:
+        records_total = _count(unfiltered)
+        if records_filtered is None:
+            records_filtered = _count(filtered)
+
+    next_cursor = None
+    if not ordered and items and len(items) == size:
+        next_cursor = _cursor_of(items[-1], tie_breaker)
+    return Page(items, draw, records_total, records_filtered, filtered, next_cursor)
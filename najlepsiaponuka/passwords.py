@@ -0,0 +1,164 @@
+"""
+Password hashing off the request threads.
+
+bcrypt costs hundreds of milliseconds of CPU per hash, so hashing and verification run
+in a bounded process pool of PASSWORD_HASH_WORKERS processes (inline when 0). At most
+PASSWORD_HASH_CONCURRENCY hashes run at once on the whole host, half of its cores by
+default, a request waiting longer than PASSWORD_HASH_TIMEOUT seconds for a slot gets
+PasswordServiceBusy, so a burst of logins can not occupy every core. The slots are locks
+of files in PASSWORD_HASH_SLOT_DIR shared by all server processes, every gunicorn worker
+has a pool of its own but they take turns. The cost factor is BCRYPT_LOG_ROUNDS, hashes
+with another cost are rehashed on the next successful login.
+"""
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, the slots are limited in each process only
+    fcntl = None
+
+import bcrypt
+
+from . import app
+
+
+class PasswordServiceBusy(Exception):
+    pass
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+class HostSlots:
+    """
+    Semaphore of all processes of the host. A slot is an exclusive lock of one of count
+    files in directory, the OS releases it when the process holding it dies, so a killed
+    worker does not leak it.
+    """
+
+    def __init__(self, directory, count, poll_interval=0.01):
+        self.paths = [os.path.join(directory, f"slot{i}") for i in range(count)]
+        self.poll_interval = poll_interval
+        self._held = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def _try_lock(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # from a random slot, so the processes do not all try the first one
+            start = random.randrange(len(self.paths))
+            for path in self.paths[start:] + self.paths[:start]:
+                fd = self._try_lock(path)
+                if fd is not None:
+                    self._held.fd = fd
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        # closing the descriptor drops its lock
+        os.close(self._held.fd)
+        del self._held.fd
+
+
+class PasswordService:
+    def __init__(self, rounds=12, workers=1, concurrency=None, timeout=10, slot_dir=None):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        concurrency = concurrency or max(workers, 1)
+        if slot_dir and fcntl is not None:
+            self._slots = HostSlots(slot_dir, concurrency)
+        else:
+            self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawned workers do not inherit locks held by other threads of a forked server
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordServiceBusy()
+        try:
+            if not self.workers:
+                return func(*args)
+            return self._pool().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        if not hashed:
+            return False
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode("utf-8")
+        try:
+            return self._run(_check, hashed, password)
+        except ValueError:
+            # not a bcrypt hash
+            return False
+
+    def needs_rehash(self, hashed):
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode("utf-8")
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# hashes running at once on the host, a pool of a process starts only the processes it uses
+_concurrency = app.config.get("PASSWORD_HASH_CONCURRENCY", max((os.cpu_count() or 2) // 2, 1))
+password_service = PasswordService(rounds=app.config.get("BCRYPT_LOG_ROUNDS", 12),
+                                   workers=app.config.get("PASSWORD_HASH_WORKERS", _concurrency),
+                                   concurrency=_concurrency,
+                                   timeout=app.config.get("PASSWORD_HASH_TIMEOUT", 10),
+                                   slot_dir=app.config.get("PASSWORD_HASH_SLOT_DIR", os.path.join(
+                                       tempfile.gettempdir(), "najlepsiaponuka-password-slots")))
+
+
+def hash_password(password):
+    return password_service.hash(password)
+
+
+def check_password(hashed, password):
+    return password_service.check(hashed, password)
+
+
+def needs_rehash(hashed):
+    return password_service.needs_rehash(hashed)
@@ -0,0 +1,260 @@
+"""
+Cache of rendered pages and JSON responses of the public auction catalog.
+
+Views decorated with @cached store their GET responses under the request path and query
+string, without the arguments of IGNORED_ARGS which change on every request of the same
+page (the DataTables draw counter and the jQuery cache buster), the draw of the request is
+put back into the served JSON. Anonymous visitors share one variant, a logged in user gets its own, as the
+catalog shows their registrations. Every response carries an ETag of its body, so a
+browser revalidating an unchanged page gets 304 without a body.
+
+Entries are not invalidated one by one, the key contains a generation which invalidate()
+bumps whenever auctions change (create, edit, manage, delete, bids, registrations), the
+entries of older generations are never read again and age out of the backend. The
+generation is kept in a file of the instance folder as well, so the invalidations of the
+other server processes and of the scheduler reach the in-memory LRU of every process.
+RESPONSE_CACHE_BACKEND may name a CacheBackend subclass as "module:Class", e.g.
+"najlepsiaponuka.response_cache:FileSystemBackend" to share the cache between processes,
+the in-memory LRU is used otherwise.
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, request, session
+from flask_login import current_user
+from werkzeug.utils import import_string
+
+from . import app
+from .identity import GenerationFile, TTLCache
+
+# query arguments left out of the cache key
+IGNORED_ARGS = ("draw", "_")
+
+
+def _write_file(path, data):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class CacheBackend:
+    """Interface of a response cache storage."""
+    # whether an invalidation reaches the other processes
+    shared = False
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def generation(self):
+        """Current generation of the cached responses."""
+        raise NotImplementedError
+
+    def bump(self):
+        """Starts a new generation, the stored responses are not served anymore."""
+        raise NotImplementedError
+
+    def size(self):
+        return None
+
+
+class MemoryBackend(CacheBackend):
+    """
+    LRU cache in the memory of the process. Its generation is shared through the file
+    RESPONSE_CACHE_GENERATION_FILE, set it to None to keep the invalidations in the process.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, generation_path=None):
+        self._cache = TTLCache(maxsize=maxsize or app.config.get("RESPONSE_CACHE_SIZE", 512),
+                               ttl=ttl or app.config.get("RESPONSE_CACHE_TTL", 300))
+        self._generation = 0
+        self._lock = threading.Lock()
+        generation_path = generation_path or app.config.get(
+            "RESPONSE_CACHE_GENERATION_FILE", os.path.join(app.instance_path, "response_cache_generation"))
+        self._generation_file = GenerationFile(generation_path) if generation_path else None
+
+    @property
+    def shared(self):
+        return self._generation_file is not None
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def generation(self):
+        if self._generation_file is None:
+            return self._generation
+        return self._generation, self._generation_file.get()
+
+    def bump(self):
+        with self._lock:
+            self._generation += 1
+        if self._generation_file is not None:
+            self._generation_file.bump()
+
+    def size(self):
+        return self._cache.stats()["size"]
+
+
+class FileSystemBackend(CacheBackend):
+    """
+    Cache in files of a directory shared by all processes of the server. The generation is
+    kept in a file as well, so an invalidation in one process is seen by all of them.
+    """
+    shared = True
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = os.path.abspath(directory or app.config.get("RESPONSE_CACHE_DIR", "instance/response_cache"))
+        self.ttl = ttl or app.config.get("RESPONSE_CACHE_TTL", 300)
+        self._generation_path = os.path.join(self.directory, "generation")
+        self._generation_file = GenerationFile(self._generation_path)
+        self._last_prune = time.monotonic()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def set(self, key, value):
+        _write_file(self._path(key), pickle.dumps(value))
+        if time.monotonic() - self._last_prune > self.ttl:
+            self._last_prune = time.monotonic()
+            self.prune()
+
+    def prune(self):
+        """Removes expired entries."""
+        deadline = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            if entry.path != self._generation_path and entry.stat().st_mtime < deadline:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def generation(self):
+        return self._generation_file.get()
+
+    def bump(self):
+        self._generation_file.bump()
+
+    def size(self):
+        return sum(1 for entry in os.scandir(self.directory) if entry.path != self._generation_path)
+
+
+backend = import_string(app.config["RESPONSE_CACHE_BACKEND"])() if app.config.get("RESPONSE_CACHE_BACKEND") \
+    else MemoryBackend()
+
+_stats = {"hits": 0, "misses": 0, "not_modified": 0, "bypassed": 0, "invalidations": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _user_class():
+    # User.is_anonymous is a method, only the anonymous user has no user_id
+    user_id = getattr(current_user, "user_id", None)
+    return "anonymous" if user_id is None else f"user:{user_id}"
+
+
+def _cache_path():
+    args = [(name, value) for name, value in request.args.items(multi=True) if name not in IGNORED_ARGS]
+    return f"{request.path}?{urlencode(args)}"
+
+
+def _with_draw(body):
+    """The cached page with the draw counter of the request, DataTables drops pages of other draws."""
+    draw = request.args.get("draw", type=int)
+    if draw is None:
+        return body
+    page = json.loads(body)
+    page["draw"] = draw
+    return json.dumps(page).encode("utf-8")
+
+
+def _respond(entry, user_class):
+    body, mimetype, etag = entry
+    if mimetype == "application/json":
+        body = _with_draw(body)
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers["Vary"] = "Cookie"
+    # browsers and proxies keep the page, but ask whether it changed on every use
+    response.cache_control.no_cache = True
+    if user_class == "anonymous":
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    return response.make_conditional(request)
+
+
+def cached(view):
+    """Serves GET requests of the view from the response cache."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != "GET" or not app.config.get("RESPONSE_CACHE_ENABLED", True) or session.get("_flashes"):
+            # flashed messages are rendered into the page once
+            _count("bypassed")
+            return view(*args, **kwargs)
+
+        user_class = _user_class()
+        key = (backend.generation(), user_class, _cache_path())
+        entry = backend.get(key)
+        if entry is not None:
+            _count("hits")
+        else:
+            _count("misses")
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed or session.modified \
+                    or "Set-Cookie" in response.headers:
+                # the response belongs to this session only, e.g. it carries a new CSRF token
+                return response
+            body = response.get_data()
+            entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+            backend.set(key, entry)
+
+        response = _respond(entry, user_class)
+        if response.status_code == 304:
+            _count("not_modified")
+        return response
+
+    return wrapper
+
+
+def invalidate():
+    """Drops all cached responses, call it after committing a change of auctions."""
+    _count("invalidations")
+    backend.bump()
+
+
+def stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    served = counts["hits"] + counts["misses"]
+    counts["hit_rate"] = counts["hits"] / served if served else None
+    counts["backend"] = type(backend).__name__
+    counts["size"] = backend.size()
+    return counts
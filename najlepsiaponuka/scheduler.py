@@ -0,0 +1,240 @@
+"""
+Background scheduler moving auctions through their lifecycle on time.
+
+Every tick activates CONFIRMED auctions whose start_date has passed and closes ACTIVE
+auctions whose end_date has passed, picking the winner, the leading bidder of an open
+auction or the best sealed bid, see bidding.winning_bids(). Due auctions are activated
+through the (state, start_date) index. Deadlines of ACTIVE auctions are kept in a
+DeadlineQueue, loaded from the database on start, so ticks with nothing to close do not
+query the database at all. Changes are committed in batches of batch_size auctions.
+
+Bids in the soft close window move end_date in the web processes, the queue is not told.
+It may only hold an earlier deadline then, the closing checks end_date again under the row
+lock and requeues the auction with its new deadline. Auctions activated or rescheduled in
+manageAuction are picked up every resync_interval seconds, by reading the ACTIVE auctions
+due within the next interval from the (state, end_date) index.
+"""
+import datetime
+import heapq
+import threading
+
+from . import app, db, event_log, events, response_cache
+from .bidding import reveal_sealed_bids, winning_bids
+from .models import Auction, AuctionState
+
+
+class DeadlineQueue:
+    """
+    Min-heap of auction deadlines. Setting a deadline pushes a new entry in O(log n), the
+    replaced entry stays in the heap and is skipped when it comes to the top.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, auction_id):
+        return auction_id in self._deadlines
+
+    def set(self, auction_id, deadline):
+        if self._deadlines.get(auction_id) == deadline:
+            return
+        self._deadlines[auction_id] = deadline
+        heapq.heappush(self._heap, (deadline, auction_id))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def discard(self, auction_id):
+        self._deadlines.pop(auction_id, None)
+
+    def clear(self):
+        self._heap.clear()
+        self._deadlines.clear()
+
+    def _compact(self):
+        self._heap = [(deadline, auction_id) for auction_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def _skip_replaced(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        self._skip_replaced()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit):
+        """Removes and returns up to limit auction ids with the earliest deadlines not after now."""
+        due = []
+        while len(due) < limit:
+            self._skip_replaced()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            deadline, auction_id = heapq.heappop(self._heap)
+            del self._deadlines[auction_id]
+            due.append(auction_id)
+        return due
+
+
+class AuctionScheduler:
+    def __init__(self, clock=datetime.datetime.now, batch_size=500, interval=1.0, resync_interval=60.0):
+        """
+        :param clock: returns the current time, replaceable with a fake clock in tests
+        :param interval: seconds to wait between ticks
+        :param resync_interval: seconds between reads of the soon due auctions changed by others
+        """
+        self.clock = clock
+        self.batch_size = batch_size
+        self.interval = interval
+        self.resync_interval = datetime.timedelta(seconds=resync_interval)
+        self.deadlines = DeadlineQueue()
+        self._next_resync = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _due(self, state, column, now):
+        return [auction_id for (auction_id,) in db.session.query(Auction.auction_id)
+                .filter(Auction.state == state, column <= now)
+                .order_by(column)
+                .limit(self.batch_size)]
+
+    def _publish(self, auction_ids):
+        response_cache.invalidate()
+        states = [events.auction_state(auction) for auction in
+                  Auction.query.filter(Auction.auction_id.in_(auction_ids))]
+        for state in states:
+            events.publish_auction_state(state)
+
+    def _queue_active(self, query):
+        for auction_id, end_date in query.filter(Auction.state == AuctionState.ACTIVE, Auction.end_date.isnot(None)):
+            self.deadlines.set(auction_id, end_date)
+
+    def load_deadlines(self, now):
+        """Fills the deadline queue with all ACTIVE auctions."""
+        self.deadlines.clear()
+        self._queue_active(db.session.query(Auction.auction_id, Auction.end_date))
+        db.session.commit()
+        self._next_resync = now + self.resync_interval
+
+    def resync(self, now):
+        """Queues the ACTIVE auctions due before the next resync, which others could have changed."""
+        horizon = now + 2 * self.resync_interval
+        self._queue_active(db.session.query(Auction.auction_id, Auction.end_date)
+                           .filter(Auction.end_date <= horizon))
+        db.session.commit()
+        self._next_resync = now + self.resync_interval
+
+    def activate_due(self, now):
+        auction_ids = self._due(AuctionState.CONFIRMED, Auction.start_date, now)
+        if auction_ids:
+            # the state condition keeps the update correct if someone changed the auction meanwhile
+            Auction.query.filter(Auction.auction_id.in_(auction_ids), Auction.state == AuctionState.CONFIRMED) \
+                .update({Auction.state: AuctionState.ACTIVE}, synchronize_session=False)
+            event_log.record_states(auction_ids)
+            self._queue_active(db.session.query(Auction.auction_id, Auction.end_date)
+                               .filter(Auction.auction_id.in_(auction_ids)))
+            db.session.commit()
+            self._publish(auction_ids)
+        return auction_ids
+
+    def close_due(self, now):
+        auction_ids = self.deadlines.pop_due(now, self.batch_size)
+        if auction_ids:
+            db.session.commit()
+            closed = close_auctions(auction_ids, now)
+            # extended by bids meanwhile, or changed in manageAuction
+            self._queue_active(db.session.query(Auction.auction_id, Auction.end_date)
+                               .filter(Auction.auction_id.in_(set(auction_ids) - set(closed))))
+            db.session.commit()
+            if closed:
+                self._publish(closed)
+        return auction_ids
+
+    def tick(self):
+        """Processes all due auctions, batch by batch, returns numbers of activated and closed auctions."""
+        now = self.clock()
+        if self._next_resync is None:
+            self.load_deadlines(now)
+        elif now >= self._next_resync:
+            self.resync(now)
+        activated = closed = 0
+        while True:
+            batch = self.activate_due(now)
+            activated += len(batch)
+            if len(batch) < self.batch_size:
+                break
+        while True:
+            batch = self.close_due(now)
+            closed += len(batch)
+            if len(batch) < self.batch_size:
+                break
+        return activated, closed
+
+    def run(self):
+        """Ticks every interval seconds, or when the next auction ends, until stopped."""
+        with app.app_context():
+            while not self._stop.is_set():
+                try:
+                    self.tick()
+                except Exception:
+                    app.logger.exception("Auction scheduler tick failed.")
+                    db.session.rollback()
+                    # deadlines popped by the failed tick are loaded again
+                    self._next_resync = None
+                finally:
+                    db.session.remove()
+                self._stop.wait(self._wait())
+
+    def _wait(self):
+        """Seconds until the next tick, shorter than interval when an auction ends sooner."""
+        next_deadline = self.deadlines.next_deadline()
+        if next_deadline is None:
+            return self.interval
+        return min(self.interval, max((next_deadline - self.clock()).total_seconds(), 0))
+
+    def start(self):
+        """Runs the scheduler in a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="auction-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def close_auctions(auction_ids, now=None):
+    """
+    Closes the ACTIVE auctions among auction_ids and stores their winners and final prices,
+    revealing the sealed bids. The caller commits.
+
+    The auctions are locked first, waiting for bids holding a lock on them, and the winners
+    are read only after it, so a bid committed right before closing is not missed. Call it
+    at the start of a transaction, so the winners are not read from an older snapshot.
+    :param now: close only the auctions whose end_date is not after now, which bids in the
+                soft close window may have moved
+    :return: ids of the closed auctions
+    """
+    query = db.session.query(Auction.auction_id) \
+        .filter(Auction.auction_id.in_(auction_ids), Auction.state == AuctionState.ACTIVE)
+    if now is not None:
+        query = query.filter(Auction.end_date <= now)
+    auction_ids = [auction_id for (auction_id,) in query.with_for_update()]
+    if not auction_ids:
+        return []
+    Auction.query.filter(Auction.auction_id.in_(auction_ids)) \
+        .update({Auction.state: AuctionState.CLOSED}, synchronize_session=False)
+    reveal_sealed_bids(auction_ids)
+    winners = winning_bids(auction_ids)
+    if winners:
+        # the price of an open auction is its winning bid already, of a sealed one it is revealed here
+        db.session.bulk_update_mappings(Auction, [
+            {"auction_id": auction_id, "winner_id": creator_id, "price": price}
+            for auction_id, (creator_id, price) in winners.items()
+        ])
+    event_log.record_states(auction_ids)
+    return auction_ids
@@ -0,0 +1,113 @@
+"""
+Search over auction titles and descriptions.
+
+An inverted index in the search_term table maps every word of an auction to the auction,
+so a search reads index ranges of its words instead of scanning every description with
+LIKE. Words are folded to lowercase ASCII ("Nábytok" and "nabytok" are the same word) and
+every word of a query matches as a prefix, which also covers Slovak inflections
+("stol" finds "stolička", "auto" finds "autom"). All words of a query have to match.
+
+create_auction and edit_auction update the index of the auction in their transaction,
+`flask reindex-search` rebuilds it from scratch.
+"""
+import re
+import unicodedata
+
+from . import db
+from .models import Auction, SearchTerm
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+WORD_PATTERN = re.compile(r"\w+")
+
+# facet name mapped to the column it counts
+FACETS = {
+    "category": Auction.category,
+    "type": Auction.type,
+    "state": Auction.state,
+}
+
+
+def fold(text):
+    """Lowercase text without diacritics."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def terms(text):
+    """Set of indexed words of text."""
+    return {word[:MAX_TERM_LENGTH] for word in WORD_PATTERN.findall(fold(text)) if len(word) >= MIN_TERM_LENGTH}
+
+
+def auction_terms(title, description):
+    return terms(title) | terms(description)
+
+
+def index_auction(auction):
+    """Replaces the indexed words of the auction, the caller commits."""
+    if auction.auction_id is None:
+        db.session.flush()
+    SearchTerm.query.filter_by(auction_id=auction.auction_id).delete(synchronize_session=False)
+    rows = [{"term": term, "auction_id": auction.auction_id}
+            for term in auction_terms(auction.title, auction.description)]
+    if rows:
+        db.session.execute(SearchTerm.__table__.insert(), rows)
+
+
+def rebuild_index(batch_size=10000):
+    """Indexes all auctions again, batch by batch, returns the number of indexed auctions."""
+    SearchTerm.query.delete(synchronize_session=False)
+    db.session.commit()
+
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = db.session.query(Auction.auction_id, Auction.title, Auction.description) \
+            .filter(Auction.auction_id > last_id) \
+            .order_by(Auction.auction_id) \
+            .limit(batch_size).all()
+        rows = [{"term": term, "auction_id": auction_id}
+                for auction_id, title, description in batch
+                for term in auction_terms(title, description)]
+        if rows:
+            db.session.execute(SearchTerm.__table__.insert(), rows)
+        db.session.commit()
+        indexed += len(batch)
+        if len(batch) < batch_size:
+            return indexed
+        last_id = batch[-1].auction_id
+
+
+def _prefix_range(word):
+    """Bounds of the words starting with word, a range works with the index where LIKE may not."""
+    return word, word[:-1] + chr(ord(word[-1]) + 1)
+
+
+def match(query, text):
+    """
+    Restricts a query over Auction to auctions containing every word of text.
+    Text without any indexed word matches nothing.
+    """
+    words = sorted(terms(text), key=len, reverse=True)[:MAX_QUERY_TERMS]
+    if not words:
+        return query.filter(db.false())
+    for word in words:
+        # the (term, auction_id) primary key makes each prefix a range scan of the index
+        lower, upper = _prefix_range(word)
+        query = query.filter(Auction.auction_id.in_(
+            db.session.query(SearchTerm.auction_id).filter(SearchTerm.term >= lower, SearchTerm.term < upper)
+        ))
+    return query
+
+
+def facet_counts(query):
+    """Number of auctions of query for every value of each facet."""
+    counts = {name: {} for name in FACETS}
+    # one grouping by all facets together, there are only a few dozen combinations
+    rows = query.order_by(None).with_entities(*FACETS.values(), db.func.count()).group_by(*FACETS.values())
+    for *values, count in rows:
+        for name, value in zip(FACETS, values):
+            if value is not None:
+                counts[name][str(value)] = counts[name].get(str(value), 0) + count
+    return counts
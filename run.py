@@ -1,4 +1,6 @@
-from najlepsiaponuka import db_setup
+import os
+
+from najlepsiaponuka import db_setup, event_log, search
 from najlepsiaponuka.app import app
 from najlepsiaponuka.models import *
 
@@ -7,17 +9,29 @@ def setup_db():
     db_setup.main()
 
 
+def upgrade_db():
+    columns, indexes, sealed_bids = db_setup.upgrade()
+    print(f"Added columns: {', '.join(columns) or 'none'}")
+    print(f"Created indexes: {', '.join(indexes) or 'none'}")
+    print(f"Moved {sealed_bids} bids of sealed auctions to sealed_bid")
+    db_setup.rebuild_bid_summary()
+    print(f"Indexed {search.rebuild_index()} auctions for search")
+    print(f"Backfilled the event log of {event_log.backfill()} auctions")
+
+
 def force_create(table):
     db_setup.drop_table(table)
     db_setup.create_table(table)
 
 
 def run_app():
-    app.run(debug=True)
+    # development server only, production runs gunicorn -c gunicorn.conf.py wsgi:app
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1")
 
 
 if __name__ == "__main__":
     # force_create(AuctionRegistration)
     # setup_db()
+    # upgrade_db()
     run_app()
 
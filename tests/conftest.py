@@ -0,0 +1,92 @@
+"""
+Fixtures shared by the tests. The application runs on an in-memory SQLite database, the
+tables are created for every test and dropped after it.
+
+Run from the repository root: python -m pytest tests
+"""
+import datetime
+import os
+import tempfile
+from decimal import Decimal
+
+import pytest
+from flask_login.utils import _create_identifier
+
+from najlepsiaponuka import app
+
+# the files shared by the server processes are kept out of the instance folder, set before
+# the modules of the application read their settings
+_runtime = tempfile.TemporaryDirectory(prefix="najlepsiaponuka-tests-")
+app.config.update(RESPONSE_CACHE_GENERATION_FILE=os.path.join(_runtime.name, "response_cache_generation"),
+                  IDENTITY_GENERATION_FILE=os.path.join(_runtime.name, "identity_generation"),
+                  PASSWORD_HASH_SLOT_DIR=os.path.join(_runtime.name, "password_slots"))
+
+import najlepsiaponuka.app  # noqa: E402, F401
+from najlepsiaponuka import db, db_setup, identity
+from najlepsiaponuka.models import Auction, AuctionRegistration, AuctionRegistrationState, AuctionRules, \
+    AuctionState, AuctionType, User, UserType
+
+
+@pytest.fixture
+def client():
+    app.config.update(SQLALCHEMY_DATABASE_URI="sqlite://", RESPONSE_CACHE_ENABLED=False, TESTING=True)
+    with app.app_context():
+        db_setup.create_tables()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+    # the users of one test do not exist in the next one
+    identity.identity_cache.clear()
+
+
+@pytest.fixture
+def log_in():
+    """Returns a function logging the user with the given email in on a test client."""
+
+    def log_in(client, email):
+        with client.session_transaction() as session:
+            session["_user_id"] = email
+            session["_fresh"] = True
+            # the identifier of the client's address and user agent, a different one fails the session
+            # protection, which then modifies the session on every request
+            with app.test_request_context(environ_base=client.environ_base):
+                session["_id"] = _create_identifier()
+
+    return log_in
+
+
+@pytest.fixture
+def make_user(client):
+    """Returns a function adding a user, its email is its name at test.xyz."""
+
+    def make_user(name, type=UserType.BASIC):
+        user = User(type=type, name=name, surname="test", email=f"{name}@test.xyz", password="")
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+def make_auction(client):
+    """
+    Returns a function adding an active open offer auction of creator priced 100 with the
+    registrations of bidders allowed, the columns override the defaults.
+    """
+
+    def make_auction(creator, bidders=(), **columns):
+        defaults = dict(price=Decimal(100), start_price=Decimal(100), minimal_bid=Decimal(1), title="Auction",
+                        description="Auction of a test", rules=AuctionRules.OPEN, type=AuctionType.OFFER,
+                        state=AuctionState.ACTIVE, creator_id=creator.user_id,
+                        creation_timestamp=datetime.datetime.now())
+        auction = Auction(**{**defaults, **columns})
+        db.session.add(auction)
+        db.session.flush()
+        for bidder in bidders:
+            db.session.add(AuctionRegistration(auction_id=auction.auction_id, creator_id=bidder.user_id,
+                                               state=AuctionRegistrationState.ALLOWED))
+        db.session.commit()
+        return auction
+
+    return make_auction
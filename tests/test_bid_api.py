@@ -0,0 +1,42 @@
+"""
+/api/auctionBid and /api/auctionProxyBid take a JSON object only, a form post of another
+site must not bid in the session of a logged in user.
+"""
+import pytest
+
+from najlepsiaponuka.models import Auction
+
+
+@pytest.fixture
+def auction(make_user, make_auction, client, log_in):
+    bidder = make_user("bidder")
+    auction = make_auction(make_user("seller"), bidders=[bidder])
+    log_in(client, bidder.email)
+    return auction
+
+
+@pytest.mark.parametrize("url, name", [("/api/auctionBid", "price"), ("/api/auctionProxyBid", "price_limit")])
+def test_json_bid_is_accepted(client, auction, url, name):
+    response = client.post(f"{url}/{auction.auction_id}", json={name: "150"})
+    assert response.status_code == 200
+    assert response.get_json()["accepted"]
+
+
+@pytest.mark.parametrize("url, name", [("/api/auctionBid", "price"), ("/api/auctionProxyBid", "price_limit")])
+def test_form_post_is_rejected(client, auction, url, name):
+    response = client.post(f"{url}/{auction.auction_id}", data={name: "150"})
+    assert response.status_code == 400
+    assert Auction.query.get(auction.auction_id).bid_count == 0
+
+
+@pytest.mark.parametrize("body", [[1], "150", 150, None, {}, {"price": "NaN"}, {"price": "Infinity"},
+                                  {"price": "abc"}, {"price": [150]}])
+def test_invalid_body_is_rejected(client, auction, body):
+    response = client.post(f"/api/auctionBid/{auction.auction_id}", json=body)
+    assert response.status_code == 400
+
+
+def test_text_body_is_rejected(client, auction):
+    response = client.post(f"/api/auctionBid/{auction.auction_id}", data='{"price": "150"}',
+                           content_type="text/plain")
+    assert response.status_code == 400
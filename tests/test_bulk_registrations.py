@@ -0,0 +1,83 @@
+"""
+/api/manageRegistrations/<auction_id>/<decision> decides registrations of an auction the
+auctioneer manages, listed in a JSON body only.
+"""
+import pytest
+
+from najlepsiaponuka import db
+from najlepsiaponuka.models import Auction, AuctionRegistration, AuctionRegistrationState, UserType
+
+
+@pytest.fixture
+def registrations(client, make_user, make_auction, log_in):
+    """Ids of five pending registrations of an auction managed by the logged in auctioneer."""
+    auction = make_auction(make_user("seller"))
+    bidders = [make_user(f"bidder{i}") for i in range(5)]
+    for bidder in bidders:
+        db.session.add(AuctionRegistration(auction_id=auction.auction_id, creator_id=bidder.user_id,
+                                           state=AuctionRegistrationState.CREATED))
+    db.session.commit()
+    log_in(client, make_user("auctioneer", UserType.AUCTIONEER).email)
+    return auction.auction_id, [r.auction_registration_id for r in AuctionRegistration.query]
+
+
+def states():
+    db.session.expire_all()
+    return [r.state for r in AuctionRegistration.query.order_by(AuctionRegistration.auction_registration_id)]
+
+
+def test_listed_registrations_are_decided(client, registrations):
+    auction_id, ids = registrations
+    response = client.post(f"/api/manageRegistrations/{auction_id}/allow", json={"ids": ids[:2]})
+    assert response.status_code == 200
+    assert response.get_json()["updated"] == 2
+    assert states() == [AuctionRegistrationState.ALLOWED] * 2 + [AuctionRegistrationState.CREATED] * 3
+
+
+def test_all_pending_registrations_are_decided(client, registrations):
+    auction_id, ids = registrations
+    client.post(f"/api/manageRegistrations/{auction_id}/allow", json={"ids": [ids[0]]})
+    response = client.post(f"/api/manageRegistrations/{auction_id}/deny", json={"all": True})
+    assert response.get_json()["updated"] == 4
+    assert states() == [AuctionRegistrationState.ALLOWED] + [AuctionRegistrationState.FORBIDDEN] * 4
+
+
+def test_form_post_is_rejected(client, registrations):
+    auction_id, ids = registrations
+    response = client.post(f"/api/manageRegistrations/{auction_id}/allow", data={"all": "1"})
+    assert response.status_code == 400
+    assert states() == [AuctionRegistrationState.CREATED] * 5
+
+
+@pytest.mark.parametrize("body", [[1], "1", {"ids": "12"}, {"ids": [1.5]}, {"ids": ["x"]}, {"ids": [True]},
+                                  {"all": "maybe"}])
+def test_invalid_body_is_rejected(client, registrations, body):
+    auction_id, ids = registrations
+    response = client.post(f"/api/manageRegistrations/{auction_id}/allow", json=body)
+    assert response.status_code == 400
+    assert states() == [AuctionRegistrationState.CREATED] * 5
+
+
+def test_auction_of_another_auctioneer_is_forbidden(client, registrations, make_user, log_in):
+    auction_id, ids = registrations
+    Auction.query.get(auction_id).auctioneer_id = make_user("other", UserType.AUCTIONEER).user_id
+    db.session.commit()
+    response = client.post(f"/api/manageRegistrations/{auction_id}/allow", json={"all": True})
+    assert response.status_code == 403
+    assert states() == [AuctionRegistrationState.CREATED] * 5
+
+
+def test_own_auction_is_forbidden(client, make_user, make_auction, log_in):
+    auctioneer = make_user("auctioneer", UserType.AUCTIONEER)
+    auction = make_auction(auctioneer)
+    log_in(client, auctioneer.email)
+    response = client.post(f"/api/manageRegistrations/{auction.auction_id}/allow", json={"all": True})
+    assert response.status_code == 403
+
+
+def test_basic_user_is_forbidden(client, registrations, make_user, log_in):
+    auction_id, ids = registrations
+    log_in(client, make_user("basic").email)
+    response = client.post(f"/api/manageRegistrations/{auction_id}/allow", json={"all": True})
+    assert response.status_code == 403
+    assert states() == [AuctionRegistrationState.CREATED] * 5
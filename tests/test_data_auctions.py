@@ -0,0 +1,46 @@
+"""
+The number of SQL statements of /api/data/auctions must not grow with the auctions on the
+page, the registrations of the user on the page are loaded in one query.
+
+Run from the repository root: python -m pytest tests
+"""
+import pytest
+from sqlalchemy import event
+
+from najlepsiaponuka import db, db_setup
+
+
+def statements(client, url):
+    """Number of SQL statements executed for a GET of url and its JSON."""
+    count = 0
+
+    def counter(*args):
+        nonlocal count
+        count += 1
+
+    event.listen(db.engine, "before_cursor_execute", counter)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", counter)
+    assert response.status_code == 200
+    return count, response.get_json()
+
+
+@pytest.mark.parametrize("logged_in", [False, True])
+def test_statement_count_does_not_grow_with_auctions(client, log_in, logged_in):
+    url = "/api/data/auctions?draw=1&start=0&length=1000"
+    results = []
+    for auctions in (20, 180):
+        # the second call adds to the first, 20 and then 200 auctions
+        db_setup.seed_tables(users=50, auctions=auctions, registrations_per_auction=10, bids_per_auction=5)
+        db.session.remove()
+        if logged_in:
+            log_in(client, "user1@seed.najlepsiaponuka.xyz")
+        # the first request caches the identity of the user
+        statements(client, url)
+        results.append(statements(client, url))
+
+    (small_count, small_page), (large_count, large_page) = results
+    assert len(large_page["data"]) > len(small_page["data"]) > 0
+    assert large_count == small_count
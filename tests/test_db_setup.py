@@ -0,0 +1,84 @@
+"""
+The upgrade path of db_setup: a database created before the indexes, the summary columns of
+the auctions or sealed_bid existed is brought up to date in place, without losing its data.
+"""
+import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+
+from najlepsiaponuka import db, db_setup
+from najlepsiaponuka.models import AuctionRegistration, AuctionRegistrationState, AuctionRules, Bid, SealedBid, \
+    User, UserType
+
+
+def index_names(table):
+    return {index["name"] for index in inspect(db.engine).get_indexes(table)}
+
+
+def test_upgrade_creates_missing_indexes(client):
+    db_setup.drop_indexes()
+    assert "ix_user_email" not in index_names("user")
+
+    columns, indexes, moved = db_setup.upgrade()
+
+    assert columns == []
+    assert {"ix_user_email", "ix_auction_registration_auction_creator",
+            "ix_bid_auction_creator_price"} <= set(indexes)
+    assert "ix_bid_auction_creator_price" in index_names("bid")
+    assert moved == 0
+    # a second upgrade has nothing left to do
+    assert db_setup.upgrade() == ([], [], 0)
+
+
+def test_upgrade_adds_missing_columns_keeping_rows(client, make_user, make_auction):
+    seller = make_user("seller")
+    auction_id = make_auction(seller, title="Old auction").auction_id
+    db.session.remove()
+    db.session.execute("DROP INDEX ix_auction_state_end_date")
+    db.session.execute("ALTER TABLE auction DROP COLUMN leading_bid_timestamp")
+    db.session.commit()
+
+    columns, indexes, _ = db_setup.upgrade()
+
+    assert columns == ["auction.leading_bid_timestamp"]
+    assert indexes == ["ix_auction_state_end_date"]
+    assert db.session.execute("SELECT title FROM auction WHERE auction_id = :id",
+                              {"id": auction_id}).scalar() == "Old auction"
+
+
+def test_upgrade_moves_bids_of_closed_auctions(client, make_user, make_auction):
+    seller, first, second = make_user("seller"), make_user("first"), make_user("second")
+    auction = make_auction(seller, bidders=(first, second), rules=AuctionRules.CLOSED)
+    start = datetime.datetime(2021, 1, 1)
+    # bids placed on a closed auction before sealed_bid existed, first bid twice
+    for minutes, bidder, price in ((0, first, 120), (1, second, 110), (2, first, 150)):
+        db.session.add(Bid(auction_id=auction.auction_id, creator_id=bidder.user_id, price=Decimal(price),
+                           timestamp=start + datetime.timedelta(minutes=minutes)))
+    db.session.commit()
+
+    _, _, moved = db_setup.upgrade()
+
+    assert moved == 2
+    assert Bid.query.filter_by(auction_id=auction.auction_id).count() == 0
+    sealed = {bid.creator_id: bid.price for bid in SealedBid.query.filter_by(auction_id=auction.auction_id)}
+    # only the first bid of every user is kept
+    assert sealed == {first.user_id: 120, second.user_id: 110}
+
+
+def test_email_is_unique(client, make_user):
+    make_user("twice")
+    db.session.add(User(type=UserType.BASIC, name="twice", surname="test", email="twice@test.xyz", password=""))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+
+
+def test_user_registers_to_an_auction_once(client, make_user, make_auction):
+    seller, bidder = make_user("seller"), make_user("bidder")
+    auction = make_auction(seller, bidders=(bidder,))
+    db.session.add(AuctionRegistration(auction_id=auction.auction_id, creator_id=bidder.user_id,
+                                       state=AuctionRegistrationState.CREATED))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
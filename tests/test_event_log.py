@@ -0,0 +1,43 @@
+"""
+The auction event log: bids append events in their transaction, replay() rebuilds an auction
+at any event and check() finds the auctions whose table row disagrees with the log.
+"""
+from decimal import Decimal
+
+from najlepsiaponuka import db, event_log
+from najlepsiaponuka.bidding import place_bid
+from najlepsiaponuka.models import Auction, AuctionEvent, AuctionEventKind
+
+
+def test_bids_replay_to_the_auction(client, make_user, make_auction):
+    seller, first, second = make_user("seller"), make_user("first"), make_user("second")
+    auction_id = make_auction(seller, bidders=(first, second)).auction_id
+    assert event_log.backfill() == 1
+    assert place_bid(auction_id, first, Decimal(110)).accepted
+    assert place_bid(auction_id, second, Decimal(120)).accepted
+    # check() expunges the session, the users are detached after it
+    first_id, second_id = first.user_id, second.user_id
+
+    assert event_log.check() == []
+    first_bid = AuctionEvent.query.filter_by(auction_id=auction_id, kind=AuctionEventKind.BID) \
+        .order_by(AuctionEvent.event_id).first()
+    snapshot = event_log.replay(auction_id, until_event_id=first_bid.event_id)
+    assert (snapshot.price, snapshot.bid_count, snapshot.leading_bidder_id) == (110, 1, first_id)
+    snapshot = event_log.replay(auction_id)
+    assert (snapshot.price, snapshot.bid_count, snapshot.leading_bidder_id) == (120, 2, second_id)
+
+
+def test_check_reports_differences(client, make_user, make_auction):
+    seller = make_user("seller")
+    changed = make_auction(seller).auction_id
+    removed = make_auction(seller).auction_id
+    unlogged = make_auction(seller).auction_id
+    event_log.backfill()
+    db.session.execute(db.update(Auction).where(Auction.auction_id == changed).values(price=Decimal(500)))
+    db.session.execute(db.delete(Auction).where(Auction.auction_id == removed))
+    db.session.execute(db.delete(AuctionEvent).where(AuctionEvent.auction_id == unlogged))
+    db.session.commit()
+
+    assert sorted(event_log.check()) == [(changed, "price", 100, 500),
+                                         (removed, "deleted", False, True),
+                                         (unlogged, "events", None, "missing")]
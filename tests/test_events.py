@@ -0,0 +1,30 @@
+"""
+A watcher whose queue is full loses the oldest messages and keeps the newest, the current
+state of the auction.
+"""
+import pytest
+
+from najlepsiaponuka import events
+
+
+@pytest.mark.parametrize("broker", [events.MemoryBroker(maxsize=2), events.PollingBroker(maxsize=2, interval=3600)])
+def test_full_queue_keeps_the_newest_messages(broker):
+    subscription = broker.subscribe("auction:1")
+    try:
+        for price in ("1", "2", "3"):
+            broker.publish("auction:1", price)
+        assert [subscription.get(timeout=0) for _ in range(3)] == ["2", "3", None]
+    finally:
+        subscription.close()
+
+
+def test_polled_state_equal_to_the_last_one_is_not_delivered_again():
+    broker = events.PollingBroker(maxsize=2, interval=3600)
+    subscription = broker.subscribe("auction:1")
+    try:
+        broker.publish("auction:1", "1")
+        broker._deliver("auction:1", "1", float("inf"))
+        broker._deliver("auction:1", "2", float("inf"))
+        assert [subscription.get(timeout=0) for _ in range(3)] == ["1", "2", None]
+    finally:
+        subscription.close()
@@ -0,0 +1,32 @@
+"""
+Loading the application does not import phonenumbers, the phone validators import it when
+they first run.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+from wtforms.validators import ValidationError
+
+from najlepsiaponuka.app import app
+from najlepsiaponuka.forms import UpdateForm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_wsgi_does_not_import_phonenumbers():
+    # a fresh interpreter, this one has imported everything the other tests needed
+    loaded = subprocess.run([sys.executable, "-c", "import sys, wsgi; print('phonenumbers' in sys.modules)"],
+                            cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    assert loaded.strip().splitlines()[-1] == "False"
+
+
+def test_phone_is_validated_on_first_use():
+    with app.test_request_context():
+        form = UpdateForm(meta={"csrf": False})
+        form.phone.data = "+421 900 000 00"
+        with pytest.raises(ValidationError):
+            form.validate_phone(form.phone)
+        form.phone.data = "+421 905 123 456"
+        form.validate_phone(form.phone)
@@ -0,0 +1,33 @@
+"""
+A user changed in another server process is not served from the identity cache of this
+one once that process bumped the shared generation.
+"""
+from najlepsiaponuka import db, identity
+from najlepsiaponuka.identity import GenerationFile
+from najlepsiaponuka.models import User, UserType
+
+
+def test_invalidation_of_another_process_is_seen(client, make_user):
+    email = make_user("admin", UserType.ADMIN).email
+    assert identity.load_identity(email).type == UserType.ADMIN
+
+    # another process demotes the admin, this one still has it cached
+    User.query.filter_by(email=email).update({User.type: UserType.BASIC})
+    db.session.commit()
+    db.session.expunge_all()
+    assert identity.load_identity(email).type == UserType.ADMIN
+
+    GenerationFile(identity.identity_generation.path).bump()
+    db.session.expunge_all()
+    assert identity.load_identity(email).type == UserType.BASIC
+
+
+def test_deleted_user_is_not_loaded_after_invalidation(client, make_user):
+    email = make_user("user").email
+    assert identity.load_identity(email) is not None
+    User.query.filter_by(email=email).delete()
+    db.session.commit()
+    db.session.expunge_all()
+    # as in another process, only the shared generation is bumped
+    GenerationFile(identity.identity_generation.path).bump()
+    assert identity.load_identity(email) is None
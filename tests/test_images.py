@@ -0,0 +1,80 @@
+"""
+The content addressed image store: variants are rendered once per content, auctions uploading
+the same bytes share them, and the last release removes them.
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from najlepsiaponuka.app import app
+from najlepsiaponuka import db, images
+from najlepsiaponuka.models import StoredImage
+
+
+@pytest.fixture
+def store(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    return tmp_path
+
+
+def photo(color="red", size=(2000, 1000)):
+    data = io.BytesIO()
+    Image.new("RGB", size, color).save(data, "PNG")
+    return data.getvalue()
+
+
+def upload(auction, data):
+    return images.store_upload(auction, FileStorage(io.BytesIO(data), filename="photo.PNG"))
+
+
+def test_render_variants_once(store):
+    raw_path = store / "photo.png"
+    raw_path.write_bytes(photo())
+
+    digest = images.render_variants(str(raw_path), str(store))
+
+    for name, size in images.VARIANTS.items():
+        with Image.open(store / images.variant_filename(digest, name)) as variant:
+            assert max(variant.size) == size
+    detail = store / images.variant_filename(digest, "detail")
+    modified = detail.stat().st_mtime_ns
+    assert images.render_variants(str(raw_path), str(store)) == digest
+    assert detail.stat().st_mtime_ns == modified
+
+
+def test_same_content_is_stored_once(store, make_user, make_auction):
+    seller = make_user("seller")
+    first, second = make_auction(seller), make_auction(seller)
+    data = photo()
+
+    raw_path = upload(first, data)
+    db.session.commit()
+    assert first.image.startswith(images.RAW_PREFIX)
+    digest = images.render_variants(raw_path, images.store_folder())
+    assert images.digest_of(first.image) == digest
+
+    # the variants exist, the second upload only takes a reference
+    assert upload(second, data) is None
+    db.session.commit()
+    assert second.image == images.variant_image(digest)
+    assert StoredImage.query.get(digest).refcount == 2
+    assert images.image_url(second.image, "thumb") == images.variant_image(digest, "thumb")
+
+    variants = [store / images.variant_filename(digest, name) for name in images.VARIANTS]
+    images.release(second.image)
+    assert StoredImage.query.get(digest).refcount == 1
+    assert all(path.exists() for path in variants)
+
+    images.release(first.image)
+    assert StoredImage.query.get(digest) is None
+    assert not any(path.exists() for path in variants)
+    assert not os.path.exists(raw_path)
+
+
+def test_other_images_are_left_alone(store):
+    assert images.digest_of("static/images/placeholder.png") is None
+    assert images.image_url("static/images/placeholder.png", "thumb") == "static/images/placeholder.png"
+    images.release("static/images/placeholder.png")
@@ -0,0 +1,65 @@
+"""
+Per-request instrumentation: every request is counted under its endpoint with its status,
+queries and timings, slow requests and repeated statements are logged.
+"""
+import logging
+
+import pytest
+from flask import g
+
+from najlepsiaponuka.app import app
+from najlepsiaponuka import instrumentation
+from najlepsiaponuka.models import AuctionCategory
+
+URL = "/api/data/auctions?draw=1&start=0&length=10"
+
+
+@pytest.fixture
+def stats(client):
+    instrumentation.reset()
+    yield instrumentation.stats
+    instrumentation.reset()
+
+
+def test_requests_are_counted_by_endpoint(client, stats, make_user, make_auction):
+    make_auction(make_user("seller"), category=AuctionCategory.OTHERS)
+    assert client.get(URL).status_code == 200
+    assert client.get(URL).status_code == 200
+    assert client.get("/no/such/page").status_code == 404
+
+    endpoints = stats()
+    auctions = endpoints["data_auctions"]
+    assert auctions["requests"] == 2
+    assert auctions["statuses"] == {200: 2}
+    assert auctions["queries"]["count"] == 2
+    assert auctions["queries"]["mean"] > 0
+    assert sum(count for _, count in auctions["total_ms"]["buckets"]) == 2
+    assert endpoints["<unmatched>"]["statuses"] == {404: 1}
+
+
+def test_slow_requests_are_logged(client, stats, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, "SLOW_REQUEST_MS", 0)
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        client.get(URL)
+
+    assert stats()["data_auctions"]["slow"] == 1
+    assert any(record.message.startswith("Slow request GET") for record in caplog.records)
+
+
+def test_repeated_statements_are_logged(client, stats, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, "N_PLUS_ONE_THRESHOLD", 3)
+    statement = "SELECT * FROM bid WHERE auction_id = ?"
+    with app.test_request_context("/api/data/auctions"), caplog.at_level(logging.WARNING, logger=app.logger.name):
+        app.preprocess_request()
+        g.request_metrics.statements[statement] += 3
+        app.process_response(app.response_class())
+
+    assert stats()["data_auctions"]["n_plus_one"] == 1
+    assert [record.message for record in caplog.records if "N+1" in record.message] == [
+        f"Likely N+1 query in data_auctions, executed 3 times: {statement}"]
+
+
+def test_disabled(client, stats, monkeypatch):
+    monkeypatch.setitem(app.config, "INSTRUMENTATION_ENABLED", False)
+    client.get(URL)
+    assert stats() == {}
@@ -0,0 +1,41 @@
+"""
+/metrics is served to a scraper with the METRICS_TOKEN bearer token or to a logged in
+admin, not to whoever connects from the address of the reverse proxy.
+"""
+import pytest
+
+from najlepsiaponuka.app import app
+from najlepsiaponuka.models import UserType
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "scraper-secret")
+    return "scraper-secret"
+
+
+def test_request_from_the_proxy_address_is_refused(client, token):
+    response = client.get("/metrics", environ_base={"REMOTE_ADDR": "127.0.0.1"})
+    assert response.status_code == 404
+
+
+def test_scraper_with_the_token_reads_the_metrics(client, token):
+    response = client.get("/metrics", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+
+@pytest.mark.parametrize("authorization", ["Bearer wrong", "Bearer ", "Basic c2NyYXBlcjpzZWNyZXQ="])
+def test_wrong_token_is_refused(client, token, authorization):
+    assert client.get("/metrics", headers={"Authorization": authorization}).status_code == 404
+
+
+def test_any_token_is_refused_when_none_is_configured(client, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", None)
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
+
+
+@pytest.mark.parametrize("type, status", [(UserType.ADMIN, 200), (UserType.AUCTIONEER, 404), (UserType.BASIC, 404)])
+def test_only_admins_read_the_metrics(client, make_user, log_in, type, status):
+    log_in(client, make_user("user", type).email)
+    assert client.get("/metrics").status_code == status
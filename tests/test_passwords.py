@@ -0,0 +1,93 @@
+"""
+A busy password service shows the form again instead of failing the request, and its slots
+are shared by all processes of the host.
+"""
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import najlepsiaponuka.app
+from najlepsiaponuka import db
+from najlepsiaponuka.app import app
+from najlepsiaponuka.forms import PASSWORD_SERVICE_BUSY
+from najlepsiaponuka.models import User, UserType
+from najlepsiaponuka.passwords import HostSlots, PasswordServiceBusy
+
+
+def test_slot_is_taken_until_released(tmp_path):
+    slots = HostSlots(str(tmp_path), 1)
+    assert slots.acquire(timeout=0)
+    other = []
+    thread = threading.Thread(target=lambda: other.append(slots.acquire(timeout=0.05)))
+    thread.start()
+    thread.join()
+    assert other == [False]
+    slots.release()
+    assert slots.acquire(timeout=0)
+    slots.release()
+
+
+def test_slot_of_another_process_is_released_when_it_dies(tmp_path):
+    holder = subprocess.Popen([sys.executable, "-c", f"""
+import fcntl, os, sys, time
+fd = os.open({str(tmp_path / "slot0")!r}, os.O_RDWR | os.O_CREAT)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print("locked", flush=True)
+time.sleep(60)
+"""], stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        slots = HostSlots(str(tmp_path), 1)
+        assert not slots.acquire(timeout=0.05)
+        holder.kill()
+        holder.wait()
+        assert slots.acquire(timeout=5)
+        slots.release()
+    finally:
+        holder.kill()
+        holder.stdout.close()
+
+
+@pytest.fixture
+def busy(client, monkeypatch):
+    """Makes the password service busy, renders the errors of the form instead of templates."""
+
+    def hash_password(password):
+        raise PasswordServiceBusy()
+
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    monkeypatch.setattr(najlepsiaponuka.app, "hash_password", hash_password)
+    monkeypatch.setattr(najlepsiaponuka.forms, "check_password", lambda hashed, password: True)
+    monkeypatch.setattr(najlepsiaponuka.app, "render_template",
+                        lambda template, form=None, **context: {"errors": form.errors if form else None})
+
+
+def test_register_shows_the_form_again(client, busy):
+    response = client.post("/auth/register", data={"email": "new@test.xyz", "password": "secret1",
+                                                  "password_confirm": "secret1"})
+    assert response.status_code == 200
+    assert response.get_json()["errors"] == {"password": [PASSWORD_SERVICE_BUSY]}
+    assert User.query.filter_by(email="new@test.xyz").first() is None
+
+
+def test_update_profile_leaves_the_user_unchanged(client, busy, make_user, log_in):
+    log_in(client, make_user("user").email)
+    response = client.post("/updateProfile", data={"name": "renamed", "password": "secret1",
+                                                   "password_confirm": "current"})
+    assert response.status_code == 200
+    assert response.get_json()["errors"] == {"password": [PASSWORD_SERVICE_BUSY]}
+    db.session.expire_all()
+    assert User.query.filter_by(email="user@test.xyz").one().name == "user"
+
+
+def test_manage_user_leaves_the_user_unchanged(client, busy, make_user, log_in):
+    user = make_user("user")
+    log_in(client, make_user("admin", UserType.ADMIN).email)
+    response = client.post(f"/admin/user/profile?id={user.user_id}",
+                           data={"type": "admin", "password": "secret1", "password_confirm": "current"})
+    assert response.status_code == 200
+    assert response.get_json()["errors"] == {"password": [PASSWORD_SERVICE_BUSY]}
+    db.session.expire_all()
+    assert User.query.get(user.user_id).type == UserType.BASIC
@@ -0,0 +1,111 @@
+"""
+Proxy bids of open auctions. The closed form resolution of bidding.resolve_proxies must
+place the same last bids as a naive simulation placing one bid per minimal_bid step, on
+random sequences of proxy and manual bids, and only the proxies of users whose
+registration is allowed bid.
+"""
+import random
+from decimal import Decimal
+
+import pytest
+
+from najlepsiaponuka import db
+from najlepsiaponuka.bidding import place_bid, place_proxy_bid, resolve_proxies
+from najlepsiaponuka.models import Auction, AuctionRegistration, AuctionRegistrationState, AuctionType, Bid
+
+SCENARIOS = 500
+EVENTS = 30
+
+
+def simulate(price, has_bid, leader_id, step, proxies, offer):
+    """One bid at a time: the strongest proxy of another user than the leader bids the lowest acceptable price."""
+    sign = 1 if offer else -1
+    bids = []
+    while True:
+        lowest = price + sign * step if has_bid else price
+        candidates = [proxy for proxy in proxies if proxy[0] != leader_id and sign * (proxy[1] - lowest) >= 0]
+        if not candidates:
+            return bids
+        # proxies are ordered from the strongest
+        leader_id, price, has_bid = candidates[0][0], lowest, True
+        bids.append((leader_id, price))
+
+
+def ordered(proxies, offer):
+    """Proxies as (creator_id, price_limit) from the strongest, the earlier one of equal limits first."""
+    sign = 1 if offer else -1
+    return [(creator_id, limit) for creator_id, (limit, order) in
+            sorted(proxies.items(), key=lambda item: (-sign * item[1][0], item[1][1]))]
+
+
+def scenario(rnd):
+    """Yields the expected last bids and those of the closed form after each bid of a random sequence."""
+    offer = rnd.random() < 0.5
+    sign = 1 if offer else -1
+    step = Decimal(rnd.choice(["0.01", "1", "5", "0.5"]))
+    price = Decimal(rnd.randint(100, 1000))
+    has_bid, leader_id = False, None
+    proxies = {}
+    for order in range(EVENTS):
+        user_id = rnd.randint(1, 6)
+        lowest = price + sign * step if has_bid else price
+        amount = lowest + sign * step * rnd.randint(0, 40) + sign * Decimal(rnd.randint(0, 99)) / 100
+        if rnd.random() < 0.6:
+            proxies[user_id] = (amount, order)
+        else:
+            leader_id, price, has_bid = user_id, amount, True
+
+        strongest = ordered(proxies, offer)
+        bids = resolve_proxies(price, has_bid, leader_id, step, strongest[:2], offer)
+        yield simulate(price, has_bid, leader_id, step, strongest, offer)[-2:], bids
+        if bids:
+            leader_id, price, has_bid = bids[-1][0], bids[-1][1], True
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_closed_form_matches_the_simulation(seed):
+    rnd = random.Random(seed)
+    for _ in range(SCENARIOS // 4):
+        for expected, bids in scenario(rnd):
+            assert bids == expected
+
+
+@pytest.fixture
+def bidders(make_user):
+    return [make_user(f"bidder{i}") for i in range(3)]
+
+
+def bids_of(auction_id):
+    return [(bid.creator_id, bid.price) for bid in Bid.query.filter_by(auction_id=auction_id).order_by(Bid.bid_id)]
+
+
+@pytest.mark.parametrize("type", [AuctionType.OFFER, AuctionType.DEMAND])
+def test_proxies_answer_a_bid_in_closed_form(make_user, make_auction, bidders, type):
+    sign = 1 if type == AuctionType.OFFER else -1
+    auction_id = make_auction(make_user("seller"), bidders, type=type, minimal_bid=Decimal(5)).auction_id
+    first, second, manual = bidders
+    assert place_proxy_bid(auction_id, first, 100 + sign * 40).accepted
+    assert place_proxy_bid(auction_id, second, 100 + sign * 27).accepted
+    result = place_bid(auction_id, manual, Decimal(100 + sign * 5))
+
+    expected = resolve_proxies(Decimal(100 + sign * 5), True, manual.user_id, Decimal(5),
+                               [(first.user_id, 100 + sign * 40), (second.user_id, 100 + sign * 27)], sign == 1)
+    assert bids_of(auction_id)[-2:] == expected
+    # the proxy with the better limit ends up leading
+    assert expected[-1][0] == first.user_id
+    assert not result.leading
+    auction = Auction.query.get(auction_id)
+    assert (auction.price, auction.leading_bidder_id) == (expected[-1][1], first.user_id)
+
+
+@pytest.mark.parametrize("state", [AuctionRegistrationState.FORBIDDEN, AuctionRegistrationState.CREATED])
+def test_proxy_of_a_registration_no_longer_allowed_does_not_bid(make_user, make_auction, bidders, state):
+    auction_id = make_auction(make_user("seller"), bidders).auction_id
+    proxy, manual = bidders[0], bidders[1]
+    assert place_proxy_bid(auction_id, proxy, Decimal(200)).accepted
+    AuctionRegistration.query.filter_by(auction_id=auction_id, creator_id=proxy.user_id).update({"state": state})
+    db.session.commit()
+
+    result = place_bid(auction_id, manual, Decimal(110))
+    assert result.accepted and result.leading
+    assert bids_of(auction_id)[-1] == (manual.user_id, 110)
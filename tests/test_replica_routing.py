@@ -0,0 +1,78 @@
+"""
+Routing of RoutingSession between two SQLite files standing in for the primary and the
+replica: read-only views read the replica, writes and the reads of a client which has just
+written go to the primary.
+"""
+import datetime
+
+import pytest
+
+from najlepsiaponuka import db, identity
+from najlepsiaponuka.app import app
+from najlepsiaponuka.models import Auction, AuctionCategory, AuctionRegistration, AuctionRegistrationState, \
+    AuctionRules, AuctionState, AuctionType, Bid, User, UserType
+
+AUCTIONS = "/api/data/auctions?draw=1&start=0&length=10"
+
+
+@pytest.fixture
+def routed_client(tmp_path, monkeypatch):
+    """Test client of a primary and a replica with the same auction under different titles."""
+    monkeypatch.setitem(app.config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setitem(app.config, "SQLALCHEMY_BINDS", {"replica": f"sqlite:///{tmp_path / 'replica.db'}"})
+    monkeypatch.setitem(app.config, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setitem(app.config, "REPLICA_READ_AFTER_WRITE", 5)
+    with app.app_context():
+        for bind in (None, "replica"):
+            engine = db.get_engine(app, bind=bind)
+            db.Model.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(User.__table__.insert(), {"user_id": 1, "type": UserType.BASIC, "name": "bidder",
+                                                             "email": "bidder@test.xyz", "password": ""})
+                connection.execute(Auction.__table__.insert(), {
+                    "auction_id": 1, "title": bind or "primary", "description": "Auction of a test", "price": 100,
+                    "start_price": 100, "minimal_bid": 1, "rules": AuctionRules.OPEN, "type": AuctionType.OFFER,
+                    "state": AuctionState.ACTIVE, "category": AuctionCategory.OTHERS, "creator_id": 1,
+                    "creation_timestamp": datetime.datetime.now()})
+                connection.execute(AuctionRegistration.__table__.insert(), {
+                    "auction_id": 1, "creator_id": 1, "state": AuctionRegistrationState.ALLOWED})
+        yield app.test_client()
+        db.session.remove()
+    identity.identity_cache.clear()
+
+
+def served(client):
+    response = client.get(AUCTIONS)
+    assert response.status_code == 200
+    # the title tells the database apart
+    return [auction["title"] for auction in response.get_json()["data"]]
+
+
+def test_read_only_view_reads_the_replica(routed_client):
+    assert served(routed_client) == ["replica"]
+
+
+def test_without_replica_everything_reads_the_primary(routed_client, monkeypatch):
+    monkeypatch.setitem(app.config, "SQLALCHEMY_BINDS", {})
+    assert served(routed_client) == ["primary"]
+
+
+def test_write_goes_to_the_primary_and_is_read_back_from_it(routed_client, log_in, monkeypatch):
+    log_in(routed_client, "bidder@test.xyz")
+    assert routed_client.post("/api/auctionBid/1", json={"price": "150"}).status_code == 200
+    for bind, bids in ((None, 1), ("replica", 0)):
+        with db.get_engine(app, bind=bind).connect() as connection:
+            assert len(connection.execute(Bid.__table__.select()).fetchall()) == bids
+
+    # the bidder reads from the primary, which has its bid
+    assert served(routed_client) == ["primary"]
+    # and the replica again once REPLICA_READ_AFTER_WRITE passed
+    monkeypatch.setitem(app.config, "REPLICA_READ_AFTER_WRITE", 0)
+    assert served(routed_client) == ["replica"]
+
+
+def test_other_clients_keep_reading_the_replica(routed_client, log_in):
+    log_in(routed_client, "bidder@test.xyz")
+    routed_client.post("/api/auctionBid/1", json={"price": "150"})
+    with app.test_client() as other:
+        assert served(other) == ["replica"]
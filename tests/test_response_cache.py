@@ -0,0 +1,78 @@
+"""
+The response cache of the auction catalog: pages are served from the cache until a change
+of auctions bumps the generation, revalidation gets 304, logged in users get their own
+variant.
+"""
+import pytest
+
+from najlepsiaponuka.app import app
+from najlepsiaponuka import response_cache
+from najlepsiaponuka.models import AuctionCategory
+
+URL = "/api/data/auctions?start=0&length=10"
+
+
+@pytest.fixture
+def cache(client, monkeypatch):
+    monkeypatch.setitem(app.config, "RESPONSE_CACHE_ENABLED", True)
+    # the entries of other tests belong to an older generation
+    response_cache.invalidate()
+
+
+def titles(response):
+    assert response.status_code == 200
+    return sorted(auction["title"] for auction in response.get_json()["data"])
+
+
+def test_served_from_cache_until_invalidated(client, cache, make_user, make_auction):
+    seller = make_user("seller")
+    make_auction(seller, title="First", category=AuctionCategory.OTHERS)
+    assert titles(client.get(f"{URL}&draw=1")) == ["First"]
+
+    make_auction(seller, title="Second", category=AuctionCategory.OTHERS)
+    response = client.get(f"{URL}&draw=2")
+    assert titles(response) == ["First"]
+    # the cached page answers the draw of the request
+    assert response.get_json()["draw"] == 2
+
+    response_cache.invalidate()
+    assert titles(client.get(f"{URL}&draw=3")) == ["First", "Second"]
+
+
+def test_unchanged_page_is_not_modified(client, cache):
+    etag = client.get(URL).headers["ETag"]
+    response = client.get(URL, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_bid_invalidates(client, cache, make_user, make_auction, log_in):
+    bidder = make_user("bidder")
+    auction = make_auction(make_user("seller"), bidders=[bidder], category=AuctionCategory.OTHERS)
+    log_in(client, bidder.email)
+    hits = response_cache.stats()["hits"]
+    client.get(URL)
+    client.get(URL)
+    before = response_cache.stats()
+    assert before["hits"] == hits + 1
+
+    assert client.post(f"/api/auctionBid/{auction.auction_id}", json={"price": "150"}).get_json()["accepted"]
+    client.get(URL)
+
+    after = response_cache.stats()
+    assert after["invalidations"] == before["invalidations"] + 1
+    # the page is rendered again, not served from the entry of the older generation
+    assert (after["hits"], after["misses"]) == (before["hits"], before["misses"] + 1)
+
+
+def test_users_get_their_own_variant(client, cache, make_user, make_auction, log_in):
+    seller = make_user("seller")
+    make_auction(seller, category=AuctionCategory.OTHERS)
+    anonymous = client.get(URL)
+    assert anonymous.get_json()["data"][0]["registered"] == "neregistrovaný"
+    assert anonymous.cache_control.public
+
+    log_in(client, seller.email)
+    own = client.get(URL)
+    assert own.get_json()["data"][0]["registered"] == "moja aukcia"
+    assert own.cache_control.private
@@ -0,0 +1,123 @@
+"""
+The auction scheduler driven by a fake clock: CONFIRMED auctions start and ACTIVE ones
+close on time, bids in the soft close window postpone the closing, and the winner is the
+leader the auction showed.
+"""
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from najlepsiaponuka import db
+from najlepsiaponuka.app import app
+from najlepsiaponuka.bidding import place_bid
+from najlepsiaponuka.models import Auction, AuctionState
+from najlepsiaponuka.scheduler import AuctionScheduler, DeadlineQueue
+
+START = datetime.datetime(2026, 1, 1, 12)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+
+
+def test_deadline_queue_pops_due_auctions_in_order():
+    queue = DeadlineQueue()
+    for auction_id, seconds in ((1, 30), (2, 10), (3, 20), (4, 40)):
+        queue.set(auction_id, START + datetime.timedelta(seconds=seconds))
+    # a replaced deadline is skipped, not popped twice
+    queue.set(3, START + datetime.timedelta(seconds=50))
+    queue.discard(4)
+
+    assert queue.next_deadline() == START + datetime.timedelta(seconds=10)
+    assert queue.pop_due(START + datetime.timedelta(seconds=35), limit=1) == [2]
+    assert queue.pop_due(START + datetime.timedelta(seconds=35), limit=10) == [1]
+    assert len(queue) == 1 and 3 in queue and 4 not in queue
+    assert queue.pop_due(START + datetime.timedelta(seconds=60), limit=10) == [3]
+    assert queue.next_deadline() is None
+
+
+def test_deadline_queue_compacts_replaced_entries():
+    queue = DeadlineQueue()
+    for seconds in range(1000):
+        queue.set(1, START + datetime.timedelta(seconds=seconds))
+    assert len(queue._heap) <= 2 * len(queue) + 64
+    assert queue.pop_due(START + datetime.timedelta(hours=1), limit=10) == [1]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(START)
+
+
+@pytest.fixture
+def scheduler(client, clock, monkeypatch):
+    monkeypatch.setitem(app.config, "SOFT_CLOSE_WINDOW", 60)
+    monkeypatch.setitem(app.config, "SOFT_CLOSE_EXTENSION", 60)
+    # no resync in the tests, it would read the deadlines moved by bids
+    return AuctionScheduler(clock=clock, batch_size=2, resync_interval=3600)
+
+
+def state_of(auction_id):
+    db.session.expire_all()
+    return Auction.query.get(auction_id)
+
+
+def test_auctions_start_and_close_on_time(scheduler, clock, make_user, make_auction):
+    seller = make_user("seller")
+    confirmed = [make_auction(seller, state=AuctionState.CONFIRMED, start_date=START + datetime.timedelta(minutes=1),
+                              end_date=START + datetime.timedelta(minutes=10)).auction_id for _ in range(3)]
+    assert scheduler.tick() == (0, 0)
+
+    clock.advance(60)
+    # more than a batch
+    assert scheduler.tick() == (3, 0)
+    assert {state_of(auction_id).state for auction_id in confirmed} == {AuctionState.ACTIVE}
+
+    clock.advance(8 * 60)
+    assert scheduler.tick() == (0, 0)
+    clock.advance(60)
+    assert scheduler.tick() == (0, 3)
+    assert {state_of(auction_id).state for auction_id in confirmed} == {AuctionState.CLOSED}
+
+
+def test_late_bid_postpones_the_closing(scheduler, clock, make_user, make_auction):
+    bidder = make_user("bidder")
+    auction_id = make_auction(make_user("seller"), [bidder], end_date=START + datetime.timedelta(minutes=5)).auction_id
+    scheduler.tick()
+
+    clock.advance(4 * 60 + 30)
+    assert place_bid(auction_id, bidder, Decimal(110), timestamp=clock()).accepted
+    clock.advance(30)
+    # the queue still holds the first deadline, the auction is popped and requeued with the new one
+    assert scheduler.tick() == (0, 1)
+    assert scheduler.deadlines.next_deadline() == START + datetime.timedelta(minutes=5, seconds=30)
+    assert state_of(auction_id).state == AuctionState.ACTIVE
+
+    clock.advance(30)
+    scheduler.tick()
+    auction = state_of(auction_id)
+    assert (auction.state, auction.winner_id, auction.price) == (AuctionState.CLOSED, bidder.user_id, 110)
+
+
+def test_winner_of_equal_bids_is_the_leader(scheduler, clock, make_user, make_auction):
+    first, second = make_user("first"), make_user("second")
+    auction_id = make_auction(make_user("seller"), [first, second], minimal_bid=Decimal(0),
+                              end_date=START + datetime.timedelta(minutes=5)).auction_id
+    scheduler.tick()
+    assert place_bid(auction_id, first, Decimal(120), timestamp=START).accepted
+    # minimal_bid 0 accepts a bid matching the price, its bidder leads
+    assert place_bid(auction_id, second, Decimal(120), timestamp=START + datetime.timedelta(seconds=1)).leading
+    assert state_of(auction_id).leading_bidder_id == second.user_id
+
+    clock.advance(5 * 60)
+    scheduler.tick()
+    auction = state_of(auction_id)
+    assert (auction.state, auction.winner_id, auction.price) == (AuctionState.CLOSED, second.user_id, 120)
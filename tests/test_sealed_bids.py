@@ -0,0 +1,118 @@
+"""
+Sealed bids of auctions with AuctionRules.CLOSED: one bid per user, the best one wins and
+the earlier one wins a tie, they are revealed when the auction closes.
+"""
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from najlepsiaponuka import db
+from najlepsiaponuka.bidding import BidRejection, place_bid, reveal_sealed_bids, winning_bids
+from najlepsiaponuka.export import export_bids
+from najlepsiaponuka.models import Auction, AuctionRules, AuctionState, AuctionType, Bid, SealedBid
+from najlepsiaponuka.scheduler import close_auctions
+
+NOW = datetime.datetime(2026, 1, 1, 12)
+
+
+@pytest.fixture
+def bidders(make_user):
+    return [make_user(f"bidder{i}") for i in range(3)]
+
+
+@pytest.fixture
+def sealed_auction(make_user, make_auction, bidders):
+    seller = make_user("seller")
+
+    def sealed_auction(type=AuctionType.OFFER):
+        return make_auction(seller, bidders, rules=AuctionRules.CLOSED, type=type).auction_id
+
+    return sealed_auction
+
+
+def add_sealed_bids(auction_id, *bids):
+    """Adds sealed bids given as (bidder, price, seconds after NOW)."""
+    for bidder, price, seconds in bids:
+        db.session.add(SealedBid(auction_id=auction_id, creator_id=bidder.user_id, price=Decimal(price),
+                                 timestamp=NOW + datetime.timedelta(seconds=seconds)))
+    db.session.commit()
+
+
+@pytest.mark.parametrize("type, winner, price", [(AuctionType.OFFER, 1, 150), (AuctionType.DEMAND, 0, 90)])
+def test_best_sealed_bid_wins(sealed_auction, bidders, type, winner, price):
+    auction_id = sealed_auction(type)
+    add_sealed_bids(auction_id, (bidders[0], 90, 0), (bidders[1], 150, 1), (bidders[2], 120, 2))
+    assert winning_bids([auction_id]) == {auction_id: (bidders[winner].user_id, price)}
+
+
+def test_earlier_sealed_bid_wins_a_tie(sealed_auction, bidders):
+    auction_id = sealed_auction()
+    add_sealed_bids(auction_id, (bidders[0], 150, 2), (bidders[1], 150, 1), (bidders[2], 120, 0))
+    assert winning_bids([auction_id]) == {auction_id: (bidders[1].user_id, 150)}
+
+
+def test_lower_id_wins_a_tie_at_the_same_time(sealed_auction, bidders):
+    auction_id = sealed_auction()
+    add_sealed_bids(auction_id, (bidders[2], 150, 0), (bidders[0], 150, 0))
+    assert winning_bids([auction_id]) == {auction_id: (bidders[2].user_id, 150)}
+
+
+def test_winners_of_many_auctions_are_found_together(sealed_auction, bidders):
+    offer, demand = sealed_auction(AuctionType.OFFER), sealed_auction(AuctionType.DEMAND)
+    add_sealed_bids(offer, (bidders[0], 110, 0), (bidders[1], 130, 1))
+    add_sealed_bids(demand, (bidders[0], 80, 0), (bidders[1], 70, 1))
+    assert winning_bids([offer, demand]) == {offer: (bidders[1].user_id, 130), demand: (bidders[1].user_id, 70)}
+
+
+def test_reveal_sets_the_bid_count_of_sealed_auctions_only(sealed_auction, bidders, make_auction):
+    sealed = sealed_auction()
+    add_sealed_bids(sealed, (bidders[0], 110, 0), (bidders[1], 130, 1))
+    open_auction = make_auction(bidders[2], bid_count=5).auction_id
+    reveal_sealed_bids([sealed, open_auction])
+    db.session.commit()
+    db.session.expire_all()
+    assert Auction.query.get(sealed).bid_count == 2
+    assert Auction.query.get(open_auction).bid_count == 5
+
+
+def test_second_bid_of_a_user_is_rejected(sealed_auction, bidders):
+    auction_id = sealed_auction()
+    assert place_bid(auction_id, bidders[0], Decimal(120)).accepted
+    result = place_bid(auction_id, bidders[0], Decimal(200))
+    assert not result.accepted
+    assert result.rejection == BidRejection.ALREADY_BID
+    assert [(bid.creator_id, bid.price) for bid in SealedBid.query] == [(bidders[0].user_id, 120)]
+    # the public price stays hidden
+    assert Auction.query.get(auction_id).price == 100
+    assert place_bid(auction_id, bidders[1], Decimal(110)).accepted
+
+
+def test_closing_reveals_the_winner(sealed_auction, bidders):
+    auction_id = sealed_auction()
+    add_sealed_bids(auction_id, (bidders[0], 110, 0), (bidders[1], 130, 1))
+    assert close_auctions([auction_id]) == [auction_id]
+    db.session.commit()
+    db.session.expire_all()
+    auction = Auction.query.get(auction_id)
+    assert (auction.state, auction.winner_id, auction.price, auction.bid_count) == \
+           (AuctionState.CLOSED, bidders[1].user_id, 130, 2)
+
+
+def test_export_includes_sealed_bids_of_closed_auctions(sealed_auction, bidders, make_auction):
+    closed, running = sealed_auction(), sealed_auction()
+    add_sealed_bids(closed, (bidders[0], 110, 1), (bidders[1], 130, 3))
+    add_sealed_bids(running, (bidders[0], 500, 2))
+    open_auction = make_auction(bidders[2]).auction_id
+    db.session.add(Bid(auction_id=open_auction, creator_id=bidders[0].user_id, price=101,
+                       timestamp=NOW + datetime.timedelta(seconds=2)))
+    db.session.commit()
+    close_auctions([closed])
+    db.session.commit()
+
+    # a batch of one row, so the rows of both tables are merged across batches
+    rows = [json.loads(line) for chunk in export_bids("ndjson", batch_size=1) for line in chunk.splitlines()]
+    assert [(row["auction_id"], row["price"], row["sealed"]) for row in rows] == \
+           [(closed, "110.00", True), (open_auction, "101.00", False), (closed, "130.00", True)]
+    assert "".join(export_bids("ndjson", auction_id=running)) == ""
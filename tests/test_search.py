@@ -0,0 +1,75 @@
+"""
+Search of /api/data/auctions through the search_term index: words are folded, match as
+prefixes and all of them have to match, the facets count the matching auctions.
+"""
+from najlepsiaponuka import db, search
+from najlepsiaponuka.models import Auction, AuctionCategory, AuctionType, SearchTerm
+
+
+def test_terms_are_folded_and_short_words_skipped():
+    assert search.terms("Nábytok: STOLIČKA a stôl") == {"nabytok", "stolicka", "stol"}
+    assert search.terms("") == set()
+
+
+def add_auction(make_auction, creator, title, description="", **columns):
+    columns.setdefault("category", AuctionCategory.OTHERS)
+    auction = make_auction(creator, title=title, description=description, **columns)
+    search.index_auction(auction)
+    db.session.commit()
+    return auction.auction_id
+
+
+def titles(text):
+    return sorted(auction.title for auction in search.match(Auction.query, text))
+
+
+def test_match_needs_every_word_as_prefix(client, make_user, make_auction):
+    seller = make_user("seller")
+    add_auction(make_auction, seller, "Drevená stolička", "Stolička do kuchyne")
+    add_auction(make_auction, seller, "Kuchynský stôl", "Stôl s dvomi stoličkami")
+    add_auction(make_auction, seller, "Bicykel")
+
+    assert titles("stol") == ["Drevená stolička", "Kuchynský stôl"]
+    assert titles("DREVENA") == ["Drevená stolička"]
+    assert titles("stol kuchyn") == ["Drevená stolička", "Kuchynský stôl"]
+    assert titles("stol bicykel") == []
+    # no word long enough to be indexed
+    assert titles("a") == []
+
+
+def test_index_follows_edits(client, make_user, make_auction):
+    seller = make_user("seller")
+    auction_id = add_auction(make_auction, seller, "Bicykel")
+    auction = Auction.query.get(auction_id)
+    auction.title = "Kolobežka"
+    search.index_auction(auction)
+    db.session.commit()
+
+    assert titles("bicykel") == []
+    assert titles("kolobezka") == ["Kolobežka"]
+
+
+def test_rebuild_index(client, make_user, make_auction):
+    seller = make_user("seller")
+    for i in range(5):
+        make_auction(seller, title=f"Lampa {i}", description="Stolová lampa", category=AuctionCategory.OTHERS)
+
+    assert search.rebuild_index(batch_size=2) == 5
+    assert len(titles("lampa")) == 5
+    assert SearchTerm.query.filter_by(term="stolova").count() == 5
+
+
+def test_data_auctions_search_with_facets(client, make_user, make_auction):
+    seller = make_user("seller")
+    add_auction(make_auction, seller, "Auto Škoda", category=AuctionCategory.CAR)
+    add_auction(make_auction, seller, "Auto na diely", category=AuctionCategory.CAR, type=AuctionType.DEMAND)
+    add_auction(make_auction, seller, "Autosedačka")
+    add_auction(make_auction, seller, "Bicykel")
+
+    response = client.get("/api/data/auctions?draw=1&start=0&length=10&search[value]=auto&facets=1")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted(auction["title"] for auction in body["data"]) == ["Auto na diely", "Auto Škoda", "Autosedačka"]
+    assert body["facets"]["category"] == {str(AuctionCategory.CAR): 2, str(AuctionCategory.OTHERS): 1}
+    assert body["facets"]["type"] == {str(AuctionType.OFFER): 2, str(AuctionType.DEMAND): 1}
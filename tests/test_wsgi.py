@@ -0,0 +1,20 @@
+"""
+wsgi.create_app returns the one application of the package, it does not build a new one
+per call, so it refuses to configure it differently a second time.
+"""
+import pytest
+
+import wsgi
+
+
+def test_every_call_returns_the_same_application():
+    assert wsgi.create_app() is wsgi.app
+    assert wsgi.create_app() is wsgi.app
+
+
+def test_other_settings_are_refused(tmp_path):
+    settings = tmp_path / "settings.py"
+    settings.write_text("RESPONSE_CACHE_TTL = 1\n")
+    with pytest.raises(RuntimeError):
+        wsgi.create_app(str(settings))
+    assert wsgi.app.config.get("RESPONSE_CACHE_TTL") != 1
@@ -0,0 +1,73 @@
+"""
+WSGI entry point of the production server, started with
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+run.py starts the development server instead.
+"""
+import os
+
+from flask import Flask
+
+# settings file of the first create_app() call, which configured the application
+_config_file = None
+_created = False
+
+
+def create_app(config_file=None):
+    """
+    Returns the application with its views, CLI commands and request hooks registered.
+
+    It is not an application factory: the modules of the package register their views and
+    hooks on the application of najlepsiaponuka when they are imported, so every call
+    returns that same application. Only the first call configures it, a later call asking
+    for another settings file raises RuntimeError instead of changing the application of the
+    earlier callers.
+    :param config_file: settings overriding instance/config.py, NAJLEPSIAPONUKA_SETTINGS by default
+    """
+    global _config_file, _created
+    import najlepsiaponuka
+
+    app = najlepsiaponuka.app
+    if not isinstance(app, Flask):
+        # the module of the views replaced the attribute of the package when it was imported
+        app = app.app
+    config_file = config_file or os.environ.get("NAJLEPSIAPONUKA_SETTINGS")
+    config_file = os.path.abspath(config_file) if config_file else None
+    if _created:
+        if config_file not in (None, _config_file):
+            raise RuntimeError(f"The application is configured with {_config_file} already.")
+        return app
+    if config_file:
+        # before the modules below read their settings
+        app.config.from_pyfile(config_file)
+    app.debug = False
+
+    import najlepsiaponuka.app  # noqa: F401
+    _config_file, _created = config_file, True
+    return app
+
+
+def after_fork():
+    """Prepares a worker forked from a preloaded master."""
+    from najlepsiaponuka import db, metrics
+
+    # connections opened by the master must not be shared with the workers
+    db.engine.dispose()
+    # threads do not survive fork
+    metrics.registry.start()
+
+
+def shutdown(timeout=30):
+    """Finishes the bids being placed and stops the worker pools of a worker which exits."""
+    from najlepsiaponuka import bidding, db, images, metrics, passwords
+
+    if not bidding.drain(timeout):
+        app.logger.warning(f"Bids still being placed after {timeout} s of shutdown.")
+    passwords.password_service.shutdown()
+    images.shutdown()
+    metrics.registry.flush()
+    db.engine.dispose()
+
+
+app = create_app()